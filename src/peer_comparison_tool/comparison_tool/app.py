@@ -5,7 +5,8 @@ from dash.dependencies import Input, Output
 import dash_bootstrap_components as dbc
 from typing import Dict, Any
 
-from .biggest_winners_and_losers import get_biggest_winners_and_losers_page_layout, register_winners_and_losers_callback
+from .biggest_winners_and_losers import get_biggest_winners_and_losers_page_layout, register_winners_and_losers_callback, \
+    RECENT_PRICE_DAYS
 # from .layout import create_container
 from .landing_page import get_landing_page_layout_v2, register_landing_page_data_callbacks
 from .comparison_page import get_comparison_page_layout, register_comparison_callbacks
@@ -18,9 +19,16 @@ from .styles import colors
 
 from src.peer_comparison_tool.data.queries import get_table_data_query
 from src.peer_comparison_tool.data.db_utils import fetch_table_data
+from src.peer_comparison_tool.data.columnar import fetch_time_series, fetch_price_history
+from src.peer_comparison_tool.data.db import read_connection
+from src.peer_comparison_tool.data.transform import QFINANCIAL_TABLE_COLS, BALANCE_SHEET_TABLE_COLS, \
+    RECENT_METRICS_TABLE_COLS, COMPANY_INFO_TABLE_COLS, CASHFLOW_TABLE_COLS
 
 
-def create_app(db_conn):
+def create_app(db_conn, columnar_dir=None):
+    # db_conn: a ConnectionManager (reads use its read-only pool) or a sqlite connection
+    # columnar_dir: the Arrow copy of the time series tables (data/columnar.py), mapped instead of read when current.
+    # The price histories older than the daily rows kept are read as weekly or monthly bars (data/retention.py)
     # TODO remove:
     # (ticker_series_data: Dict[str, Any], data: pd.DataFrame, qfin_data: pd.DataFrame, bs_data: pd.DataFrame,
     # qfin_map: Dict[str, pd.DataFrame], bs_map: Dict[str, pd.DataFrame], cashflow_map: Dict[str, pd.DataFrame]
@@ -37,68 +45,89 @@ def create_app(db_conn):
         html.Div(id='page-content', style={'backgroundColor': colors['background']})
     ])
 
-    # TODO abstract this data prelims away from this function
-    economic_data = fetch_table_data(db_conn, 'asset_class_time_series')
-
-    # Retrieve data from connection:  # TODO only retrieve what we need, do this later.
-    snapshot_recent_metrics = fetch_table_data(db_conn, 'ticker_most_recent_metric_data')
-    company_info = fetch_table_data(db_conn, 'company_info')
-    snapshot_recent_metrics = pd.merge(snapshot_recent_metrics, company_info, on='ticker', how='left')
-    # TODO move this elsewhere:
-    snapshot_recent_metrics['market_cap_MM'] = snapshot_recent_metrics['market_cap'].clip(lower=1) / 1_000_000
-    data_cluster = fetch_table_data(sql_conn=db_conn, table_name='cluster_table', most_recent=True)
-    data_cluster.rename(columns={"cluster_membership": "label"}, inplace=True)
-    snapshot_recent_metrics = pd.merge(snapshot_recent_metrics, data_cluster[['ticker', 'label']], on=['ticker'])
-    # snapshot_recent_metrics = pd.read_sql_query(sql=get_table_data_query, con=db_conn, params=['ticker_most_recent_metric_data'])
-    # we can calculate EV here from stock_price X number of shareholds
-    latest_ev_data = snapshot_recent_metrics[['ticker', 'enterprise_value']].set_index(keys='ticker')
-
-    # Create the home page data:
-    ticker_series_data = fetch_table_data(db_conn, 'ticker_time_series')
-    ticker_series_data = pd.merge(ticker_series_data, company_info, on='ticker', how='left')
-    ticker_metric_yoy_data = fetch_table_data(db_conn, 'ticker_metrics_yoy')
-    ticker_metric_yoy_data = pd.merge(ticker_metric_yoy_data, company_info, on='ticker', how='left')
-    ticker_series_yoy_data = fetch_table_data(db_conn, 'ticker_ts_yoy')
-    ticker_series_data = pd.merge(ticker_series_data, ticker_series_yoy_data, on=['ticker', 'date'], how='left')
-    ticker_series_data.sort_values(by=['ticker', 'date'], ascending=True, inplace=True)
-    ticker_metric_yoy_data.sort_values(by=['ticker', 'date'], ascending=True, inplace=True)
-
-    # ticker_series_data = pd.read_sql_query(sql=get_table_data_query, con=db_conn, params=['ticker_time_series'])
-    # And the industry_series_data (aggregated from ticker data)
-
-    industry_series_data = fetch_table_data(db_conn, 'industry_time_series')
-    industry_series_yoy_data = fetch_table_data(db_conn, 'industry_time_series_yoy')
-    industry_series_data = pd.merge(industry_series_data, industry_series_yoy_data, on=['sub_industry', 'date'], how='left')
-    industry_metrics_yoy_data = fetch_table_data(db_conn, 'industry_metrics_yoy')
-    industry_series_data.sort_values(by=['sub_industry', 'date'], ascending=True, inplace=True)
-    # TODO we need to standardise the index column:
-    industry_series_data['first_indexed_value'] = industry_series_data.groupby(['sub_industry'])['industry_close_price_indexed'].transform('first')
-    industry_series_data['industry_close_price_indexed'] = industry_series_data['industry_close_price_indexed'] / industry_series_data['first_indexed_value'] * 100
-    industry_metrics_yoy_data.sort_values(by=['sub_industry', 'date'], ascending=True, inplace=True)
-
-    # don't need this anymore? TODO remove if we dont
-    # sub_industries = [key.split(":")[0] for key in ticker_series_data.keys() if key.startswith("Industry Index")]
-    # overview_data = {}
-    # for sub_industry in sub_industries:
-    #     sub_industry_map = {}
-    #     overview_data[sub_industry] = sub_industry_map
-
-    # Quarterly-financials:
-    qfin_data = fetch_table_data(db_conn, 'quarterly_financial_data', force_date_conversion=True)
-    qfin_data = pd.merge(qfin_data, company_info, on=['ticker'], how='left')
-    # Get price data for P/E Ratio:
-    qfin_ticker_data = pd.merge(qfin_data[['ticker', 'date']], ticker_series_data[['ticker', 'date', 'close_price']], on=['ticker', 'date'], how='outer')
-    qfin_ticker_data['close_price'] = qfin_ticker_data['close_price'].ffill()
-    qfin_data = pd.merge(qfin_data, qfin_ticker_data[['ticker', 'date', 'close_price']], on=['ticker', 'date'], how='left')
-    del qfin_ticker_data  # remove this time series df
-
-    qfin_data['Price Over EPS'] = qfin_data['close_price'] / qfin_data['Basic EPS']
-    # qfin_data = pd.read_sql_query(sql=get_table_data_query, con=db_conn, params=['quarterly_financial_data'])
-
-    # Balance Sheet financials:
-    bs_data = fetch_table_data(db_conn, 'balance_sheet_data', force_date_conversion=True)
-    bs_data = pd.merge(bs_data, company_info, on=['ticker'], how='left')
-    # bs_data = pd.read_sql_query(sql=get_table_data_query, con=db_conn, params=['balance_sheet_data'])
+    # load on one pooled read-only connection (or the given connection), released once loaded. Only the rows and
+    # columns the pages render are read, the company overview and the DCF model read their ticker's data when it
+    # is selected:
+    with read_connection(db_conn) as read_conn:
+        # TODO abstract this data prelims away from this function
+        economic_data = fetch_price_history(read_conn, 'asset_class_time_series', columnar_dir,
+                                            columns=['ticker', 'date', 'AssetClass', 'close_price_indexed', 'close_price_yoy'])
+
+        snapshot_recent_metrics = fetch_table_data(read_conn, 'ticker_most_recent_metric_data',
+                                                   columns=RECENT_METRICS_TABLE_COLS)
+        company_info = fetch_table_data(read_conn, 'company_info', columns=COMPANY_INFO_TABLE_COLS)
+        snapshot_recent_metrics = pd.merge(snapshot_recent_metrics, company_info, on='ticker', how='left')
+        # TODO move this elsewhere:
+        snapshot_recent_metrics['market_cap_MM'] = snapshot_recent_metrics['market_cap'].clip(lower=1) / 1_000_000
+        data_cluster = fetch_table_data(sql_conn=read_conn, table_name='cluster_table', most_recent=True,
+                                        columns=['ticker', 'cluster_membership'])
+        data_cluster.rename(columns={"cluster_membership": "label"}, inplace=True)
+        snapshot_recent_metrics = pd.merge(snapshot_recent_metrics, data_cluster[['ticker', 'label']], on=['ticker'])
+        # we can calculate EV here from stock_price X number of shareholds
+        latest_ev_data = snapshot_recent_metrics[['ticker', 'enterprise_value']].set_index(keys='ticker')
+        # the DCF model is offered for the tickers with an EV and stored cash flows:
+        cashflow_tickers = fetch_table_data(read_conn, 'cashflow_statement_data', most_recent=True, columns=['ticker'])
+        dcf_ev_data = latest_ev_data[latest_ev_data.index.isin(cashflow_tickers['ticker'])
+                                     & latest_ev_data['enterprise_value'].notna()]
+
+        # The winners and losers only need the last few days of prices:
+        latest_price_date = fetch_table_data(read_conn, 'ticker_time_series', most_recent=True, columns=['date'])['date'].max()
+        recent_price_start = None if pd.isna(latest_price_date) else latest_price_date - pd.Timedelta(days=RECENT_PRICE_DAYS)
+        recent_price_data = fetch_price_history(read_conn, 'ticker_time_series', columnar_dir, date=recent_price_start,
+                                                columns=['ticker', 'date', 'close_price_indexed'])
+        recent_price_data = pd.merge(recent_price_data, company_info, on='ticker', how='left')
+        recent_price_data.sort_values(by=['ticker', 'date'], ascending=True, inplace=True)
+
+        # Quarterly-financials:
+        qfin_data = fetch_table_data(read_conn, 'quarterly_financial_data', columns=QFINANCIAL_TABLE_COLS)
+        qfin_data = pd.merge(qfin_data, company_info, on=['ticker'], how='left')
+        # Get price data for P/E Ratio, from the first report on:
+        first_report_date = None if qfin_data.empty else qfin_data['date'].min()
+        report_price_data = fetch_price_history(read_conn, 'ticker_time_series', columnar_dir, date=first_report_date,
+                                                columns=['ticker', 'date', 'close_price'])
+        qfin_ticker_data = pd.merge(qfin_data[['ticker', 'date']], report_price_data, on=['ticker', 'date'], how='outer')
+        qfin_ticker_data.sort_values(by=['ticker', 'date'], ascending=True, inplace=True)
+        qfin_ticker_data['close_price'] = qfin_ticker_data['close_price'].ffill()
+        qfin_data = pd.merge(qfin_data, qfin_ticker_data[['ticker', 'date', 'close_price']], on=['ticker', 'date'], how='left')
+        del qfin_ticker_data, report_price_data  # remove these time series dfs
+
+        qfin_data['Price Over EPS'] = qfin_data['close_price'] / qfin_data['Basic EPS']
+
+        # Balance Sheet financials:
+        bs_data = fetch_table_data(read_conn, 'balance_sheet_data', columns=BALANCE_SHEET_TABLE_COLS)
+        bs_data = pd.merge(bs_data, company_info, on=['ticker'], how='left')
+
+    def load_company_overview_data(ticker: str, sub_industry: str):
+        # the price and metric YoY series of one ticker and its sub-industry, for the company overview page
+        with read_connection(db_conn) as read_conn:
+            ticker_series_data = fetch_price_history(read_conn, 'ticker_time_series', columnar_dir, tickers=[ticker],
+                                                     columns=['date', 'close_price_indexed'])
+            ticker_series_yoy_data = fetch_time_series(read_conn, 'ticker_ts_yoy', columnar_dir, tickers=[ticker],
+                                                       columns=['date', 'close_price_indexed_yoy'])
+            ticker_metric_yoy_data = fetch_table_data(read_conn, 'ticker_metrics_yoy', tickers=[ticker])
+            industry_series_data = fetch_time_series(read_conn, 'industry_time_series', columnar_dir,
+                                                     sub_industries=[sub_industry],
+                                                     columns=['date', 'industry_close_price_indexed'])
+            industry_series_yoy_data = fetch_time_series(read_conn, 'industry_time_series_yoy', columnar_dir,
+                                                         sub_industries=[sub_industry],
+                                                         columns=['date', 'industry_close_price_indexed_yoy'])
+            industry_metrics_yoy_data = fetch_table_data(read_conn, 'industry_metrics_yoy', sub_industries=[sub_industry])
+
+        ticker_series_data = pd.merge(ticker_series_data, ticker_series_yoy_data, on=['date'], how='left')
+        industry_series_data = pd.merge(industry_series_data, industry_series_yoy_data, on=['date'], how='left')
+        for df in [ticker_series_data, industry_series_data, ticker_metric_yoy_data, industry_metrics_yoy_data]:
+            df.sort_values(by=['date'], ascending=True, inplace=True)
+        # TODO we need to standardise the index column:
+        if not industry_series_data.empty:
+            first_indexed_value = industry_series_data['industry_close_price_indexed'].iloc[0]
+            industry_series_data['industry_close_price_indexed'] = industry_series_data['industry_close_price_indexed'] / first_indexed_value * 100
+        return ticker_series_data, ticker_metric_yoy_data, industry_series_data, industry_metrics_yoy_data
+
+    def load_cashflow(ticker: str):
+        with read_connection(db_conn) as read_conn:
+            df_cashflow = fetch_table_data(read_conn, 'cashflow_statement_data', tickers=[ticker],
+                                           columns=CASHFLOW_TABLE_COLS)
+        return df_cashflow.sort_values(by=['date'], ascending=True)
 
     # Callback to update the page content based on URL
     @app.callback(Output('page-content', 'children'),
@@ -111,13 +140,11 @@ def create_app(db_conn):
         elif pathname == '/balance-sheet-report-ts-data':
             return get_balance_sheet_report_page_layout(bs_data)
         elif pathname == '/company-stock-overview-data':
-            return get_individual_company_overview_page_layout(ticker_series_data,
-                                                               industry_series_data, industry_metrics_yoy_data)
+            return get_individual_company_overview_page_layout(company_info)
         elif pathname == "/winners-and-losers":
-            return get_biggest_winners_and_losers_page_layout(ticker_series_data)
-        # TODO add cashflow df back in
-        # elif pathname == '/company-discounted-cashflow-calculation':
-        #     return get_discounted_cashflow_model_page_layout(cashflow_map, latest_ev_data)
+            return get_biggest_winners_and_losers_page_layout(recent_price_data)
+        elif pathname == '/company-discounted-cashflow-calculation':
+            return get_discounted_cashflow_model_page_layout(dcf_ev_data)
         else:
             return get_landing_page_layout_v2(economic_data=economic_data)  # TODO add high-level data here?
 
@@ -147,9 +174,9 @@ def create_app(db_conn):
         elif button_id == 'company-stock-overview-data-page-button':
             return '/company-stock-overview-data'
         elif button_id == "/winners-and-losers":
-            return get_biggest_winners_and_losers_page_layout(ticker_series_data)
-        # elif button_id == 'company-discounted-cashflow-calculation-page-button':
-        #     return '/company-discounted-cashflow-calculation'
+            return get_biggest_winners_and_losers_page_layout(recent_price_data)
+        elif button_id == 'company-discounted-cashflow-calculation-page-button':
+            return '/company-discounted-cashflow-calculation'
         else:
             return '/'
 
@@ -157,10 +184,9 @@ def create_app(db_conn):
     register_comparison_callbacks(app, snapshot_recent_metrics)
     register_quarterly_report_page_callbacks(app, qfin_data)
     register_balance_sheet_report_page_callbacks(app, bs_data)
-    register_individual_company_overview_callback(app, company_info, ticker_series_data, ticker_metric_yoy_data,
-                                                  industry_series_data, industry_metrics_yoy_data)
-    register_winners_and_losers_callback(app, ticker_series_data)
-    # register_discounted_cashflow_model_page_callbacks(app, cashflow_map, latest_ev_data)
+    register_individual_company_overview_callback(app, company_info, load_company_overview_data)
+    register_winners_and_losers_callback(app, recent_price_data)
+    register_discounted_cashflow_model_page_callbacks(app, load_cashflow, dcf_ev_data)
 
     # Callback to handle the "Return to Home" button click
     @app.callback(
@@ -1,10 +1,10 @@
-import yfinance as yf
 import pandas as pd
 import os
 from typing import List
 from scipy.stats import trim_mean
 from constants import DB_PATH, HUGGINGFACE_API_URL, HUGGINGFACE_API_TOKEN
 from src.peer_comparison_tool.data.db import initialize_db_connection
+from src.peer_comparison_tool.data.providers import get_default_provider
 import requests
 import re
 # Could use the huggingfac_hub client as well instead of requests
@@ -35,7 +35,7 @@ def find_candidate_tickers(df: pd.DataFrame, tickers):
 def get_ticker_price_data(ticker_list: List[str]):
     df_tickers = pd.DataFrame()
     for ticker in ticker_list:
-        yf_ticker = yf.Ticker(ticker)
+        yf_ticker = get_default_provider().ticker(ticker)
         try:
             df_ticker = yf_ticker.history(period='1y')[['Close']]
             df_ticker = df_ticker.reset_index()
@@ -63,7 +63,7 @@ def analyse_recent_news(tickers: List[str]):
                   f"Recent news summary: This recent news for company means <opinion of news>." \
                   f"Investment grade: <number from 1-10>." \
                   f"High-level takeaways: <final short note on investing given the recent news titles>"
-        yf_ticker = yf.Ticker(ticker)
+        yf_ticker = get_default_provider().ticker(ticker)
         ticker_news = yf_ticker.get_news()
         # todo use chatgpt to evaluate badness of the news
         input_message = context + "\n\n" + message_intro + "\n" + "\n".join([news['title'] for news in ticker_news])
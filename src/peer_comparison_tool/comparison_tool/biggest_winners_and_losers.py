@@ -9,6 +9,7 @@ import pandas as pd
 
 DISPLAY_COLS = ['name', 'ticker', 'industry', 'sub_industry', 'close_price_indexed_dod']  # 'price_change', 'signifiance']
 # significance is some measure of price change and historical vol.
+RECENT_PRICE_DAYS = 7  # days of prices before the latest loaded for the page, enough for the last day-on-day change
 
 
 def get_biggest_winners_and_losers_page_layout(data: pd.DataFrame):
@@ -134,4 +134,4 @@ def register_balance_sheet_report_page_callbacks(app, data):
 
 
 def most_recent_report_date(ticker_data):
-    return ticker_data['date'].iloc[-1]
+    return ticker_data['date'].iloc[-1].strftime('%Y-%m-%d')
@@ -4,6 +4,10 @@ DOWNLOAD_DIR = "~/Documents/Code/peer-comparison-tool/data"
 
 DB_FOLDER = os.path.dirname(__file__)
 DB_PATH = os.path.join(DB_FOLDER, "comparison_tool.db")
+# Arrow copy of the time series tables (data/columnar.py), set PEER_TOOL_COLUMNAR_DIR empty to read only SQLite:
+COLUMNAR_DIR = os.getenv("PEER_TOOL_COLUMNAR_DIR", os.path.join(DB_FOLDER, "columnar")) or None
+# Published snapshots the app reads (data/snapshot.py), set PEER_TOOL_SNAPSHOT_DIR empty to read DB_PATH directly:
+SNAPSHOT_DIR = os.getenv("PEER_TOOL_SNAPSHOT_DIR", os.path.join(DB_FOLDER, "snapshots")) or None
 
 HUGGINGFACE_API_TOKEN = os.getenv("HUGGINGFACE_API_TOKEN")
 url = "https://api-inference.huggingface.co/models/"
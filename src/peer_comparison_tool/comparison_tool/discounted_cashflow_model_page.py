@@ -15,7 +15,8 @@ CF_FUTURE_YEARS = 5
 
 
 def get_discounted_cashflow_model_page_layout(latest_ev_data):
-    unique_ticker_list = list(latest_ev_data['ticker'].unique)
+    # latest_ev_data: enterprise_value indexed by ticker, for the tickers with stored cash flows
+    unique_ticker_list = list(latest_ev_data.index.unique())
     return dbc.Container([
         dbc.Row([
             dbc.Col(
@@ -31,7 +32,7 @@ def get_discounted_cashflow_model_page_layout(latest_ev_data):
                 dcc.Dropdown(
                     id='company-dropdown',
                     options=[{'label': ticker, 'value': ticker} for ticker in unique_ticker_list],
-                    value=unique_ticker_list[0],  # Default selection - jut pick first ticker
+                    value=unique_ticker_list[0] if unique_ticker_list else None,  # Default selection - jut pick first ticker
                     multi=False,
                     searchable=True,
                     placeholder="Select ticker...",
@@ -114,7 +115,8 @@ def get_discounted_cashflow_model_page_layout(latest_ev_data):
     ], fluid=True, style={'backgroundColor': colors['background']})
 
 
-def register_discounted_cashflow_model_page_callbacks(app, cashflow_map, latest_ev):
+def register_discounted_cashflow_model_page_callbacks(app, load_cashflow, latest_ev):
+    # load_cashflow(ticker) -> the ticker's annual cash flows sorted by date, read when the DCF is calculated
     @app.callback(
         dash.dependencies.Output('ev-value', 'children'),
         dash.dependencies.Output('base-percentage-error', 'children'),
@@ -131,13 +133,13 @@ def register_discounted_cashflow_model_page_callbacks(app, cashflow_map, latest_
         dash.dependencies.State('discount-rate-input', 'value')
     )
     def calculate_dcf(n_clicks, ticker, growth_rate, terminal_rate, discount_rate):
-        if n_clicks is None:
-            return ""
+        if n_clicks is None or ticker is None:
+            return dash.no_update
 
         # Fetch financial data and calculate DCF
-        df_cashflow = cashflow_map.get(ticker).reset_index(names=['date'])
-        if df_cashflow is None:
-            return ""
+        df_cashflow = load_cashflow(ticker).dropna(subset=['Free Cash Flow'])
+        if df_cashflow.empty:
+            return dash.no_update
 
         # Now we want the three scenarios:
         # Example calculation (simplified)
@@ -9,9 +9,8 @@ from .styles import colors
 from .constants import DOWNLOAD_DIR
 
 
-def get_individual_company_overview_page_layout(ticker_price_data, industry_price_data,
-                                                industry_metric_yoy_data):
-    # TODO subset the industry_metric_yoy_data to the sub_industry - where do we choose this?
+def get_individual_company_overview_page_layout(company_info):
+    # company_info: the tickers to choose from
     return dbc.Container([
         dbc.Row([
             dbc.Col(
@@ -25,8 +24,8 @@ def get_individual_company_overview_page_layout(ticker_price_data, industry_pric
                 html.Label("Select Company:", style={'color': colors['text']}),
                 dcc.Dropdown(
                     id='ticker-dropdown',
-                    options=[{'label': ticker, 'value': ticker} for ticker in list(ticker_price_data['ticker'].unique())],
-                    value=list(ticker_price_data['ticker'].unique())[0],  # Default selection - jut pick first ticker
+                    options=[{'label': ticker, 'value': ticker} for ticker in list(company_info['ticker'].unique())],
+                    value=list(company_info['ticker'].unique())[0],  # Default selection - jut pick first ticker
                     multi=False,
                     searchable=True,
                     placeholder="Select ticker...",
@@ -135,8 +134,9 @@ def get_color_and_arrow(change):
         return 'grey', '→'
 
 
-def register_individual_company_overview_callback(app, company_info_tab, tickers_series_data, tickers_metric_data, industries_series_data,
-                                                  industries_metric_data):
+def register_individual_company_overview_callback(app, company_info_tab, load_data):
+    # load_data(ticker, sub_industry) -> the ticker's price series, metric YoY and its sub-industry's price series,
+    # metric YoY, each sorted by date - only the selected company's rows are read
     @app.callback(
         [dash.dependencies.Output('stock-price-series-chart', 'figure'),
          dash.dependencies.Output('gross-margin-metric', 'children'),
@@ -159,10 +159,8 @@ def register_individual_company_overview_callback(app, company_info_tab, tickers
 
         # Filter data by selected sector:
         sub_industry = company_info_tab.loc[company_info_tab["ticker"] == selected_ticker, "sub_industry"].iloc[0]
-        ticker_series_data = tickers_series_data[tickers_series_data['ticker'] == selected_ticker]
-        ticker_metric_data = tickers_metric_data[tickers_metric_data['ticker'] == selected_ticker]
-        industry_series_data = industries_series_data[industries_series_data['sub_industry'] == sub_industry]
-        industry_metric_data = industries_metric_data[industries_metric_data['sub_industry'] == sub_industry]
+        ticker_series_data, ticker_metric_data, industry_series_data, industry_metric_data = \
+            load_data(selected_ticker, sub_industry)
 
         ts_filtered_data = ticker_series_data[['date', 'close_price_indexed', 'close_price_indexed_yoy']]
         ts_industry_data = industry_series_data[['date', 'industry_close_price_indexed', 'industry_close_price_indexed_yoy']]
@@ -3,7 +3,7 @@ import numpy as np
 import statsmodels.tsa.stattools as st
 from statsmodels.tsa.vector_ar.vecm import coint_johansen
 from typing import Dict, Any
-import yfinance as yf
+from src.peer_comparison_tool.data.providers import get_default_provider
 import plotly.express as px
 import os
 from typing import List
@@ -16,10 +16,10 @@ def test_individual_asset_pairs(tickers: List[str]):
 
     for i, ticker_a in enumerate(tickers):
         for ticker_b in tickers[i+1:]:
-            yf_a = yf.Ticker(ticker_a)
+            yf_a = get_default_provider().ticker(ticker_a)
             df_a = yf_a.history(period='1y')[['Close']].reset_index()
 
-            yf_b = yf.Ticker(ticker_b)
+            yf_b = get_default_provider().ticker(ticker_b)
             df_b = yf_b.history(period='1y')[['Close']].reset_index()
             df_pairs = pd.merge(df_a, df_b, on=['Date'], suffixes=('_a', '_b'), how='inner')
             df_pairs['Close_a_indexed'] = df_pairs['Close_a'] / df_pairs['Close_a'].iloc[0]
@@ -137,7 +137,7 @@ def create_cointegrated_spread_series(tickers: List[str]) -> List[Dict[str, Any]
     # Get Data:
     df_series = pd.DataFrame()
     for ticker in tickers:
-        yf_a = yf.Ticker(ticker)
+        yf_a = get_default_provider().ticker(ticker)
         df_ticker = yf_a.history(period='1y')[['Close']].reset_index()
         df_ticker['log_close'] = np.log(df_ticker['Close'])
         if check_stationarity(df_ticker['log_close']):
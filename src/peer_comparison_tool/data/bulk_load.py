@@ -0,0 +1,163 @@
+"""Bulk loading of DataFrames into the tables. Rows are streamed to executemany a chunk at a time from plain Python
+column lists, so no tuple list of the whole frame or numpy scalar per value is built, and each chunk reuses the
+statement prepared for the first (sqlite3 caches prepared statements by their SQL text).
+Benchmark from the repo root: python -m src.peer_comparison_tool.data.bulk_load --rows 10000000"""
+
+import click
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from functools import lru_cache
+from typing import Iterator, List, Optional, Tuple
+
+from .dates import encode_date_columns
+from .constants import BULK_LOAD_CHUNK_ROWS
+
+ON_CONFLICT = (None, 'IGNORE', 'REPLACE')
+
+
+def quoted_columns(columns) -> str:
+    # Some columns have spaces so the names are quoted
+    return ", ".join(f'"{col}"' for col in columns)
+
+
+@lru_cache(maxsize=None)
+def insert_sql(table: str, columns: Tuple[str, ...], on_conflict: Optional[str] = None) -> str:
+    columns_str = quoted_columns(columns)
+    placeholders = ", ".join(["?"] * len(columns))
+    insert = f"INSERT OR {on_conflict}" if on_conflict else "INSERT"
+    return f'{insert} INTO {table} ({columns_str}) VALUES ({placeholders})'
+
+
+def iter_row_chunks(df: pd.DataFrame, chunk_rows: int = BULK_LOAD_CHUNK_ROWS) -> Iterator[Iterator[tuple]]:
+    # Series.tolist() converts a whole column to Python ints/floats/strs in one pass (NaN binds as NULL)
+    for start in range(0, len(df), chunk_rows):
+        chunk = df.iloc[start:start + chunk_rows]
+        yield zip(*[chunk[col].tolist() for col in chunk.columns])
+
+
+def primary_key_columns(conn, table: str) -> List[str]:
+    rows = [row for row in conn.execute(f'PRAGMA table_info("{table}")') if row[5] > 0]
+    return [row[1] for row in sorted(rows, key=lambda row: row[5])]
+
+
+def _load_rows(cursor, table: str, df: pd.DataFrame, on_conflict: Optional[str], chunk_rows: int):
+    sql = insert_sql(table, tuple(df.columns), on_conflict)
+    for rows in iter_row_chunks(df, chunk_rows):
+        cursor.executemany(sql, rows)
+
+
+def _merge_from_staging(cursor, table: str, df: pd.DataFrame, on_conflict: Optional[str], chunk_rows: int):
+    # load into an unindexed temp table, then merge with one INSERT ... SELECT in primary key order, so the
+    # table's b-trees are filled sequentially and the conflict checks happen in SQLite rather than per bound row
+    staging_table = f'temp."staging_{table}"'
+    columns_str = quoted_columns(df.columns)
+    cursor.execute(f'DROP TABLE IF EXISTS {staging_table}')
+    cursor.execute(f'CREATE TEMP TABLE "staging_{table}" AS SELECT {columns_str} FROM "{table}" WHERE 0')
+    _load_rows(cursor, staging_table, df, None, chunk_rows)
+    # rowid last, so of the rows with the same key the later one still replaces the earlier one
+    order_columns = [col for col in primary_key_columns(cursor.connection, table) if col in df.columns]
+    order_sql = f" ORDER BY {quoted_columns(order_columns)}, rowid" if order_columns else ""
+    insert = f"INSERT OR {on_conflict}" if on_conflict else "INSERT"
+    cursor.execute(f'{insert} INTO "{table}" ({columns_str}) SELECT {columns_str} FROM {staging_table}{order_sql}')
+    cursor.execute(f'DROP TABLE {staging_table}')
+
+
+def bulk_load(cursor, table: str, df: pd.DataFrame, on_conflict: Optional[str] = None, staging: bool = False,
+              chunk_rows: int = BULK_LOAD_CHUNK_ROWS):
+    """Insert every row of df into table (its columns must be table columns), resolving key conflicts with
+    on_conflict ('IGNORE', 'REPLACE' or None to fail). staging=True loads through a temp table and a set based merge,
+    which pays off for large loads into a populated table.
+    The load is all or nothing, but like a plain INSERT it is left in the caller's transaction and committed with the
+    caller's commit. Into an open transaction the rows are always staged, as the merge is a single statement: a
+    savepoint would do too, but held open once the transaction has outgrown the page cache it slows every insert into
+    a WAL database down by orders of magnitude."""
+    if on_conflict not in ON_CONFLICT:
+        raise ValueError(f"on_conflict must be one of {ON_CONFLICT}, not {on_conflict}")
+    if df.empty:
+        return
+    df = encode_date_columns(df)
+    conn = cursor.connection
+    if table.startswith('temp.'):
+        # a scratch table of the connection's own (a staging table etc.), out of the database's WAL
+        _load_rows(cursor, table, df, on_conflict, chunk_rows)
+        return
+    if conn.in_transaction:
+        # the rows only reach table with the one INSERT ... SELECT, which is atomic on its own
+        _merge_from_staging(cursor, table, df, on_conflict, chunk_rows)
+        return
+    # the load is the whole transaction, so rolling it back undoes only the load
+    cursor.execute("BEGIN")
+    try:
+        if staging:
+            _merge_from_staging(cursor, table, df, on_conflict, chunk_rows)
+        else:
+            _load_rows(cursor, table, df, on_conflict, chunk_rows)
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _records_load(cursor, table: str, df: pd.DataFrame, on_conflict: Optional[str] = None, **_):
+    # the row by row conversion bulk_load replaced, kept as the benchmark baseline
+    sql = insert_sql(table, tuple(df.columns), on_conflict)
+    cursor.executemany(sql, encode_date_columns(df).to_records(index=False).tolist())
+
+
+BENCHMARK_METHODS = {
+    'records': _records_load,
+    'bulk': bulk_load,
+    'staging': lambda cursor, table, df, on_conflict=None: bulk_load(cursor, table, df, on_conflict, staging=True),
+}
+
+
+def synthetic_price_frames(rows: int, tickers_per_frame: int = 100, days: int = 2_520,
+                           seed: int = 0) -> Iterator[pd.DataFrame]:
+    # ticker_time_series rows, ten years of trading days per ticker, a frame of tickers_per_frame tickers at a time
+    rng = np.random.default_rng(seed)
+    dates = np.arange(20_000 - days, 20_000, dtype=np.int64)  # epoch days
+    for first_ticker in range(0, -(-rows // days), tickers_per_frame):
+        n_tickers = min(tickers_per_frame, -(-rows // days) - first_ticker)
+        closes = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, (n_tickers, days)), axis=1))
+        yield pd.DataFrame({
+            'ticker': np.repeat([f"T{i:05d}" for i in range(first_ticker, first_ticker + n_tickers)], days),
+            'date': np.tile(dates, n_tickers),
+            'close_price': closes.ravel(),
+            'close_price_indexed': (closes / closes[:, :1] * 100).ravel(),
+        })
+
+
+def benchmark_bulk_load(method: str, rows: int, on_conflict: Optional[str] = 'IGNORE') -> float:
+    # rows/sec loading into ticker_time_series of a new database, including the commits
+    from .db import initialize_db_connection
+    from .migrations import migrate
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        conn = initialize_db_connection(os.path.join(tmp_dir, 'benchmark.db'))
+        migrate(conn)
+        cursor = conn.cursor()
+        load, loaded, elapsed = BENCHMARK_METHODS[method], 0, 0.0
+        for df in synthetic_price_frames(rows):
+            start = time.perf_counter()  # frame generation is not timed
+            load(cursor, 'ticker_time_series', df, on_conflict=on_conflict)
+            conn.commit()
+            elapsed += time.perf_counter() - start
+            loaded += len(df)
+        conn.close()
+    return loaded / elapsed
+
+
+@click.command()
+@click.option('--rows', default=10_000_000, type=int, help='Price rows to load')
+@click.option('--method', 'methods', multiple=True, type=click.Choice(list(BENCHMARK_METHODS)),
+              help='Loader to benchmark (repeatable), default all')
+def execute(rows, methods):
+    for method in methods or BENCHMARK_METHODS:
+        rows_per_second = benchmark_bulk_load(method, rows)
+        print(f"{method}: {rows_per_second:,.0f} rows/sec")
+
+
+if __name__ == '__main__':
+    execute()
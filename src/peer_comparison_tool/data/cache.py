@@ -0,0 +1,219 @@
+"""On-disk cache in front of the yfinance calls, with per-endpoint TTLs, size-based eviction and offline replay"""
+
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional
+
+import pandas as pd
+import yfinance as yf
+
+CACHE_DIR = os.path.expanduser(os.getenv('PEER_TOOL_CACHE_DIR', '~/.cache/peer-comparison-tool/yfinance'))
+CACHE_MAX_BYTES = int(os.getenv('PEER_TOOL_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+# Replay only from the cache, never touching the network:
+CACHE_OFFLINE = os.getenv('PEER_TOOL_OFFLINE', '').lower() in ('1', 'true', 'yes')
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+ENDPOINT_TTL_SECONDS = {
+    'info': DAY,
+    'quarterly_financials': 7 * DAY,
+    'balance_sheet': 7 * DAY,
+    'cashflow': 7 * DAY,
+    'income_stmt': 7 * DAY,
+    'history': 12 * HOUR,
+    'download': 12 * HOUR,
+    'news': HOUR,
+}
+DEFAULT_TTL_SECONDS = DAY
+
+
+def is_empty_response(value) -> bool:
+    # what yfinance returns for unknown or delisted symbols and failed requests: nothing, empty frames and dicts, or
+    # a frame of NaNs. Not cached, so the next run asks again rather than replaying the failure for a whole TTL.
+    if value is None:
+        return True
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.empty or bool(value.isna().all(axis=None))
+    if isinstance(value, dict):
+        return all(item is None for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return len(value) == 0
+    return False
+
+
+class CacheMissError(Exception):
+    """Raised in offline mode when a response is not in the cache."""
+    pass
+
+
+class ResponseCache:
+    # Entries are zlib-compressed pickles addressed by a hash of (symbol, endpoint, parameters).
+    # Offline mode serves expired entries as well, so a cache can be replayed indefinitely.
+    def __init__(self, cache_dir: str = CACHE_DIR, ttl_seconds: Optional[Dict[str, float]] = None,
+                 max_bytes: int = CACHE_MAX_BYTES, offline: bool = CACHE_OFFLINE):
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ENDPOINT_TTL_SECONDS | (ttl_seconds or {})
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self._lock = threading.Lock()
+        self._size_bytes = None  # scanned from disk on the first write
+
+    @staticmethod
+    def key(symbol: str, endpoint: str, params: Dict[str, Any]) -> str:
+        payload = json.dumps([symbol, endpoint, params], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.pkl.z")
+
+    def get_or_fetch(self, symbol: str, endpoint: str, fetch: Callable[[], Any], **params):
+        path = self._path(self.key(symbol, endpoint, params))
+        try:
+            age = time.time() - os.path.getmtime(path)
+            if self.offline or age <= self.ttl_seconds.get(endpoint, DEFAULT_TTL_SECONDS):
+                return self._load(path)
+        except (FileNotFoundError, EOFError, zlib.error, pickle.UnpicklingError):
+            pass
+        if self.offline:
+            raise CacheMissError(f"No cached {endpoint} response for {symbol} with {params}")
+
+        value = fetch()
+        if not is_empty_response(value):
+            self._store(path, value)
+        return value
+
+    @staticmethod
+    def _load(path: str):
+        with open(path, 'rb') as f:
+            return pickle.loads(zlib.decompress(f.read()))
+
+    def _store(self, path: str, value):
+        blob = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(blob)
+        with self._lock:
+            # an overwritten entry's bytes are given back, under the lock so no other write replaces it in between
+            try:
+                replaced_bytes = os.path.getsize(path)
+            except FileNotFoundError:
+                replaced_bytes = 0
+            os.replace(tmp_path, path)  # atomic, readers never see a partial entry
+            if self._size_bytes is None:
+                self._size_bytes = sum(size for _, size, _ in self._entries())
+            else:
+                self._size_bytes += len(blob) - replaced_bytes
+            if self._size_bytes > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.pkl.z'):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    yield path, stat.st_size, stat.st_mtime
+
+    def _evict(self):
+        # oldest entries first, down to 90% of the limit so we don't evict on every write. The size is recounted from
+        # the scan, which also corrects it for entries other processes sharing the directory wrote or removed.
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        self._size_bytes = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for path, size, _ in entries:
+            if self._size_bytes <= target:
+                break
+            try:
+                os.remove(path)
+                self._size_bytes -= size
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            for path, _, _ in list(self._entries()):
+                os.remove(path)
+            self._size_bytes = 0
+
+
+_default_cache = None
+
+
+def get_default_cache() -> ResponseCache:
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResponseCache()
+    return _default_cache
+
+
+def configure_default_cache(**kwargs) -> ResponseCache:
+    # e.g. configure_default_cache(offline=True) for a benchmark replay
+    global _default_cache
+    _default_cache = ResponseCache(**kwargs)
+    return _default_cache
+
+
+class CachedTicker:
+    # Drop-in for the parts of yf.Ticker we use, every response goes through the cache.
+    # The rate limiter is only hit on a cache miss, i.e. when a request really goes to the network.
+    def __init__(self, symbol: str, cache: Optional[ResponseCache] = None, rate_limiter=None):
+        self.ticker = symbol
+        self.cache = cache or get_default_cache()
+        self.rate_limiter = rate_limiter
+        self._yf_ticker = None
+
+    @property
+    def _yf(self):
+        if self._yf_ticker is None:
+            self._yf_ticker = yf.Ticker(self.ticker)
+        return self._yf_ticker
+
+    def _get(self, endpoint: str, fetch: Callable[[], Any], **params):
+        def fetch_from_network():
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            return fetch()
+        return self.cache.get_or_fetch(self.ticker, endpoint, fetch_from_network, **params)
+
+    @property
+    def info(self):
+        return self._get('info', lambda: self._yf.info)
+
+    @property
+    def quarterly_financials(self):
+        return self._get('quarterly_financials', lambda: self._yf.quarterly_financials)
+
+    @property
+    def cashflow(self):
+        return self._get('cashflow', lambda: self._yf.cashflow)
+
+    @property
+    def income_stmt(self):
+        return self._get('income_stmt', lambda: self._yf.income_stmt)
+
+    def get_balance_sheet(self, **kwargs):
+        return self._get('balance_sheet', lambda: self._yf.get_balance_sheet(**kwargs), **kwargs)
+
+    def history(self, **kwargs):
+        return self._get('history', lambda: self._yf.history(**kwargs), **kwargs)
+
+    def get_news(self, **kwargs):
+        return self._get('news', lambda: self._yf.get_news(**kwargs), **kwargs)
+
+
+def cached_download(tickers: List[str], cache: Optional[ResponseCache] = None, rate_limiter=None, **kwargs):
+    # yf.download through the cache, keyed on the (order independent) set of tickers and the download parameters
+    cache = cache or get_default_cache()
+
+    def fetch_from_network():
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        return yf.download(tickers, **kwargs)
+    symbol = ",".join(sorted(tickers)) if isinstance(tickers, (list, tuple)) else tickers
+    return cache.get_or_fetch(symbol, 'download', fetch_from_network, **kwargs)
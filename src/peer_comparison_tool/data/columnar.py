@@ -0,0 +1,291 @@
+"""Optional columnar copy of the long time series tables: one Arrow IPC file per table and calendar year, exported
+after each ingestion and memory-mapped by the app. Loading them is zero-copy for the numeric and date columns, and
+every process mapping the same files shares their pages through the OS page cache.
+Each export of a table is a new version directory, holding its partitions (the unchanged ones hard linked from the
+previous version) and its manifest, and the table's CURRENT pointer is then swapped to it, so a reader sees one whole
+export or the next. The manifest records the columnar_change counts (migration 7) it was exported at, so a table is
+current when they are still the database's counts.
+Needs pyarrow - without it, or for a table whose export is behind the database, the app reads SQLite as before.
+Export now (e.g. after a manual load) from the repo root: python -m src.peer_comparison_tool.data.columnar [--rebuild]"""
+
+import click
+import json
+import os
+import shutil
+import pandas as pd
+from datetime import date
+from typing import Dict, List, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+
+from .queries import query_columnar_changes, query_rows_since_date
+from .dates import epoch_day, to_epoch_days, epoch_day_to_date, from_epoch_days
+from .db_utils import fetch_table_data
+from .retention import price_tiers, tier_ranges, bar_table_name, tier_columns
+from .snapshot import current_snapshot, swap_pointer
+from .constants import COLUMNAR_VERSIONS_KEPT
+
+COLUMNAR_TABLES = ['ticker_time_series', 'ticker_ts_yoy', 'industry_time_series', 'industry_time_series_yoy',
+                   'asset_class_time_series']
+MANIFEST_FILE = 'manifest.json'
+PARTITION_SUFFIX = '.arrow'
+VERSION_PREFIX = 'v'
+
+
+def columnar_available() -> bool:
+    return pa is not None
+
+
+def _table_dir(store_dir: str, table_name: str) -> str:
+    return os.path.join(store_dir, table_name)
+
+
+def _partition_path(version_dir: str, year: int) -> str:
+    return os.path.join(version_dir, f"{year}{PARTITION_SUFFIX}")
+
+
+def current_version_dir(store_dir: str, table_name: str) -> Optional[str]:
+    # the directory of the table's current export, None if never exported
+    return current_snapshot(_table_dir(store_dir, table_name))
+
+
+def _version_number(file_name: str) -> int:
+    return int(file_name[len(VERSION_PREFIX):])
+
+
+def list_versions(store_dir: str, table_name: str) -> List[str]:
+    # the version directory names, oldest first
+    table_dir = _table_dir(store_dir, table_name)
+    if not os.path.isdir(table_dir):
+        return []
+    return sorted((file_name for file_name in os.listdir(table_dir) if file_name.startswith(VERSION_PREFIX)
+                   and file_name[len(VERSION_PREFIX):].isdigit()), key=_version_number)
+
+
+def table_changes(conn, table_name: str) -> Dict[int, int]:
+    # year -> the rows inserted, updated and deleted in it so far (columnar_change)
+    return dict(conn.execute(query_columnar_changes, (table_name, )).fetchall())
+
+
+def _replace_file(path: str, write):
+    # write a temporary file then rename it over path, so a reader sees the old file or the new one, never half of one
+    tmp_path = f"{path}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def read_manifest(version_dir: str) -> Dict:
+    # {'changes': the year -> columnar_change count exported, 'years': the partitions}
+    with open(os.path.join(version_dir, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    return {'changes': {int(year): count for year, count in manifest['changes'].items()}, 'years': manifest['years']}
+
+
+def write_manifest(version_dir: str, manifest: Dict):
+    def write(tmp_path):
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+    _replace_file(os.path.join(version_dir, MANIFEST_FILE), write)
+
+
+def to_arrow(df: pd.DataFrame) -> 'pa.Table':
+    # epoch days are what Arrow's date32 stores, so the stored integers are reinterpreted rather than converted
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    dates = pa.array(df['date'].to_numpy(dtype='int32')).view(pa.date32())
+    return table.set_column(table.schema.get_field_index('date'), 'date', dates)
+
+
+def write_partition(path: str, table: 'pa.Table'):
+    # uncompressed IPC, so the file maps straight into Arrow buffers
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+def read_partition(path: str) -> 'pa.Table':
+    with pa.memory_map(path, 'r') as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def _link_partition(source: str, target: str):
+    # the partitions are never written again once exported, so versions can share them
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def prune_versions(store_dir: str, table_name: str, keep: int = COLUMNAR_VERSIONS_KEPT):
+    # the previous versions are kept for a while as app readers may still be reading them
+    table_dir = _table_dir(store_dir, table_name)
+    current = current_version_dir(store_dir, table_name)
+    for file_name in list_versions(store_dir, table_name)[:-keep]:
+        path = os.path.join(table_dir, file_name)
+        if path != current:
+            shutil.rmtree(path, ignore_errors=True)
+    for file_name in os.listdir(table_dir):
+        # partitions and manifest of a store exported before there were versions:
+        if file_name.endswith(PARTITION_SUFFIX) or file_name == MANIFEST_FILE:
+            os.remove(os.path.join(table_dir, file_name))
+
+
+def export_table(conn, store_dir: str, table_name: str, rebuild: bool = False) -> List[int]:
+    """Export the years of one table with rows inserted, updated or deleted since the last export to a new version,
+    returning them. They are read in one pass from the earliest of them, the other years' partitions are linked from
+    the current version, and a year left without rows is dropped."""
+    changes = table_changes(conn, table_name)
+    version_dir = current_version_dir(store_dir, table_name)
+    manifest = read_manifest(version_dir) if version_dir is not None and not rebuild else None
+    if manifest is not None and manifest['changes'] == changes:
+        return []
+    exported_changes = manifest['changes'] if manifest is not None else {}
+    changed_years = sorted(year for year, count in changes.items() if exported_changes.get(year) != count)
+
+    versions = list_versions(store_dir, table_name)
+    new_version = f"{VERSION_PREFIX}{_version_number(versions[-1]) + 1 if versions else 1}"
+    new_version_dir = os.path.join(_table_dir(store_dir, table_name), new_version)
+    shutil.rmtree(new_version_dir, ignore_errors=True)  # left from a failed export
+    os.makedirs(new_version_dir)
+    years = [year for year in (manifest['years'] if manifest is not None else []) if year not in changed_years]
+    for year in years:
+        _link_partition(_partition_path(version_dir, year), _partition_path(new_version_dir, year))
+    if changed_years:
+        df = pd.read_sql_query(query_rows_since_date.format(table_name=table_name), conn,
+                               params=[epoch_day(date(changed_years[0], 1, 1))])
+        row_years = from_epoch_days(df['date']).dt.year
+        for year in changed_years:
+            df_year = df[row_years == year]
+            if not df_year.empty:
+                write_partition(_partition_path(new_version_dir, year), to_arrow(df_year))
+                years.append(year)
+    write_manifest(new_version_dir, {'changes': changes, 'years': sorted(years)})
+    swap_pointer(_table_dir(store_dir, table_name), new_version)
+    prune_versions(store_dir, table_name)
+    return changed_years
+
+
+def export_columnar_store(conn, store_dir: str, rebuild: bool = False):
+    # run after the tables are written, by the same process, so nothing is written during the export
+    if not columnar_available():
+        print("pyarrow is not installed, skipping the columnar store export")
+        return
+    for table_name in COLUMNAR_TABLES:
+        years = export_table(conn, store_dir, table_name, rebuild)
+        if years:
+            print(f"Exported {table_name} to the columnar store, years {years[0]}-{years[-1]}")
+
+
+def current_columnar_version(conn, store_dir: str, table_name: str) -> Optional[str]:
+    # the table's current version directory if it is up to date with conn's database (the columnar_change counts
+    # it was exported at are the database's), else None
+    version_dir = current_version_dir(store_dir, table_name)
+    if version_dir is None:
+        return None
+    manifest = read_manifest(version_dir)
+    if not manifest['years'] or manifest['changes'] != table_changes(conn, table_name):
+        return None
+    return version_dir
+
+
+def read_columnar_table(version_dir: str, date: str = None, end_date: str = None, columns: Optional[List[str]] = None,
+                        key_filters: Optional[Dict[str, List[str]]] = None) -> pd.DataFrame:
+    """The same frame fetch_table_data returns, from the mapped partitions of one version of a table: only the years
+    overlapping [date, end_date] are mapped, the rows are filtered (dates and key_filters, column -> values) and the
+    columns projected in Arrow, so pandas only materialises the result."""
+    all_years = read_manifest(version_dir)['years']
+    start_day = int(to_epoch_days([date])[0]) if date else None
+    end_day = int(to_epoch_days([end_date])[0]) if end_date else None
+    years = [year for year in all_years if (start_day is None or year >= epoch_day_to_date(start_day).year)
+             and (end_day is None or year <= epoch_day_to_date(end_day).year)]
+    tables = [read_partition(_partition_path(version_dir, year)) for year in years or all_years[:1]]
+    table = pa.concat_tables(tables) if years else tables[0].slice(0, 0)
+
+    masks = []
+    if start_day is not None:
+        masks.append(pc.greater_equal(table['date'], pa.scalar(epoch_day_to_date(start_day), pa.date32())))
+    if end_day is not None:
+        masks.append(pc.less_equal(table['date'], pa.scalar(epoch_day_to_date(end_day), pa.date32())))
+    for column, values in (key_filters or {}).items():
+        masks.append(pc.is_in(table[column], value_set=pa.array(list(values), pa.string())))
+    if masks:
+        mask = masks[0]
+        for other_mask in masks[1:]:
+            mask = pc.and_(mask, other_mask)
+        table = table.filter(mask)
+    if columns:
+        table = table.select(columns)
+
+    df = table.to_pandas(date_as_object=False)
+    if 'date' in df.columns:
+        df['date'] = df['date'].astype('datetime64[ns]')
+    return df
+
+
+def fetch_time_series(sql_conn, table_name: str, store_dir: Optional[str] = None, date: str = None,
+                      columns: Optional[List[str]] = None, tickers: Optional[List[str]] = None,
+                      sub_industries: Optional[List[str]] = None, sectors: Optional[List[str]] = None,
+                      end_date: str = None) -> pd.DataFrame:
+    # fetch_table_data, from the columnar copy when there is one and it is up to date
+    version_dir = None
+    if store_dir and columnar_available() and table_name in COLUMNAR_TABLES:
+        version_dir = current_columnar_version(sql_conn, store_dir, table_name)
+    if version_dir is None:
+        return fetch_table_data(sql_conn, table_name, date, columns=columns, tickers=tickers,
+                                sub_industries=sub_industries, sectors=sectors, end_date=end_date)
+
+    key_filters = {}
+    if tickers is not None:
+        key_filters['ticker'] = list(tickers)
+    if sub_industries is not None or sectors is not None:
+        # resolved to the table's keys through company_info, as fetch_table_data does in SQL
+        key_column = 'sub_industry' if table_name.startswith('industry') else 'ticker'
+        df_keys = fetch_table_data(sql_conn, 'company_info', columns=[key_column], sub_industries=sub_industries,
+                                   sectors=sectors)
+        keys = set(df_keys[key_column])
+        key_filters[key_column] = list(keys & set(key_filters[key_column]) if key_column in key_filters else keys)
+    return read_columnar_table(version_dir, date, end_date, columns, key_filters)
+
+
+def fetch_price_history(sql_conn, table_name: str, store_dir: Optional[str] = None, date: str = None,
+                        columns: Optional[List[str]] = None, tickers: Optional[List[str]] = None,
+                        sub_industries: Optional[List[str]] = None, sectors: Optional[List[str]] = None,
+                        end_date: str = None) -> pd.DataFrame:
+    """fetch_time_series of a daily price table of retention.py: the days the daily rows are kept for are read from
+    them, and the part of the range (or the whole history) before them from the weekly and then the monthly bars.
+    The bars have the daily table's columns, dated by the last trading day of their week or month."""
+    ranges = tier_ranges(price_tiers(sql_conn, table_name), int(to_epoch_days([date])[0]) if date else None,
+                         int(to_epoch_days([end_date])[0]) if end_date else None)
+    filters = dict(tickers=tickers, sub_industries=sub_industries, sectors=sectors)
+    if len(ranges) > 1 or ranges[0][0] != 'daily':
+        columns = columns or tier_columns(table_name)
+    frames = []
+    for tier, first_day, last_day in ranges:
+        first_date = epoch_day_to_date(first_day) if first_day is not None else None
+        last_date = epoch_day_to_date(last_day) if last_day is not None else None
+        if tier == 'daily':
+            frames.append(fetch_time_series(sql_conn, table_name, store_dir, first_date, columns, end_date=last_date,
+                                            **filters))
+        else:
+            frames.append(fetch_table_data(sql_conn, bar_table_name(table_name, tier), first_date, columns=columns,
+                                           end_date=last_date, **filters))
+    # a tier with no rows in the range would take part in the dtypes of the concatenation
+    frames = [df for df in frames if not df.empty] or frames[:1]
+    return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+
+@click.command()
+@click.option('--rebuild', is_flag=True, default=False, help='Export every partition again instead of the changed years')
+def execute(rebuild):
+    from .db import initialize_db_connection, close_db
+    from ..comparison_tool.constants import DB_PATH, COLUMNAR_DIR
+
+    sql_conn = initialize_db_connection(DB_PATH)
+    export_columnar_store(sql_conn, COLUMNAR_DIR, rebuild)
+    close_db(sql_conn, DB_PATH)
+
+
+if __name__ == '__main__':
+    execute()
@@ -1 +1,27 @@
 TICKERS = ["AAPL", "MSFT", "GOOGL", "AMZN"]
+
+# Concurrent ingestion settings:
+YAHOO_HOST = "query2.finance.yahoo.com"
+MAX_INGESTION_WORKERS = 8
+REQUESTS_PER_SECOND = 5.0  # per host, shared by all workers
+TICKER_TIMEOUT_SECONDS = 120
+MAX_TRANSFORM_WORKERS = None  # processes for the statement transforms, None uses every core
+INGESTION_BATCH_SIZE = 100  # tickers fetched, transformed and written together
+INGESTION_MAX_ATTEMPTS = 3
+RETRY_BACKOFF_SECONDS = 30  # doubled after every failed attempt
+PRICE_HISTORY_CHUNK_SIZE = 100  # tickers per yf.download call
+BULK_LOAD_CHUNK_ROWS = 50_000  # rows converted and sent to executemany at a time
+
+# Days before stored data is considered stale, by asset class (0 = refresh daily):
+STALENESS_DAYS = {'equity': 14, 'commodity': 0, 'index_fund': 0, 'etf': 0, 'fx': 0}
+SCHEDULER_INTERVAL_SECONDS = 6 * 60 * 60  # time between refresh cycles of the ingestion scheduler
+SNAPSHOTS_KEPT = 2  # published snapshots kept on disk, the current one and the one readers may still have open
+COLUMNAR_VERSIONS_KEPT = 2  # exports of each columnar table kept on disk, for the same reason
+# Engine of the first, full builds of the price and industry aggregations (the refreshes after it aggregate only the
+# new rows, in SQLite). 'duckdb' needs duckdb installed and falls back to 'sqlite' without it:
+AGGREGATION_ENGINE = 'sqlite'
+# Tiered price retention (retention.py): days of daily prices kept, more than a year as the YoY aggregations join each
+# new day to the day a year before it, then days of weekly bars kept (monthly bars are kept for good):
+DAILY_RETENTION_DAYS = 2 * 365
+WEEKLY_RETENTION_DAYS = 5 * 365
+VACUUM_FREE_FRACTION = 0.25  # VACUUM once this fraction of the database file is free pages
@@ -0,0 +1,49 @@
+"""Dates are stored as epoch days: INTEGER days since 1970-01-01, in every table.
+Conversion happens only at the boundary (inserts and fetch_table_data), a whole column at a time."""
+
+import numpy as np
+import pandas as pd
+from datetime import date, timedelta
+from typing import Optional
+
+EPOCH = date(1970, 1, 1)
+EPOCH_DAY_COLUMNS = ('date', 'version date')
+
+
+def to_epoch_days(values) -> np.ndarray:
+    # dates, datetimes, 'YYYY-MM-DD' strings or datetime64 values (tz-aware ones at their local date) -> int64 days
+    dates = pd.DatetimeIndex(pd.to_datetime(values))
+    if dates.tz is not None:
+        dates = dates.tz_localize(None)
+    return dates.values.astype('datetime64[D]').astype(np.int64)
+
+
+def from_epoch_days(values) -> pd.Series:
+    # int64 days (NULLs as NaN) -> datetime64 column, no per-row parsing or formatting
+    return pd.to_datetime(values, unit='D')
+
+
+def epoch_day(day: Optional[date] = None) -> int:
+    # a single date (default today) as epoch days, e.g. for query parameters
+    return ((day or date.today()) - EPOCH).days
+
+
+def epoch_day_to_date(days: int) -> date:
+    return EPOCH + timedelta(days=int(days))
+
+
+def encode_date_columns(df: pd.DataFrame) -> pd.DataFrame:
+    date_columns = [col for col in EPOCH_DAY_COLUMNS if col in df.columns and not pd.api.types.is_integer_dtype(df[col])]
+    if not date_columns:
+        return df
+    df = df.copy()
+    for col in date_columns:
+        df[col] = to_epoch_days(df[col])
+    return df
+
+
+def decode_date_columns(df: pd.DataFrame) -> pd.DataFrame:
+    for col in EPOCH_DAY_COLUMNS:
+        if col in df.columns:
+            df[col] = from_epoch_days(df[col])
+    return df
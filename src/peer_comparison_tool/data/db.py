@@ -1,5 +1,11 @@
+import queue
 import sqlite3
+import threading
 import pandas as pd
+from contextlib import contextmanager
+from typing import Optional
+
+from .snapshot import current_snapshot
 
 
 #Tables that we will create:
@@ -12,15 +18,152 @@ import pandas as pd
 # seems best to create them when we fetch the data and then just read them into the app data
 #
 
-def initialize_db_connection(db_name=None):
-    # Connect to SQLite (or create the database if it doesn't exist)
+# Applied to every connection. WAL lets readers carry on against the last commit while the ingestion writes:
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',  # safe with WAL, only the last transactions can be lost on power failure
+    'cache_size': -64_000,  # in KiB, i.e. 64MB page cache per connection
+    'mmap_size': 256 * 1024 ** 2,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5_000,  # ms to wait on a lock instead of failing straight away
+}
+READ_POOL_SIZE = 8
+
+
+def configure_connection(conn, read_only: bool = False):
+    for pragma, value in SQLITE_PRAGMAS.items():
+        if read_only and pragma == 'journal_mode':
+            continue  # set by the writer, it is stored in the database file
+        conn.execute(f"PRAGMA {pragma} = {value}")
+    if read_only:
+        conn.execute("PRAGMA query_only = 1")
+    return conn
+
+
+def initialize_db_connection(db_name=None, read_only: bool = False, immutable: bool = False):
+    # Connect to SQLite (or create the database if it doesn't exist). immutable is for read-only connections to a
+    # file nothing writes to any more (a published snapshot): SQLite then skips all locking and change detection
     if db_name is None:
         raise ValueError("Must supply a db name to begin connection")
-    conn = sqlite3.connect(db_name)
-    print(f'Connection to {db_name} created.')
+    if read_only:
+        # pooled readers are handed between the Dash server threads, one thread at a time
+        uri = f"file:{db_name}?mode=ro&immutable=1" if immutable else f"file:{db_name}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    else:
+        conn = sqlite3.connect(db_name)
+    configure_connection(conn, read_only)
+    print(f'{"Read-only connection" if read_only else "Connection"} to {db_name} created.')
     return conn
 
 
+class ConnectionManager:
+    # One writer connection for the ingestion and a pool of read-only connections for the app callbacks.
+    # Readers are opened lazily up to pool_size; with WAL they never wait on the writer.
+    # With a snapshot_dir the readers open the published snapshot instead (data/snapshot.py), immutable, and move to
+    # the next snapshot when it is published: idle readers of an older one are closed on their next checkout and
+    # readers in use when they are returned. Until the first publish they read db_name.
+    def __init__(self, db_name: str, pool_size: int = READ_POOL_SIZE, snapshot_dir: Optional[str] = None):
+        self.db_name = db_name
+        self.pool_size = pool_size
+        self.snapshot_dir = snapshot_dir
+        self._writer = None
+        self._readers = queue.LifoQueue()  # (connection, the database file it reads)
+        self._opened_readers = 0
+        self._open_connections = set()  # every open reader, idle or checked out
+        self._lock = threading.Lock()
+
+    @property
+    def writer(self):
+        if self._writer is None:
+            self._writer = initialize_db_connection(self.db_name)
+        return self._writer
+
+    def reader_db_name(self) -> str:
+        # the file readers open now: the current snapshot, or the working database
+        snapshot = current_snapshot(self.snapshot_dir) if self.snapshot_dir else None
+        return snapshot or self.db_name
+
+    @contextmanager
+    def reader(self):
+        conn, db_name = self._checkout_reader()
+        try:
+            yield conn
+        finally:
+            # not returned to the pool when close() ran while it was in use, or a newer snapshot was published
+            if conn in self._open_connections and db_name == self.reader_db_name():
+                self._readers.put((conn, db_name))
+            else:
+                self._close_reader(conn)
+
+    def _open_reader(self, db_name: str):
+        if db_name == self.db_name and self._writer is None:
+            self.writer  # the writer creates the database and switches it to WAL first
+        conn = initialize_db_connection(db_name, read_only=True, immutable=db_name != self.db_name)
+        with self._lock:
+            self._open_connections.add(conn)
+        return conn
+
+    def _close_reader(self, conn):
+        conn.close()
+        with self._lock:
+            if conn in self._open_connections:  # else close() already gave its slot back
+                self._open_connections.remove(conn)
+                self._opened_readers -= 1
+
+    def _checkout_reader(self):
+        db_name = self.reader_db_name()
+        while True:
+            try:
+                conn, conn_db_name = self._readers.get_nowait()
+            except queue.Empty:
+                break
+            if conn_db_name == db_name:
+                return conn, db_name
+            self._close_reader(conn)
+        with self._lock:
+            can_open = self._opened_readers < self.pool_size
+            if can_open:
+                self._opened_readers += 1
+        if can_open:
+            return self._open_reader(db_name), db_name
+        conn, conn_db_name = self._readers.get()  # pool exhausted, wait for a reader to come back
+        if conn_db_name != db_name:
+            conn.close()  # reopened on the current snapshot in the same pool slot
+            with self._lock:
+                self._open_connections.discard(conn)
+            conn = self._open_reader(db_name)
+        return conn, db_name
+
+    def close(self):
+        # every connection, the readers still checked out included, so call it once the app stopped serving
+        with self._lock:
+            connections = list(self._open_connections)
+            self._open_connections.clear()
+            self._opened_readers = 0
+        for conn in connections:
+            conn.close()
+        while True:
+            try:
+                self._readers.get_nowait()
+            except queue.Empty:
+                break
+        if self._writer is not None:
+            self._writer.execute("PRAGMA optimize")
+            self._writer.close()
+            self._writer = None
+        print(f'Connections to {self.db_name} closed.')
+
+
+@contextmanager
+def read_connection(db):
+    # a pooled reader from a ConnectionManager, or the plain connection itself
+    if isinstance(db, ConnectionManager):
+        with db.reader() as conn:
+            yield conn
+    else:
+        yield db
+
+
 def close_db(conn, db_name=None):
     if db_name is None:
         print('Please give the database name')
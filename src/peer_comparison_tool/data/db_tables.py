@@ -1,11 +1,14 @@
-from db import initialize_db_connection, close_db
+from .db import initialize_db_connection, close_db
+from .queries import query_create_data_record_version_index
 import os
 
+# Tables are only created here (IF NOT EXISTS) by the baseline migration, any later change to them is a new
+# migration in migrations.py so existing data never has to be dropped and fetched again.
+# Later migrations change these tables, e.g. every date column is an INTEGER of epoch days from migration 3 on.
+# The create_* functions take the migration's cursor and leave the commit to migrate().
 
-def create_company_table(conn):
-    cur = conn.cursor()
-    # query_drop = "DROP TABLE IF EXISTS company_info;"
-    # cur.execute(query_drop)
+
+def create_company_table(cur):
     query = """
         CREATE TABLE IF NOT EXISTS company_info (
             ticker TEXT NOT NULL PRIMARY KEY,
@@ -16,17 +19,10 @@ def create_company_table(conn):
         )
     """
     cur.execute(query)
-    conn.commit()
-    cur.close()
     print('Created table Company table.')
 
 
-def create_ticker_time_series_table(conn):
-    cur = conn.cursor()
-
-    query_drop = "DROP TABLE IF EXISTS ticker_time_series;"
-    cur.execute(query_drop)
-
+def create_ticker_time_series_table(cur):
     query = """
         CREATE TABLE IF NOT EXISTS ticker_time_series (
             ticker TEXT NOT NULL,
@@ -38,17 +34,10 @@ def create_ticker_time_series_table(conn):
         )
     """
     cur.execute(query)
-    conn.commit()
-    cur.close()
     print('Create ticker time series table')
 
 
-def create_asset_class_ts_table(conn):
-    cur = conn.cursor()
-
-    # query_drop = "DROP TABLE IF EXISTS asset_class_time_series;"
-    # cur.execute(query_drop)
-
+def create_asset_class_ts_table(cur):
     query = """
         CREATE TABLE IF NOT EXISTS asset_class_time_series (
             ticker TEXT NOT NULL,
@@ -61,17 +50,10 @@ def create_asset_class_ts_table(conn):
         )
     """
     cur.execute(query)
-    conn.commit()
-    cur.close()
     print('Create asset class time series table')
 
 
-def create_quarterly_report_financial_data(conn):
-    cur = conn.cursor()
-
-    query_drop = "DROP TABLE IF EXISTS quarterly_financial_data;"
-    cur.execute(query_drop)
-
+def create_quarterly_report_financial_data(cur):
     query = """
         CREATE TABLE IF NOT EXISTS quarterly_financial_data (
             ticker TEXT NOT NULL,
@@ -90,17 +72,10 @@ def create_quarterly_report_financial_data(conn):
         )
     """
     cur.execute(query)
-    conn.commit()
-    cur.close()
     print('Create quarterly financials table')
 
 
-def create_balance_sheet_report_data(conn):
-    cur = conn.cursor()
-
-    query_drop = "DROP TABLE IF EXISTS balance_sheet_data;"
-    cur.execute(query_drop)
-
+def create_balance_sheet_report_data(cur):
     query = """
         CREATE TABLE IF NOT EXISTS balance_sheet_data (
             ticker TEXT NOT NULL,
@@ -117,17 +92,10 @@ def create_balance_sheet_report_data(conn):
         )
     """
     cur.execute(query)
-    conn.commit()
-    cur.close()
     print('Create balance sheet table')
 
 
-def create_cashflow_statement(conn):
-    cur = conn.cursor()
-
-    query_drop = "DROP TABLE IF EXISTS cashflow_statement_data;"
-    cur.execute(query_drop)
-
+def create_cashflow_statement(cur):
     query = """
         CREATE TABLE IF NOT EXISTS cashflow_statement_data (
             ticker TEXT NOT NULL,
@@ -139,20 +107,12 @@ def create_cashflow_statement(conn):
         )
     """
     cur.execute(query)
-    conn.commit()
-    cur.close()
     print("Create cash flow statement table")
 
 
-def create_tickers_most_recent_metrics(conn):
+def create_tickers_most_recent_metrics(cur):
     # This is taken from the most recent data for the ticker:
-    # TODO delete and remake - should look up how to do migrations i guess
-
-    cur = conn.cursor()
-
-    query_drop = "DROP TABLE IF EXISTS ticker_most_recent_metric_data;"
-    cur.execute(query_drop)
-
+    # schema changes go in migrations.py, never drop the table
     query = """
         CREATE TABLE IF NOT EXISTS ticker_most_recent_metric_data (
             ticker TEXT NOT NULL PRIMARY KEY,
@@ -168,17 +128,10 @@ def create_tickers_most_recent_metrics(conn):
         )
     """
     cur.execute(query)
-    conn.commit()
-    cur.close()
     print("Create ticker most recent metrics table")
 
 
-def create_cluster_data(conn):
-    cur = conn.cursor()
-
-    query_drop = "DROP TABLE IF EXISTS cluster_table;"
-    cur.execute(query_drop)
-
+def create_cluster_data(cur):
     query = """
         CREATE TABLE IF NOT EXISTS cluster_table (
             ticker TEXT NOT NULL,
@@ -188,17 +141,10 @@ def create_cluster_data(conn):
         )
     """
     cur.execute(query)
-    conn.commit()
-    cur.close()
     print("Create cluster membership table")
 
 
-def create_ticker_ts_yoy(conn):
-    cur = conn.cursor()
-
-    query_drop = "DROP TABLE IF EXISTS ticker_ts_yoy;"
-    cur.execute(query_drop)
-
+def create_ticker_ts_yoy(cur):
     query = """
         CREATE TABLE IF NOT EXISTS ticker_ts_yoy (
             ticker TEXT NOT NULL,
@@ -209,17 +155,10 @@ def create_ticker_ts_yoy(conn):
         )
     """
     cur.execute(query)
-    conn.commit()
-    cur.close()
     print("Create cluster membership table")
 
 
-def create_industry_aggregated_time_series_table(conn):
-    cur = conn.cursor()
-
-    query_drop = "DROP TABLE IF EXISTS industry_time_series;"
-    cur.execute(query_drop)
-
+def create_industry_aggregated_time_series_table(cur):
     query = """
         CREATE TABLE IF NOT EXISTS industry_time_series (
             sub_industry TEXT NOT NULL,
@@ -230,18 +169,10 @@ def create_industry_aggregated_time_series_table(conn):
         )
     """
     cur.execute(query)
-    conn.commit()
-    cur.close()
     print("Create industry aggregated price table")
 
 
-def create_industry_aggregated_ts_yoy(conn):
-
-    cur = conn.cursor()
-
-    query_drop = "DROP TABLE IF EXISTS industry_time_series_yoy;"
-    cur.execute(query_drop)
-
+def create_industry_aggregated_ts_yoy(cur):
     query = """
         CREATE TABLE IF NOT EXISTS industry_time_series_yoy (
             sub_industry TEXT NOT NULL,
@@ -252,17 +183,10 @@ def create_industry_aggregated_ts_yoy(conn):
         )
     """
     cur.execute(query)
-    conn.commit()
-    cur.close()
     print("Create industry aggregated yoy price table")
 
 
-def create_ticker_report_yoy_data(conn):
-    cur = conn.cursor()
-
-    query_drop = "DROP TABLE IF EXISTS ticker_metrics_yoy;"
-    cur.execute(query_drop)
-
+def create_ticker_report_yoy_data(cur):
     query = """
         CREATE TABLE IF NOT EXISTS ticker_metrics_yoy (
             ticker TEXT NOT NULL,
@@ -279,17 +203,10 @@ def create_ticker_report_yoy_data(conn):
         )
     """
     cur.execute(query)
-    conn.commit()
-    cur.close()
     print('Create individual ticker YoY table')
 
 
-def create_industry_report_metrics_data(conn):
-    cur = conn.cursor()
-
-    query_drop = "DROP TABLE IF EXISTS industry_metrics;"
-    cur.execute(query_drop)
-
+def create_industry_report_metrics_data(cur):
     query = """
         CREATE TABLE IF NOT EXISTS industry_metrics (
             sub_industry TEXT NOT NULL,
@@ -306,17 +223,10 @@ def create_industry_report_metrics_data(conn):
         )
     """
     cur.execute(query)
-    conn.commit()
-    cur.close()
     print('Create industry metrics table')
 
 
-def create_industry_report_yoy_data(conn):
-    cur = conn.cursor()
-
-    query_drop = "DROP TABLE IF EXISTS industry_metrics_yoy;"
-    cur.execute(query_drop)
-
+def create_industry_report_yoy_data(cur):
     query = """
         CREATE TABLE IF NOT EXISTS industry_metrics_yoy (
             sub_industry TEXT NOT NULL,
@@ -333,17 +243,10 @@ def create_industry_report_yoy_data(conn):
         )
     """
     cur.execute(query)
-    conn.commit()
-    cur.close()
     print('Create industry metrics YoY table')
 
 
-def create_data_record_table(conn):
-    cur = conn.cursor()
-
-    query_drop = "DROP TABLE IF EXISTS data_storage_record;"
-    cur.execute(query_drop)
-
+def create_data_record_table(cur):
     query = """
         CREATE TABLE IF NOT EXISTS data_storage_record (
             ticker TEXT NOT NULL,
@@ -352,9 +255,14 @@ def create_data_record_table(conn):
         )
     """
     cur.execute(query)
-    conn.commit()
-    cur.close()
     print('Create date record table')
+    create_data_record_index(cur)
+
+
+def create_data_record_index(cur):
+    # for the set-based recency check: range scan on version date, covering the ticker
+    cur.execute(query_create_data_record_version_index)
+    print('Create date record version date index')
 
 
 # We need the aggregated tables that are created every time data is updated:
@@ -362,26 +270,14 @@ def create_data_record_table(conn):
 # also need to recreate the cluster labels
 
 if __name__ == '__main__':
-    # Script to create tables:
+    # Script to create or upgrade the tables, from the repo root:
+    # python -m src.peer_comparison_tool.data.db_tables
+    from .migrations import migrate
+
     db_folder = os.path.join(os.path.dirname(__file__), "..", "comparison_tool")
     db_path = os.path.join(db_folder, "comparison_tool.db")
     db_conn = initialize_db_connection(db_path)
-
-    # create_company_table(db_conn)  # done
-    # create_ticker_time_series_table(db_conn)  # done
-    # create_quarterly_report_financial_data(db_conn)
-    # create_balance_sheet_report_data(db_conn)
-    # create_cashflow_statement(db_conn)
-    # create_cluster_data(db_conn)
-    # create_ticker_ts_yoy(db_conn)
-    # create_data_record_table(db_conn)
-    # create_tickers_most_recent_metrics(db_conn)
-    # create_industry_aggregated_time_series_table(db_conn)
-    # create_industry_aggregated_ts_yoy(db_conn)
-    # create_ticker_report_yoy_data(db_conn)
-    # create_industry_report_metrics_data(db_conn)
-    # create_industry_report_yoy_data(db_conn)
-    create_asset_class_ts_table(db_conn)
+    migrate(db_conn)
 
     # print the names of all tables in the db:
     cursor = db_conn.cursor()
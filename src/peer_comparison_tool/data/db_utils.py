@@ -1,14 +1,30 @@
 import sqlite3
 import pandas as pd
 import numpy as np
-from datetime import datetime, date
-from dateutil.relativedelta import relativedelta
-
-from .queries import query_ticker_time_series_yoy, query_create_industry_price_aggregation, \
-    query_create_industry_price_yoy_aggregation, query_create_industry_metric_aggregation
+from typing import Dict, List, Optional, Tuple
+
+from .queries import query_ticker_price_history_bounds, query_latest_versions_since, \
+    query_select_table, query_most_recent_per_key, query_delete_ticker_rows, query_delete_industry_rows_for_tickers, \
+    query_delete_industry_rows_for_ticker_since
+from .constants import STALENESS_DAYS
+from .aggregation_engine import aggregate_ticker_price_yoy, aggregate_industry_prices, aggregate_industry_price_yoy, \
+    aggregate_industry_metrics, FULL_HISTORY
+from .retention import TIERED_TABLES, BAR_TIERS, bar_table_name, price_tiers
+from .dates import epoch_day, to_epoch_days, decode_date_columns
+from .bulk_load import bulk_load
 
 YOY_METRICS = ['close_price', 'close_price_indexed']
 
+# The tables fetch_table_data reads and the key column their rows are per (None: no dated rows per key):
+TABLE_KEY_COLUMNS = {
+    'company_info': None, 'ticker_most_recent_metric_data': None, 'data_storage_record': None,
+    'ticker_time_series': 'ticker', 'ticker_ts_yoy': 'ticker', 'asset_class_time_series': 'ticker',
+    'quarterly_financial_data': 'ticker', 'balance_sheet_data': 'ticker', 'cashflow_statement_data': 'ticker',
+    'ticker_metrics_yoy': 'ticker', 'cluster_table': 'ticker',
+    'industry_time_series': 'sub_industry', 'industry_time_series_yoy': 'sub_industry',
+    'industry_metrics': 'sub_industry', 'industry_metrics_yoy': 'sub_industry',
+} | {bar_table_name(table, tier): 'ticker' for table in TIERED_TABLES for tier in BAR_TIERS}
+
 
 # Function to insert quarterly report data into the SQLite database
 def insert_quarterly_data(db_name, ticker, data):
@@ -19,7 +35,7 @@ def insert_quarterly_data(db_name, ticker, data):
         cursor.execute('''
             INSERT OR IGNORE INTO quarterly_reports (ticker, date, eps, revenue, net_income)
             VALUES (?, ?, ?, ?, ?)
-        ''', (ticker, row.Index.strftime('%Y-%m-%d'), row.Earnings, row.Revenue, row.NetIncome))
+        ''', (ticker, epoch_day(row.Index.date()), row.Earnings, row.Revenue, row.NetIncome))
 
     conn.commit()
     conn.close()
@@ -35,46 +51,72 @@ def read_ticker_from_db_table(db_name, table, ticker):
     return df
 
 
-def check_ticker_data_recency(conn, ticker) -> bool:
-
-    cur = conn.cursor()
-    cur.execute("""SELECT MAX("version date") from data_storage_record where ticker = ?""", (ticker, ))
-    result = cur.fetchone()
-    cur.close()
-
-    # today date
-    date_today = datetime.now().date()
-    if result[0] is None or (datetime.strptime(result[0], "%Y-%m-%d").date() < date_today - relativedelta(days=14)):
-        # print("No recent data versions found - retrieving new data")
-        return False
-
-    else:
-        # print("Recent data found - not retrieving new data")
-        return True
-
-
-def check_asset_data_recency(conn, ticker) -> bool:
-    cur = conn.cursor()
-    cur.execute("""SELECT MAX("version date") from data_storage_record where ticker = ?""", (ticker, ))
-    result = cur.fetchone()
-    cur.close()
-
-    # today date
-    date_today = datetime.now().date()
-    if result[0] is None or (datetime.strptime(result[0], "%Y-%m-%d").date() < date_today):
-        # print("No recent data versions found - retrieving new data")
-        return False
-
-    else:
-        # print("Recent data found - not retrieving new data")
-        return True
-
-
-def update_ticker_yoy_aggregations(sql_conn):
+def fetch_price_history_bounds(conn) -> pd.DataFrame:
+    # first/last stored date and the close the index is based on for every ticker in ticker_time_series, in one query
+    return pd.read_sql_query(query_ticker_price_history_bounds, conn)
+
+
+def delete_ticker_price_history(cursor, df_bounds: pd.DataFrame):
+    """Remove the stored prices of the tickers of df_bounds (fetch_price_history_bounds rows) and the series derived
+    from them so they are rebuilt from scratch. Their sub-industries' rows are only rebuilt from each ticker's first
+    stored date on, and not before the daily tier of retention.py: before it only the bars are left, so those industry
+    rows are kept rather than summed again over these tickers alone."""
+    tickers = df_bounds['ticker'].to_list()
+    placeholders = ", ".join(["?"] * len(tickers))
+    bar_tables = [bar_table_name('ticker_time_series', tier) for tier in BAR_TIERS]
+    for table in ['ticker_time_series', 'ticker_ts_yoy'] + bar_tables:
+        cursor.execute(query_delete_ticker_rows.format(table_name=table, placeholders=placeholders), tickers)
+    daily_tier = price_tiers(cursor.connection, 'ticker_time_series').get('daily')
+    first_days = df_bounds['first_date'].clip(lower=daily_tier.first_day if daily_tier is not None else FULL_HISTORY)
+    for table in ['industry_time_series', 'industry_time_series_yoy']:
+        cursor.executemany(query_delete_industry_rows_for_ticker_since.format(table_name=table),
+                           [(ticker, int(first_day)) for ticker, first_day in zip(tickers, first_days)])
+
+
+def partition_by_recency(conn, ticker_asset_classes: Dict[str, str],
+                         staleness_days: Dict[str, int] = None) -> Tuple[List[str], List[str]]:
+    """Split the whole universe into (stale, fresh) tickers with a single query over data_storage_record.
+    ticker_asset_classes maps each ticker to its asset class, whose threshold in staleness_days applies."""
+    staleness_days = STALENESS_DAYS | (staleness_days or {})
+    today = epoch_day()
+    cutoffs = {asset_class: today - days
+               for asset_class, days in staleness_days.items()}
+    # only versions newer than the oldest cutoff can make a ticker fresh - a range scan on the version date index:
+    df_versions = pd.read_sql_query(query_latest_versions_since, conn, params=[min(cutoffs.values())])
+    last_versions = dict(zip(df_versions['ticker'], df_versions['last_version']))
+
+    stale, fresh = [], []
+    for ticker, asset_class in ticker_asset_classes.items():
+        last_version = last_versions.get(ticker)
+        if last_version is not None and last_version >= cutoffs[asset_class]:
+            fresh.append(ticker)
+        else:
+            stale.append(ticker)
+    return stale, fresh
+
+
+def delete_restated_metrics(cursor, tickers):
+    # remove the YoY and industry metrics built from restated statements, the aggregations then rebuild them
+    placeholders = ", ".join(["?"] * len(tickers))
+    cursor.execute(query_delete_ticker_rows.format(table_name='ticker_metrics_yoy', placeholders=placeholders), tickers)
+    for table in ['industry_metrics', 'industry_metrics_yoy']:
+        cursor.execute(query_delete_industry_rows_for_tickers.format(table_name=table, placeholders=placeholders),
+                       tickers)
+
+
+def update_ticker_yoy_aggregations(sql_conn, tickers: Optional[List[str]] = None, engine: str = 'sqlite'):
+    # tickers: only recompute the metric YoY of these (the ones with new or changed statements), default all
+    # engine: 'duckdb' runs a first build of the price YoY in DuckDB (see resolve_aggregation_engine)
     cur = sql_conn.cursor()
-    cur.execute(query_ticker_time_series_yoy)
+    aggregate_ticker_price_yoy(cur, engine)
+    if tickers is not None and not tickers:
+        cur.close()
+        return
     # lets do this outside of query:
-    df_quarter = fetch_table_data(sql_conn, 'quarterly_financial_data', force_date_conversion=True)
+    if tickers is None:
+        df_quarter = fetch_table_data(sql_conn, 'quarterly_financial_data')
+    else:
+        df_quarter = fetch_table_data(sql_conn, 'quarterly_financial_data', tickers=tickers)
     df_quarter_lagged = df_quarter.copy()
     df_quarter_lagged['date'] = pd.to_datetime(df_quarter_lagged['date']) + pd.DateOffset(years=1)
     df_quarter_lagged['date_moved'] = df_quarter_lagged['date'] - pd.DateOffset(months=1)
@@ -89,14 +131,22 @@ def update_ticker_yoy_aggregations(sql_conn):
     return
 
 
-def update_industry_aggregations(sql_conn):
+def update_industry_aggregations(sql_conn, sub_industries: Optional[List[str]] = None, engine: str = 'sqlite'):
     # here we just merge on the industry to each ticker and then aggregate:
+    # sub_industries: only aggregate the metrics and recompute the metric YoY of these, default all
+    # engine: 'duckdb' runs the full builds of the price and metric aggregations in DuckDB
     cur = sql_conn.cursor()
-    cur.execute(query_create_industry_price_aggregation)
-    cur.execute(query_create_industry_price_yoy_aggregation)
-    cur.execute(query_create_industry_metric_aggregation)
+    aggregate_industry_prices(cur, engine)
+    aggregate_industry_price_yoy(cur, engine)
+    aggregate_industry_metrics(cur, sub_industries, engine)
+    if sub_industries is not None and not sub_industries:
+        cur.close()
+        return
     # TODO move this to a create_metrics_yoy_func
-    df_quarter = fetch_table_data(sql_conn, 'industry_metrics', force_date_conversion=True)
+    if sub_industries is None:
+        df_quarter = fetch_table_data(sql_conn, 'industry_metrics')
+    else:
+        df_quarter = fetch_table_data(sql_conn, 'industry_metrics', sub_industries=sub_industries)
     df_quarter_lagged = df_quarter.copy()
     df_quarter_lagged['date'] = pd.to_datetime(df_quarter_lagged['date']) + pd.DateOffset(years=1)
     df_quarter_lagged['date_moved'] = df_quarter_lagged['date'] - pd.DateOffset(months=1)
@@ -119,7 +169,7 @@ def update_other_asset_classes(retriever, conn):
     record_data_cols = ['ticker', 'version date']
     record_data_saved = pd.DataFrame(
         {'ticker': list(retriever.non_stock_entities.keys()),
-         'version date': [date.today().strftime("%Y-%m-%d")]*len(list(retriever.non_stock_entities.keys()))}
+         'version date': epoch_day()}
     )
     insert_or_ignore(cur, 'data_storage_record', record_data_saved[record_data_cols])
     conn.commit()
@@ -128,45 +178,75 @@ def update_other_asset_classes(retriever, conn):
 
 
 def insert_or_replace(cursor, table, data):
-    # Some columns have spaces so we need to set column strings correctly first:
-    columns = [f'"{col}"' for col in data.columns]
-    columns_str = ", ".join(columns)
-    placeholders = ", ".join(["?"] * len(data.columns))
-    sql = f"INSERT OR REPLACE INTO {table} ({columns_str}) VALUES ({placeholders})"
-    cursor.executemany(sql, data.to_records(index=False).tolist())
+    bulk_load(cursor, table, data, on_conflict='REPLACE')
 
 
 def insert_or_ignore(cursor, table, dataframe):
-    columns = [f'"{col}"' for col in dataframe.columns]
-    columns_str = ", ".join(columns)
-    placeholders = ", ".join(["?"] * len(dataframe.columns))
-    sql = f"INSERT OR IGNORE INTO {table} ({columns_str}) VALUES ({placeholders})"
-    cursor.executemany(sql, dataframe.to_records(index=False).tolist())
-
-
-def fetch_table_data(sql_conn, table_name, date: str = None, most_recent: bool = False, force_date_conversion: bool = False):
-    # Use string formatting to dynamically set the table name
-    query = f"SELECT * FROM {table_name}"
-    if most_recent:
-        query = f"WITH RecentDates AS (SELECT ticker, max(date) as max_date FROM cluster_table GROUP BY ticker) " \
-                f"SELECT t1.* from {table_name} as t1 JOIN RecentDates as rd on t1.ticker = rd.ticker and " \
-                f"t1.date = rd.max_date"
-
-    if not most_recent and date:
-        query = f"SELECT *, datetime(date / 1000000000, 'unixepoch') as date_type FROM {table_name} where date_type >= {date}"
-
-    # Execute the query and load into a DataFrame
-    df = pd.read_sql_query(query, sql_conn)
-    if 'date' in df.columns and (df['date'].dtype == 'int' or force_date_conversion):
-        try:
-            df = unix_to_date_format(df, 'date')  # always 'date' column name?
-        except Exception as E:
-            print(E)
-    return df
-
-
-def unix_to_date_format(df: pd.DataFrame, date_col: str):
-    # It is in unix timestamps, first get to seconds and then convert to str format:
-    df[date_col] = pd.to_datetime(df[date_col].astype(int) // 10**9, unit='s').dt.strftime('%Y-%m-%d')
-    # need to drop duplicates now? This seems like an issue with reading or writing to SQL..
-    return df
+    bulk_load(cursor, table, dataframe, on_conflict='IGNORE')
+
+
+def _placeholders(values) -> str:
+    return ", ".join(["?"] * len(values))
+
+
+def build_table_query(sql_conn, table_name: str, columns: Optional[List[str]] = None, tickers: Optional[List[str]] = None,
+                      sub_industries: Optional[List[str]] = None, sectors: Optional[List[str]] = None,
+                      start_date: str = None, end_date: str = None, most_recent: bool = False) -> Tuple[str, list]:
+    """The SQL and parameters of a fetch_table_data call. Table and column names are checked against the schema,
+    every value is a parameter. Sub-industry and sector filters on tables without those columns go through
+    company_info."""
+    if table_name not in TABLE_KEY_COLUMNS:
+        raise ValueError(f"Unknown table {table_name}")
+    table_columns = [row[1] for row in sql_conn.execute(f'PRAGMA table_info("{table_name}")')]
+    unknown_columns = set(columns or []) - set(table_columns)
+    if unknown_columns:
+        raise ValueError(f"{table_name} has no columns {sorted(unknown_columns)}")
+    key_column = TABLE_KEY_COLUMNS[table_name]
+    if most_recent and key_column is None:
+        raise ValueError(f"{table_name} has no dated rows per key, it has no most recent rows")
+    if 'ticker' not in table_columns and tickers is not None:
+        raise ValueError(f"{table_name} has no ticker column to filter on")
+
+    # the column linking the rows to company_info, for the sub-industry and sector filters:
+    link_column = 'ticker' if 'ticker' in table_columns else 'sub_industry'
+    conditions, params = [], []
+    if tickers is not None:
+        conditions.append(f"t1.ticker IN ({_placeholders(tickers)})")
+        params += list(tickers)
+    for filter_column, values in [('sub_industry', sub_industries), ('sector', sectors)]:
+        if values is None:
+            continue
+        if filter_column in table_columns:
+            conditions.append(f"t1.{filter_column} IN ({_placeholders(values)})")
+        else:
+            conditions.append(f"t1.{link_column} IN (SELECT {link_column} FROM company_info "
+                              f"WHERE {filter_column} IN ({_placeholders(values)}))")
+        params += list(values)
+    # integer ranges on the stored epoch days:
+    if start_date:
+        conditions.append("t1.date >= ?")
+        params.append(int(to_epoch_days([start_date])[0]))
+    if end_date:
+        conditions.append("t1.date <= ?")
+        params.append(int(to_epoch_days([end_date])[0]))
+
+    columns_sql = ", ".join(f't1."{col}"' for col in columns) if columns else "t1.*"
+    query = query_most_recent_per_key if most_recent else query_select_table
+    sql = query.format(table_name=table_name, key_column=key_column, columns=columns_sql)
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    return sql, params
+
+
+def fetch_table_data(sql_conn, table_name, date: str = None, most_recent: bool = False,
+                     columns: Optional[List[str]] = None, tickers: Optional[List[str]] = None,
+                     sub_industries: Optional[List[str]] = None, sectors: Optional[List[str]] = None,
+                     end_date: str = None) -> pd.DataFrame:
+    """Read the rows and columns of a table that are needed, filtering and projecting in SQLite:
+    columns: the columns to return (default all), tickers / sub_industries / sectors: only these rows,
+    date / end_date: only rows dated in [date, end_date], most_recent: only the latest row of each ticker or
+    sub-industry (the other filters then apply to those rows). The date columns come back as datetime64."""
+    query, params = build_table_query(sql_conn, table_name, columns, tickers, sub_industries, sectors, date, end_date,
+                                      most_recent)
+    df = pd.read_sql_query(query, sql_conn, params=params)
+    return decode_date_columns(df)
@@ -0,0 +1,102 @@
+"""Persisted ingestion jobs with a status per ticker, so an interrupted refresh can be resumed"""
+
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from .queries import query_create_ingestion_job_table, query_create_ingestion_job_ticker_table
+
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+
+TICKER_PENDING = 'pending'
+TICKER_DONE = 'done'
+TICKER_FAILED = 'failed'
+TICKER_SKIPPED = 'skipped'  # invalid or delisted tickers, not retried
+
+
+def _now() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def create_job_tables(cur):
+    # no commit, the baseline migration creates them in its transaction
+    cur.execute(query_create_ingestion_job_table)
+    cur.execute(query_create_ingestion_job_ticker_table)
+
+
+def create_ingestion_job(conn, tickers_info_map: Dict[str, str]) -> int:
+    cur = conn.cursor()
+    create_job_tables(cur)
+    cur.execute("INSERT INTO ingestion_job (created_at, status) VALUES (?, ?)", (_now(), JOB_RUNNING))
+    job_id = cur.lastrowid
+    cur.executemany(
+        "INSERT INTO ingestion_job_ticker (job_id, ticker, sub_industry, status, updated_at) VALUES (?, ?, ?, ?, ?)",
+        [(job_id, ticker, sub_industry, TICKER_PENDING, _now()) for ticker, sub_industry in tickers_info_map.items()]
+    )
+    conn.commit()
+    cur.close()
+    return job_id
+
+
+def find_resumable_job(conn) -> Optional[int]:
+    # the most recent job that did not run to completion
+    cur = conn.cursor()
+    create_job_tables(cur)
+    cur.execute("SELECT MAX(job_id) FROM ingestion_job WHERE status = ?", (JOB_RUNNING, ))
+    result = cur.fetchone()
+    cur.close()
+    return result[0]
+
+
+def reconcile_job_tickers(conn, job_id: int, tickers_info_map: Dict[str, str]) -> Tuple[List[str], List[str]]:
+    """Make a resumed job's tickers the ones requested now: the requested tickers it does not have are added as pending,
+    and its unfinished tickers that are no longer requested are skipped. Returns the (added, dropped) tickers."""
+    cur = conn.cursor()
+    cur.execute("SELECT ticker, status FROM ingestion_job_ticker WHERE job_id = ?", (job_id, ))
+    job_statuses = dict(cur.fetchall())
+    added = [ticker for ticker in tickers_info_map if ticker not in job_statuses]
+    dropped = [ticker for ticker, status in job_statuses.items()
+               if ticker not in tickers_info_map and status in (TICKER_PENDING, TICKER_FAILED)]
+    cur.executemany(
+        "INSERT INTO ingestion_job_ticker (job_id, ticker, sub_industry, status, updated_at) VALUES (?, ?, ?, ?, ?)",
+        [(job_id, ticker, tickers_info_map[ticker], TICKER_PENDING, _now()) for ticker in added]
+    )
+    cur.executemany(
+        "UPDATE ingestion_job_ticker SET status = ?, last_error = ?, updated_at = ? WHERE job_id = ? AND ticker = ?",
+        [(TICKER_SKIPPED, 'not requested when the job was resumed', _now(), job_id, ticker) for ticker in dropped]
+    )
+    conn.commit()
+    cur.close()
+    return added, dropped
+
+
+def get_outstanding_tickers(conn, job_id: int, max_attempts: int) -> Dict[str, str]:
+    # pending tickers plus failed tickers that still have retries left, in the order they were added
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT ticker, sub_industry FROM ingestion_job_ticker
+        WHERE job_id = ? AND (status = ? OR (status = ? AND attempts < ?))
+        ORDER BY rowid
+    """, (job_id, TICKER_PENDING, TICKER_FAILED, max_attempts))
+    outstanding = dict(cur.fetchall())
+    cur.close()
+    return outstanding
+
+
+def update_ticker_status(cursor, job_id: int, tickers: List[str], status: str, error: Optional[str] = None):
+    # Not committed here: the caller commits the statuses in the same transaction as the batch data
+    cursor.executemany("""
+        UPDATE ingestion_job_ticker SET status = ?, attempts = attempts + 1, last_error = ?, updated_at = ?
+        WHERE job_id = ? AND ticker = ?
+    """, [(status, error, _now(), job_id, ticker) for ticker in tickers])
+
+
+def finish_job(conn, job_id: int):
+    cur = conn.cursor()
+    cur.execute("UPDATE ingestion_job SET status = ? WHERE job_id = ?", (JOB_DONE, job_id))
+    cur.execute("SELECT status, COUNT(*) FROM ingestion_job_ticker WHERE job_id = ? GROUP BY status", (job_id, ))
+    status_counts = dict(cur.fetchall())
+    conn.commit()
+    cur.close()
+    print(f"Ingestion job {job_id} finished: {status_counts}")
+    return status_counts
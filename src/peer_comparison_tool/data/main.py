@@ -1,259 +1,430 @@
 import click
 import pandas as pd
 import os
-from typing import Dict, Any
-from datetime import date
-
-from .retriever import RetrieveStockData
-from .constants import TICKERS
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Any, Iterator, List, Optional, NamedTuple, Tuple
+
+from .retriever import RetrieveStockData, FetchPlan, retrieve_price_history
+from .rate_limit import HostRateLimiter
+from .cache import CacheMissError
+from .providers import MarketDataProvider
+from .dates import to_epoch_days, epoch_day_to_date, epoch_day
+from .transform import StatementPayload, TransformedStatements, create_transform_executor, submit_transform, \
+    RECENT_METRICS_TABLE_COLS
+from .constants import TICKERS, MAX_INGESTION_WORKERS, REQUESTS_PER_SECOND, TICKER_TIMEOUT_SECONDS, \
+    INGESTION_BATCH_SIZE, INGESTION_MAX_ATTEMPTS, RETRY_BACKOFF_SECONDS, MAX_TRANSFORM_WORKERS, \
+    AGGREGATION_ENGINE
+from .jobs import create_ingestion_job, find_resumable_job, reconcile_job_tickers, get_outstanding_tickers, \
+    update_ticker_status, finish_job, TICKER_DONE, TICKER_FAILED, TICKER_SKIPPED
 from .utils import create_valuation_clusters
 
-from .db_utils import update_ticker_yoy_aggregations, update_industry_aggregations, insert_or_replace, insert_or_ignore
+from .db_utils import update_ticker_yoy_aggregations, update_industry_aggregations, insert_or_ignore, \
+    fetch_price_history_bounds, delete_ticker_price_history, delete_restated_metrics
+from .bulk_load import bulk_load
+from .upsert import upsert, ChangeLog, UpsertDelta
+from .statements import write_raw_statements
+from .aggregation_engine import resolve_aggregation_engine
 from .queries import recent_metrics_sector_query
 
 
-def main(tickers):
-    df_comparison = create_ticker_data(tickers)
-    a = 1
+# The datasets the ingestion writes - price history is downloaded separately in batches:
+INGESTION_FETCH_PLAN = FetchPlan(info=True, quarterly_financials=True, balance_sheet=True, cashflow=True)
+
+
+class FetchResult(NamedTuple):
+    retriever: Optional[RetrieveStockData]
+    status: str  # one of the ingestion job ticker statuses
+    error: Optional[str] = None
+
+
+def fetch_ticker(ticker: str, rate_limiter: Optional[HostRateLimiter] = None,
+                 provider: Optional[MarketDataProvider] = None) -> FetchResult:
+    try:
+        get_stock_data = RetrieveStockData(ticker, fetch_plan=INGESTION_FETCH_PLAN, rate_limiter=rate_limiter,
+                                           provider=provider)
+        if not get_stock_data.try_stock_ticker():
+            return FetchResult(None, TICKER_SKIPPED)
+        # fetch the rest of the plan here so the network I/O stays on the worker threads:
+        get_stock_data.stock_check_then_retrieve_data()
+    except CacheMissError as e:
+        # offline replay without this ticker cached
+        print(e)
+        return FetchResult(None, TICKER_SKIPPED, str(e))
+    except Exception as e:
+        # network errors etc. - the ticker is retried later in the job
+        print(f"{e} retrieving {ticker}")
+        return FetchResult(None, TICKER_FAILED, repr(e))
+    return FetchResult(get_stock_data, TICKER_DONE)
+
+
+def iter_fetched_tickers(tickers: List[str], max_workers: int = MAX_INGESTION_WORKERS,
+                         ticker_timeout: float = TICKER_TIMEOUT_SECONDS,
+                         rate_limiter: Optional[HostRateLimiter] = None,
+                         provider: Optional[MarketDataProvider] = None) -> Iterator[Tuple[str, FetchResult]]:
+    """Fetch the tickers on a bounded thread pool, all workers sharing one per-host rate limiter.
+    Results are yielded as they complete, so the caller can work on them while the later tickers are still being
+    fetched. A ticker times out ticker_timeout seconds after a worker started on it, however long it was queued."""
+    rate_limiter = rate_limiter or HostRateLimiter(REQUESTS_PER_SECOND)
+    if max_workers <= 1:
+        for ticker in tickers:
+            yield ticker, fetch_ticker(ticker, rate_limiter, provider)
+        return
+
+    started: Dict[str, float] = {}
+
+    def fetch_timed(ticker: str) -> FetchResult:
+        started[ticker] = time.monotonic()
+        return fetch_ticker(ticker, rate_limiter, provider)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ticker-fetch')
+    try:
+        pending = {executor.submit(fetch_timed, ticker): ticker for ticker in tickers}
+        while pending:
+            deadlines = [started[ticker] + ticker_timeout for ticker in pending.values() if ticker in started]
+            timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else ticker_timeout
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+            now = time.monotonic()
+            # with nothing done and nothing started every worker is stuck on a timed out ticker, the rest can't run:
+            workers_hung = not done and not any(ticker in started for ticker in pending.values())
+            for future, ticker in list(pending.items()):
+                if workers_hung or (ticker in started and now - started[ticker] >= ticker_timeout and not future.done()):
+                    del pending[future]
+                    print(f"Timed out after {ticker_timeout}s retrieving {ticker}")
+                    yield ticker, FetchResult(None, TICKER_FAILED, f"timed out after {ticker_timeout}s")
+    finally:
+        # don't wait on hung requests, the timed out tickers are simply skipped
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def fetch_tickers_concurrently(tickers: List[str], max_workers: int = MAX_INGESTION_WORKERS,
+                               ticker_timeout: float = TICKER_TIMEOUT_SECONDS,
+                               rate_limiter: Optional[HostRateLimiter] = None,
+                               provider: Optional[MarketDataProvider] = None) -> Dict[str, FetchResult]:
+    # Results keyed by ticker in the input order
+    results = dict(iter_fetched_tickers(tickers, max_workers, ticker_timeout, rate_limiter, provider))
+    return {ticker: results[ticker] for ticker in tickers}
+
+
+def update_ticker_price_history(sql_connection, tickers: List[str], rate_limiter: Optional[HostRateLimiter] = None,
+                                incremental: bool = True, provider: Optional[MarketDataProvider] = None):
+    """Write the daily prices for the tickers to ticker_time_series.
+    In incremental mode only the dates after each ticker's last stored date are downloaded and appended, together with
+    their split events: a split after the last stored date leaves the stored closes in the pre-split scale, so that
+    ticker alone is deleted and rebuilt from a full download. Dividends only move the earlier adjusted closes by the
+    dividend and are not rebuilt for. Today's bar may still be provisional, so it is not stored until the next day."""
+    cur = sql_connection.cursor()
+    df_bounds = fetch_price_history_bounds(sql_connection)
+    if not incremental:
+        df_bounds = df_bounds.iloc[0:0]
+    df_bounds = df_bounds[df_bounds['ticker'].isin(tickers)]
+    full_history_tickers = [t for t in tickers if t not in set(df_bounds['ticker'])]
+
+    appended_rows = []
+    # tickers refreshed together mostly share a last date, so this is one batched download per distinct date:
+    for last_date, df_group in df_bounds.groupby('last_date'):
+        df_tail = retrieve_price_history(df_group['ticker'].to_list(), rate_limiter=rate_limiter,
+                                         start=epoch_day_to_date(last_date + 1), provider=provider, actions=True)
+        df_tail['date'] = to_epoch_days(df_tail['date'])
+        df_tail = df_tail[df_tail['date'] > last_date]
+        full_history_tickers += df_tail.loc[df_tail['stock_split'] > 0, 'ticker'].unique().tolist()
+
+        df_tail = pd.merge(df_tail[~df_tail['ticker'].isin(full_history_tickers)],
+                           df_group[['ticker', 'first_close']], on='ticker')
+        df_tail['close_price_indexed'] = df_tail['close_price'] / df_tail['first_close'] * 100
+        appended_rows.append(df_tail[['ticker', 'date', 'close_price', 'close_price_indexed']])
+
+    df_rebased = df_bounds[df_bounds['ticker'].isin(full_history_tickers)]
+    if not df_rebased.empty:
+        print(f"Stock splits for {df_rebased['ticker'].to_list()}, rebuilding their history")
+        delete_ticker_price_history(cur, df_rebased)
+    if full_history_tickers:
+        df_full = retrieve_price_history(full_history_tickers, rate_limiter=rate_limiter, provider=provider)
+        df_full['date'] = to_epoch_days(df_full['date'])
+        appended_rows.append(df_full)
+
+    df_appended = pd.concat(appended_rows, ignore_index=True) if appended_rows else pd.DataFrame()
+    if not df_appended.empty:
+        # the largest load of a refresh, merged from a staging table in key order:
+        bulk_load(cur, 'ticker_time_series', df_appended[df_appended['date'] < epoch_day()], on_conflict='IGNORE',
+                  staging=True)
+    cur.close()
 
 
-def create_ticker_data(tickers_info_map, sql_connection):
-    gics_subindustry_list = list(set(tickers_info_map.values()))
+def run_ingestion_job(tickers_info_map: Dict[str, str], sql_connection, resume: bool = False,
+                      max_attempts: int = INGESTION_MAX_ATTEMPTS, retry_backoff: float = RETRY_BACKOFF_SECONDS,
+                      **ingestion_kwargs):
+    """Run create_ticker_data as a persisted job. With resume the latest unfinished job is continued, skipping the
+    tickers it already completed, its tickers first reconciled with tickers_info_map (see reconcile_job_tickers).
+    Failed tickers are retried with exponential backoff up to max_attempts."""
+    job_id = find_resumable_job(sql_connection) if resume else None
+    if job_id is None:
+        job_id = create_ingestion_job(sql_connection, tickers_info_map)
+    else:
+        added, dropped = reconcile_job_tickers(sql_connection, job_id, tickers_info_map)
+        print(f"Resuming ingestion job {job_id}, {len(added)} tickers added and {len(dropped)} no longer requested")
+
+    for attempt in range(max_attempts):
+        outstanding_tickers = get_outstanding_tickers(sql_connection, job_id, max_attempts)
+        if not outstanding_tickers:
+            break
+        if attempt > 0:
+            wait = retry_backoff * 2 ** (attempt - 1)
+            print(f"Retrying {len(outstanding_tickers)} tickers in {wait}s")
+            time.sleep(wait)
+        create_ticker_data(outstanding_tickers, sql_connection, job_id=job_id, **ingestion_kwargs)
+
+    return finish_job(sql_connection, job_id)
+
+
+def create_ticker_data(tickers_info_map, sql_connection, max_workers: int = MAX_INGESTION_WORKERS,
+                       requests_per_second: float = REQUESTS_PER_SECOND, ticker_timeout: float = TICKER_TIMEOUT_SECONDS,
+                       incremental_prices: bool = True, batch_size: int = INGESTION_BATCH_SIZE,
+                       job_id: Optional[int] = None, provider: Optional[MarketDataProvider] = None,
+                       transform_workers: Optional[int] = MAX_TRANSFORM_WORKERS, change_log: Optional[ChangeLog] = None):
+    """Fetch, transform and write the tickers in batches of batch_size so memory use does not grow with the universe.
+    Each batch is fetched concurrently and every fetched ticker's statements are handed to a process pool straight
+    away, so the statement transforms run on all cores while the rest of the batch is still being fetched. The batch
+    is then written with one insert per table before the next batch is fetched. Every batch is committed on its own,
+    together with the ticker statuses of job_id if this is part of an ingestion job. The keys of the new and changed
+    statement and metric rows are added to change_log, and their counts printed once all batches are written."""
+    df_ticker_id = load_ticker_names()
+    run_log = ChangeLog()
+    rate_limiter = HostRateLimiter(requests_per_second)
+    tickers = list(tickers_info_map.keys())
+    transform_executor = create_transform_executor(transform_workers)
+    try:
+        for i in range(0, len(tickers), batch_size):
+            batch_info_map = {ticker: tickers_info_map[ticker] for ticker in tickers[i:i + batch_size]}
+            batch = IngestionBatch()
+            staged_tickers = {}
+            for ticker, fetch_result in iter_fetched_tickers(list(batch_info_map.keys()), max_workers,
+                                                             ticker_timeout, rate_limiter, provider):
+                if fetch_result.status == TICKER_DONE:
+                    try:
+                        staged = transform_ticker_data(fetch_result.retriever, batch_info_map[ticker], df_ticker_id)
+                        if staged is not None:
+                            staged_tickers[ticker] = (staged, submit_transform(transform_executor, staged.payload))
+                            continue  # status is known once the statements are transformed
+                    except Exception as e:
+                        print(f"{e} transforming {ticker}")
+                        fetch_result = FetchResult(None, TICKER_FAILED, repr(e))
+                batch.add_status(ticker, fetch_result)
+
+            # a ticker's rows only go into the batch once all of it transformed, a failed ticker writes nothing:
+            for ticker, (staged, future) in staged_tickers.items():
+                try:
+                    statements = future.result()
+                except Exception as e:
+                    print(f"{e} transforming {ticker}")
+                    batch.add_status(ticker, FetchResult(None, TICKER_FAILED, repr(e)))
+                    continue
+                batch.add_ticker(staged, statements)
+                batch.add_status(ticker, FetchResult(None, TICKER_DONE))
+
+            for delta in write_ingestion_batch(sql_connection, batch, rate_limiter, incremental_prices, provider):
+                run_log.add(delta)
+                if change_log is not None:
+                    change_log.add(delta)
+            if job_id is not None:
+                cur = sql_connection.cursor()
+                for status, errors in batch.ticker_statuses.items():
+                    for error, status_tickers in errors.items():
+                        update_ticker_status(cur, job_id, status_tickers, status, error)
+                cur.close()
+            # the batch data and its job statuses become visible atomically:
+            sql_connection.commit()
+    finally:
+        if transform_executor is not None:
+            transform_executor.shutdown(cancel_futures=True)
+    if run_log.deltas:
+        print(run_log.summary())
+    return
+
+
+def load_ticker_names() -> pd.DataFrame:
     # todo replace with call to company sql table:
+    path = os.path.expanduser('~/Documents/Code/peer-comparison-tool/data/sp500_security_ticker.csv')
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=['Symbol', 'Security'])
+    return pd.read_csv(path)
+
+
+class StagedTicker(NamedTuple):
+    # One ticker's rows, added to the batch together with its statements once they are transformed
+    company_info_row: Dict[str, Any]
+    recent_metrics_row: Dict[str, Any]
+    payload: StatementPayload  # the raw statements for transform_statements
+
+
+class IngestionBatch:
+    # Row buffers for one batch of tickers, concatenated once when the batch is written
+    def __init__(self):
+        self.retrieved_tickers: List[str] = []
+        self.ticker_statuses: Dict[str, Dict[Optional[str], List[str]]] = {}  # status -> error -> tickers
+        self.price_history_tickers: List[str] = []
+        self.company_info_rows: List[Dict[str, Any]] = []
+        self.recent_metrics_rows: List[Dict[str, Any]] = []
+        self.qfinancials_frames: List[pd.DataFrame] = []
+        self.balancesheet_frames: List[pd.DataFrame] = []
+        self.cashflow_frames: List[pd.DataFrame] = []
+        self.raw_statement_frames: List[pd.DataFrame] = []
+
+    def add_status(self, ticker: str, fetch_result: FetchResult):
+        if fetch_result.status == TICKER_DONE:
+            self.retrieved_tickers.append(ticker)
+        errors = self.ticker_statuses.setdefault(fetch_result.status, {})
+        errors.setdefault(fetch_result.error, []).append(ticker)
+
+    def add_ticker(self, staged: StagedTicker, statements: TransformedStatements):
+        self.recent_metrics_rows.append(staged.recent_metrics_row)
+        self.company_info_rows.append(staged.company_info_row)
+        # stock price series are downloaded for the whole batch at once:
+        self.price_history_tickers.append(staged.payload.ticker)
+        self.add_statements(statements)
+
+    def add_statements(self, statements: TransformedStatements):
+        if not statements.quarterly_financials.empty:
+            self.qfinancials_frames.append(statements.quarterly_financials)
+        if not statements.balance_sheet.empty:
+            self.balancesheet_frames.append(statements.balance_sheet)
+        if not statements.cashflow.empty:
+            self.cashflow_frames.append(statements.cashflow)
+        if not statements.raw_statements.empty:
+            self.raw_statement_frames.append(statements.raw_statements)
+
+
+def transform_ticker_data(get_stock_data: RetrieveStockData, subindustry: str,
+                          df_ticker_id: pd.DataFrame) -> Optional[StagedTicker]:
+    """The ticker's info rows and its raw statements for transform_statements, or None if the ticker has no sector."""
+    ticker = get_stock_data.stock_ticker
+    # Company Info Data:
+    ticker_overview = get_stock_data.add_stock_overview_metrics_to_key_metrics()
+    if not ticker_overview.get('sector'):
+        return None
+    names = df_ticker_id.loc[df_ticker_id['Symbol'] == ticker, 'Security']
+    # tickers outside the S&P 500 list (or synthetic ones) use the provider's company name:
+    ticker_overview.update({'name': names.iloc[0] if not names.empty else get_stock_data.info_snapshot.name})
+    ticker_overview.update({'sub_industry': subindustry})
+    company_info_row = {key: ticker_overview[key] for key in ["ticker", "name", "sector", "industry", "sub_industry"]}
+
+    # Quarterly financials, balance sheets and cash flows are transformed in the process pool:
+    return StagedTicker(company_info_row, ticker_overview, get_stock_data.statement_payload())
+
+
+def write_ingestion_batch(sql_connection, batch: IngestionBatch, rate_limiter: Optional[HostRateLimiter] = None,
+                          incremental_prices: bool = True,
+                          provider: Optional[MarketDataProvider] = None) -> List[UpsertDelta]:
+    # only new and changed rows are written to the upserted tables, returns their deltas
+    deltas = []
+    if not batch.retrieved_tickers:
+        return deltas
     cur = sql_connection.cursor()
-    df_ticker_id = pd.read_csv(os.path.expanduser('~/Documents/Code/peer-comparison-tool/data/sp500_security_ticker.csv'))
-    company_info_data_list = []
-    company_most_recent_metrics_list = []
-    ticker_data_series_maps: Dict[str, Any] = {}
-    df_qfinancials = pd.DataFrame()
-    df_balancesheets = pd.DataFrame()
-    qfinancials_map: Dict[str, pd.DataFrame] = {}
-    balancesheets_map: Dict[str, pd.DataFrame] = {}
-    cashflow_map: Dict[str, pd.DataFrame] = {}
-    tickers_list = list(tickers_info_map.keys())
-    for ticker, subindustry in tickers_info_map.items():
-        try:
-            get_stock_data = RetrieveStockData(ticker)
-            if not get_stock_data.try_stock_ticker():
-                # remove ticker and pass loop
-                tickers_list = [t for t in tickers_list if t != ticker]
-                continue
-        except AttributeError as e:
-            print(e)
-            continue
-        # Company Info Data:
-        ticker_overview = get_stock_data.add_stock_overview_metrics_to_key_metrics()
-        if not ticker_overview.get('sector'):
-            continue
-        ticker_overview.update({'name': df_ticker_id[df_ticker_id['Symbol'] == ticker]['Security'].iloc[0]})
-        ticker_overview.update({'sub_industry': subindustry})
-        company_most_recent_metrics_list.append(ticker_overview)
-        company_info_map = {key: ticker_overview[key] for key in
-                            ["ticker", "name", "sector", "industry", "sub_industry"]}
-        company_info_data_list.append(company_info_map)
-
-        # Write quarterly financials data:
-        df_ticker_qfinancial = get_stock_data.get_quarterly_financials_app_data()
-        if df_ticker_qfinancial.empty:
-            pass
-        else:
-            add_ticker_metadata(df_ticker_qfinancial, get_stock_data.stock_overview_map)
-            if df_qfinancials.empty:
-                df_qfinancials = df_ticker_qfinancial
-            else:
-                df_qfinancials = pd.concat([df_qfinancials, df_ticker_qfinancial])
-            df_ticker_complete_qfin = get_stock_data.quarterly_finances
-            df_ticker_complete_qfin = df_ticker_complete_qfin.transpose()
-            qfinancials_map[ticker] = df_ticker_complete_qfin
-
-        # Balance Sheets:
-        df_ticker_balancesheet = get_stock_data.get_balance_sheet_app_data()
-        if df_ticker_balancesheet.empty:
-            pass
-        else:
-            add_ticker_metadata(df_ticker_balancesheet, get_stock_data.stock_overview_map)
-            if df_balancesheets.empty:
-                df_balancesheets = df_ticker_balancesheet
-            else:
-                df_balancesheets = pd.concat([df_balancesheets, df_ticker_balancesheet])
-            df_ticker_complete_bs = get_stock_data.balance_sheets
-            df_ticker_complete_bs = df_ticker_complete_bs.transpose()
-            balancesheets_map[ticker] = df_ticker_complete_bs
-
-        # Cash Flow Statement:
-        df_ticker_cashflow = get_stock_data.get_cashflow_data()
-        if df_ticker_cashflow.empty:
-            pass
-        else:
-            cashflow_map[ticker] = df_ticker_cashflow
-
-        # get stock series and year-to-year change data
-        try:
-            ticker_data_series_maps.update({ticker: get_stock_data.get_stock_level_data()})
-        except IndexError as e:
-            print(f"{e} for {ticker} during get_stock_data call")
-
-        # if get_stock_data.stock_info_key is not None:
-        #     click.echo(f"Key stock info for {ticker}: {get_stock_data.stock_info_key}")
-    if not tickers_list:
-        cur.close()
-        return
-    # Create the ticker time series dataframe: the ticker_data_series_map values have a lot of aggregations
-    df_ticker_time_series_data = pd.concat(
-        [stock_map['stock_price_data'] for stock_map in
-         [ticker_data_series_maps[ticker] for ticker in list(ticker_data_series_maps.keys())]],
-        axis=0)  # stack vertically
-    df_ticker_time_series_data.rename(columns={'Date': 'date', 'Close': 'close_price',
-                                               'Close Indexed': 'close_price_indexed'},
-                                      inplace=True)
-
-    # Create ticker company info:
-    df_ticker_data = pd.DataFrame(company_info_data_list)
-    df_ticker_recent_metrics = pd.DataFrame(company_most_recent_metrics_list)
-
-    # Processing todo move to app-processing function or something
-    df_qfinancials = df_qfinancials.reset_index().rename(columns={'index': 'date'})
-    df_qfinancials['date_moved'] = df_qfinancials['date'] - pd.DateOffset(months=1)
-    df_qfinancials['quarter_reporting'] = df_qfinancials['date_moved'].dt.year.astype(str) + "_" + df_qfinancials['date_moved'].dt.quarter.astype(str)
-    # todo quarterly mapping - tough because different end of months for reporting
-    df_balancesheets = df_balancesheets.reset_index().rename(columns={'index': 'date'})
-    df_balancesheets['date_moved'] = df_balancesheets['date'] + pd.DateOffset(months=3)
-    df_balancesheets['annual_reporting'] = df_balancesheets['date_moved'].dt.year.astype(str)
-    # df_qfinancials['market_cap_MM'] = df_qfinancials['market_cap'] / 1_000_000  # in millions  # TODO add this back in retriever
-    df_qfinancials['Operating Income (MM)'] = df_qfinancials['Operating Income'] / 1_000_000  # in millions
-    df_qfinancials['Net Income (MM)'] = df_qfinancials['Net Income'] / 1_000_000  # in millions
-
-    # clustering for scatter chart:
-    # cluster_cols = ["price_eps_ratio", "latest_eps", "return_on_equity", "enterpriseToEbitda", "debt_to_equity_ratio", "profit_margin"]
-    # df_ticker_data = create_valuation_clusters(df=df_ticker_data, cols=cluster_cols, eps=0.5, min_samples=3)
-
-    # industry average change:
-    # def calc_decimal_change(pct):
-    #     return 1 + pct/100
-
-    # num_keys = len(ticker_data_series_maps)
-    # ticker_data_series_maps['industry'] = {}
-    # ticker_data_series_used = list(ticker_data_series_maps.keys())
-    # for yoy_metric in list(ticker_data_series_maps[tickers_list[0]].keys()):
-    #     if yoy_metric not in ['stock_price_data', 'stock_price_normalised_data']:
-    #         ticker_data_series_maps['industry'].update({
-    #             f"{yoy_metric}": np.mean([ticker_data_series_maps[tcker].get(yoy_metric, 1) for tcker in ticker_data_series_used])
-    #         })
-    #     else:
-    #         # calculate the industry price index and normalise:
-    #         # todo this assumes that all tickers are from the same industry - now generalise this so it uses the
-    #         # todo sub-industry groupings - maybe save one column for each subindustry_close time series
-    #         industry_price_df = ticker_data_series_maps[tickers_list[0]][yoy_metric]
-    #         for ticker in ticker_data_series_used:
-    #             try:
-    #                 df_temp = ticker_data_series_maps[ticker][yoy_metric]
-    #                 df_temp[f'Close_{ticker}'] = df_temp['Close']
-    #                 industry_price_df = pd.merge(industry_price_df,
-    #                                              df_temp[['Date', f'Close_{ticker}']],
-    #                                              on=['Date'])
-    #             except KeyError as e:
-    #                 print(f"{e} for {ticker} when calculating YoY values")
-    #         for sub_industry in gics_subindustry_list:
-    #             sub_industry_cols = [c for c in industry_price_df.columns if c.startswith('Close') and any(substr in c for substr in sub_industry)]
-    #             sub_industry_price_col = f'{sub_industry} Close'
-    #             industry_price_df[sub_industry_price_col] = industry_price_df[sub_industry_cols].sum(axis=1)
-    #             industry_price_df[sub_industry_price_col] = industry_price_df[sub_industry_price_col] / industry_price_df[sub_industry_price_col].iloc[0] * 100
-    #             ticker_data_series_maps[f'Industry Index:{sub_industry}'] = {
-    #                 yoy_metric: industry_price_df[['Date', sub_industry_price_col]]
-    #             }
-    #             # todo then we can use the subindustry time series of close (and other metrics?) in the app home_page
-
-    # TODO : here we insert the new data in the tables and append to the existing rows
-    # 1. df_ticker_data = company_info table (ticker, name, sector, industry, sub_industry):
-
-    insert_or_replace(cur, 'company_info', df_ticker_data.dropna())
-    # df_ticker_data.to_sql('company_info', sql_connection, if_exists='append', index=False)  # TODO no duplicate rows.
-    recent_metrics_table_keys = ['ticker', 'market_cap', 'price_eps_ratio', 'price_to_book', 'return_on_equity',
-                                 'debt_to_equity_ratio', 'profit_margin', 'enterpriseToEbitda', 'latest_eps',
-                                 'enterprise_value']
-    # df_ticker_recent_metrics[recent_metrics_table_keys].to_sql('ticker_most_recent_metric_data', sql_connection,
-    #                                                            if_exists='append', index=False,
-    #                                                            method=insert_or_replace)
-    insert_or_replace(cur, 'ticker_most_recent_metric_data', df_ticker_recent_metrics[recent_metrics_table_keys])
-
-    # 2. df_ticker_time_series_data:
-    insert_or_ignore(cur, 'ticker_time_series', df_ticker_time_series_data)
-    # df_ticker_time_series_data.to_sql('ticker_time_series', sql_connection, if_exists='append', index=False)
+    # 1. company_info table (ticker, name, sector, industry, sub_industry) and the latest metrics:
+    if batch.company_info_rows:
+        deltas.append(upsert(cur, 'company_info', pd.DataFrame(batch.company_info_rows).dropna()))
+        deltas.append(upsert(cur, 'ticker_most_recent_metric_data',
+                             pd.DataFrame(batch.recent_metrics_rows)[RECENT_METRICS_TABLE_COLS]))
+
+    # 2. ticker time series: batched downloads of only the missing dates, already in long format
+    if batch.price_history_tickers:
+        update_ticker_price_history(sql_connection, batch.price_history_tickers, rate_limiter,
+                                    incremental=incremental_prices, provider=provider)
 
     # 3. 10-Q-Financials:
-    qfinancial_table_cols = ['ticker', 'date', 'quarter_reporting', 'Basic EPS', 'Operating Income',
-                             'Operating Income (MM)', 'Net Income', 'Net Income (MM)', 'Gross Margin',
-                             'Operating Margin', 'Net Margin', 'EBITDA Margin']
-    insert_or_ignore(cur, 'quarterly_financial_data', df_qfinancials[qfinancial_table_cols])
-    # df_qfinancials.to_sql('quarterly_financial_data', sql_connection, if_exists='append', index=False)
+    if batch.qfinancials_frames:
+        deltas.append(upsert(cur, 'quarterly_financial_data', pd.concat(batch.qfinancials_frames)))
 
     # 4. 10-K Data:
-    balance_sheet_cols = ['ticker', 'date', 'annual_reporting', 'OrdinarySharesNumber', 'StockholdersEquity',
-                          'TotalLiabilitiesNetMinorityInterest', 'CurrentAssets', 'Quick Ratio',
-                          'Equity Ratio', 'Debt-to-Equity Ratio']
-    insert_or_ignore(cur, 'balance_sheet_data', df_balancesheets[balance_sheet_cols])
-    # df_balancesheets.to_sql('balance_sheet_data', sql_connection, if_exists='append', index=False)
-
-    # 5. Record data written:
-    record_data_cols = ['ticker', 'version date']
+    if batch.balancesheet_frames:
+        deltas.append(upsert(cur, 'balance_sheet_data', pd.concat(batch.balancesheet_frames)))
+
+    # 5. Cash flows, for the discounted cash flow model:
+    if batch.cashflow_frames:
+        deltas.append(upsert(cur, 'cashflow_statement_data', pd.concat(batch.cashflow_frames)))
+
+    # 6. Every raw statement line item, in the narrow statement store:
+    if batch.raw_statement_frames:
+        written = write_raw_statements(cur, pd.concat(batch.raw_statement_frames, ignore_index=True))
+        print(f"statement_value: {written} values new or changed")
+
+    # 7. Record data written:
     record_data_saved = pd.DataFrame(
-        {'ticker': tickers_list, 'version date': [date.today().strftime("%Y-%m-%d")]*len(tickers_list)}
+        {'ticker': batch.retrieved_tickers,
+         'version date': epoch_day()}
     )
-    insert_or_ignore(cur, 'data_storage_record', record_data_saved[record_data_cols])
-    # record_data_saved.to_sql('data_storage_record', sql_connection, if_exists='append', index=False)
-
-    sql_connection.commit()
+    insert_or_ignore(cur, 'data_storage_record', record_data_saved[['ticker', 'version date']])
     cur.close()
-
-    return
+    return deltas
 
 
-def create_aggregations_data(conn, ticker_subindustry_map: Dict[str, str]):
+def create_aggregations_data(conn, ticker_subindustry_map: Dict[str, str], change_log: Optional[ChangeLog] = None,
+                             engine: str = AGGREGATION_ENGINE):
     """the aggregations data includes clustering and any other ML techniques we write.
-    It includes all data that is built from the ticker-level data that we store from the API"""
+    It includes all data that is built from the ticker-level data that we store from the API.
+    With the change_log of the ingestion only the sub-industries and tickers with new or changed data are
+    recomputed, otherwise everything is. engine runs the full builds of the price and industry aggregations
+    ('sqlite' or 'duckdb')."""
+    engine = resolve_aggregation_engine(engine)
     cur = conn.cursor()
+    subindustry_list = list(set(ticker_subindustry_map.values()))
+    statement_tickers, statement_subindustries = None, None
+    if change_log is not None:
+        metric_tickers = change_log.changed_tickers(['company_info', 'ticker_most_recent_metric_data'])
+        subindustry_list = list({ticker_subindustry_map[t] for t in metric_tickers if t in ticker_subindustry_map})
+        statement_tickers = list(change_log.changed_tickers(['quarterly_financial_data']))
+        # restated quarters invalidate the metrics built from them:
+        restated_tickers = list(change_log.changed_tickers(['quarterly_financial_data'], include_inserted=False))
+        if restated_tickers:
+            delete_restated_metrics(cur, restated_tickers)
+        statement_subindustries = list({ticker_subindustry_map[t] for t in statement_tickers + restated_tickers
+                                         if t in ticker_subindustry_map})
 
     # Aggregations:
     # 1. Clutering model
     cluster_cols = ["price_eps_ratio", "latest_eps", "return_on_equity", "enterpriseToEbitda", "debt_to_equity_ratio", "profit_margin"]
     # FIXME or is is better to just pass the list of tickers instead? And we can get the list here instead.
-    subindustry_list = list(set(ticker_subindustry_map.values()))
     # loop over all sub_industry values in the selected tickers:
     for subindustry in subindustry_list:
         df_company_recent_metrics = pd.read_sql_query(sql=recent_metrics_sector_query, con=conn,
                                                       params=[subindustry])
         df_cluster_data = create_valuation_clusters(df=df_company_recent_metrics, cols=cluster_cols, eps=0.5, min_samples=3)
 
-        df_cluster_data['date'] = date.today().strftime("%Y-%m-%d")  # date it was created
+        df_cluster_data['date'] = epoch_day()  # date it was created
         # maybe we don't want date? But just store the most recent cluster label?
         insert_or_ignore(cur, 'cluster_table', df_cluster_data[['ticker', 'date', 'cluster_membership']])
         conn.commit()
 
     # YoY Aggregations:
-    update_ticker_yoy_aggregations(conn)
+    update_ticker_yoy_aggregations(conn, statement_tickers, engine=engine)
 
     # Industry Aggregation:
-    update_industry_aggregations(conn)
+    update_industry_aggregations(conn, statement_subindustries, engine=engine)
 
     conn.commit()
     cur.close()
     return
 
 
-def add_ticker_metadata(df: pd.DataFrame, ticker_metadata):
-    for key, val in ticker_metadata.items():
-        df[key] = val
-
-
 @click.command()
 @click.option('--tickers', default=None, prompt='Stock Ticker', help='Pass the stock ticker of the stock you wish to retrieve financial data for')
-def execute(tickers):
+@click.option('--resume', is_flag=True, default=False, help='Continue the last unfinished ingestion job, skipping completed tickers')
+def execute(tickers, resume):
+    from .db import initialize_db_connection, close_db
+    from .migrations import migrate
+    from ..comparison_tool.constants import DB_PATH
+
     if tickers:
         tickers = tickers.split(", ")
     else:
         tickers = TICKERS
-    main(tickers)
+    sql_conn = initialize_db_connection(DB_PATH)
+    migrate(sql_conn)
+    run_ingestion_job({ticker: "Misc." for ticker in tickers}, sql_conn, resume=resume)
+    close_db(sql_conn, DB_PATH)
 
 
 if __name__ == '__main__':
-    main({"AAPL": "testA", "AMZN": "testB"})
+    execute()
@@ -0,0 +1,249 @@
+"""Versioned schema migrations. The schema_version table records which migrations a database has had, and
+migrate() applies the missing ones in order. A schema change is a new Migration appended to MIGRATIONS, using an
+in-place ALTER (add_column, add_index) where SQLite supports it and copy_and_swap where it does not."""
+
+import click
+import re
+from datetime import datetime
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from . import db_tables
+from .jobs import create_job_tables
+from .queries import query_create_statement_line_item_table, query_create_statement_value_table, \
+    query_create_price_bar_table, query_create_price_tier_table, query_create_columnar_change_table, \
+    query_create_columnar_change_trigger, query_count_columnar_change, query_seed_columnar_change
+from .retention import TIERED_TABLES, BAR_TIERS, bar_table_name
+from .columnar import COLUMNAR_TABLES
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable  # apply(conn), must not commit - migrate() commits it together with its version row
+
+
+def table_columns(conn, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+
+
+def primary_key_columns(conn, table: str) -> List[str]:
+    # in key order, empty for a table without a declared primary key
+    return [row[1] for row in sorted(conn.execute(f'PRAGMA table_info("{table}")'), key=lambda row: row[5]) if row[5]]
+
+
+def add_column(conn, table: str, column: str, column_type: str, default=None):
+    # in place, the existing rows get the default (or NULL)
+    if column in table_columns(conn, table):
+        return
+    default_sql = f" DEFAULT {default!r}" if default is not None else ""
+    conn.execute(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {column_type}{default_sql}')
+
+
+def add_index(conn, index_name: str, table: str, columns: List[str], unique: bool = False):
+    columns_sql = ", ".join(f'"{col}"' for col in columns)
+    conn.execute(f'CREATE {"UNIQUE " if unique else ""}INDEX IF NOT EXISTS {index_name} ON "{table}" ({columns_sql})')
+
+
+def copy_and_swap(conn, table: str, create_sql: str, column_map: Optional[Dict[str, str]] = None,
+                  indexes: Optional[Dict[str, List[str]]] = None):
+    """Rebuild a table for changes ALTER TABLE can't make (primary key, column types, dropping columns).
+    create_sql is the new CREATE TABLE statement with {table} for the table name. column_map maps each new column to
+    the SQL expression selecting it from the old table, by default the columns the old and new tables share.
+    The old table's indexes go with it, so the indexes to keep are passed (name -> columns) and recreated.
+    Rows that collide on the new keys fail the copy, check for them first."""
+    new_table = f"{table}__new"
+    conn.execute(f'DROP TABLE IF EXISTS "{new_table}"')  # left over from a failed run
+    conn.execute(create_sql.format(table=f'"{new_table}"'))
+    if column_map is None:
+        old_columns = set(table_columns(conn, table))
+        column_map = {col: f'"{col}"' for col in table_columns(conn, new_table) if col in old_columns}
+    new_columns_sql = ", ".join(f'"{col}"' for col in column_map)
+    conn.execute(f'INSERT INTO "{new_table}" ({new_columns_sql}) SELECT {", ".join(column_map.values())} FROM "{table}"')
+    conn.execute(f'DROP TABLE "{table}"')
+    conn.execute(f'ALTER TABLE "{new_table}" RENAME TO "{table}"')
+    for index_name, columns in (indexes or {}).items():
+        add_index(conn, index_name, table, columns)
+
+
+def _create_baseline_tables(conn):
+    # every table as of the first versioned schema, a no-op on databases created before migrations existed
+    cur = conn.cursor()
+    db_tables.create_company_table(cur)
+    db_tables.create_ticker_time_series_table(cur)
+    db_tables.create_asset_class_ts_table(cur)
+    db_tables.create_quarterly_report_financial_data(cur)
+    db_tables.create_balance_sheet_report_data(cur)
+    db_tables.create_cashflow_statement(cur)
+    db_tables.create_tickers_most_recent_metrics(cur)
+    db_tables.create_cluster_data(cur)
+    db_tables.create_ticker_ts_yoy(cur)
+    db_tables.create_industry_aggregated_time_series_table(cur)
+    db_tables.create_industry_aggregated_ts_yoy(cur)
+    db_tables.create_ticker_report_yoy_data(cur)
+    db_tables.create_industry_report_metrics_data(cur)
+    db_tables.create_industry_report_yoy_data(cur)
+    db_tables.create_data_record_table(cur)
+    create_job_tables(cur)
+    cur.close()
+
+
+def _add_hot_path_indexes(conn):
+    # sub_industry filters (recent_metrics_sector_query) and the ticker -> sub_industry lookups of the industry
+    # aggregation joins, both answered from the index alone. Check the plans with query_plans.py.
+    add_index(conn, 'idx_company_info_sub_industry', 'company_info', ['sub_industry', 'ticker'])
+    add_index(conn, 'idx_company_info_ticker_sub_industry', 'company_info', ['ticker', 'sub_industry'])
+    # the running job lookup when resuming:
+    add_index(conn, 'idx_ingestion_job_status', 'ingestion_job', ['status', 'job_id'])
+
+
+def table_indexes(conn, table: str) -> Dict[str, List[str]]:
+    # the explicitly created indexes of a table (not the primary key ones), name -> columns
+    index_names = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (table, ))]
+    return {name: [row[2] for row in conn.execute(f'PRAGMA index_info("{name}")')] for name in index_names}
+
+
+def epoch_day_sql(column: str) -> str:
+    # stored dates were 'YYYY-MM-DD' (maybe with a time) or nanosecond timestamps from pandas, the latter as integers
+    # or, through the TEXT column affinity, as strings of digits
+    return f"""CASE
+        WHEN "{column}" NOT GLOB '*[^0-9]*' AND length("{column}") > 11
+            THEN CAST("{column}" AS INTEGER) / 86400000000000
+        WHEN "{column}" NOT GLOB '*[^0-9]*' THEN CAST("{column}" AS INTEGER)
+        ELSE CAST(strftime('%s', "{column}") AS INTEGER) / 86400
+    END"""
+
+
+# Every date column, stored as epoch days (see dates.py) from migration 3 on:
+EPOCH_DAY_COLUMNS_BY_TABLE = {
+    'ticker_time_series': ['date'], 'asset_class_time_series': ['date'], 'quarterly_financial_data': ['date'],
+    'balance_sheet_data': ['date'], 'cashflow_statement_data': ['date'], 'cluster_table': ['date'],
+    'ticker_ts_yoy': ['date'], 'industry_time_series': ['date'], 'industry_time_series_yoy': ['date'],
+    'ticker_metrics_yoy': ['date'], 'industry_metrics': ['date'], 'industry_metrics_yoy': ['date'],
+    'data_storage_record': ['version date'],
+}
+
+
+def _dates_to_epoch_days(conn):
+    # rebuild each table with INTEGER date columns, converting the existing rows in SQL
+    for table, date_columns in EPOCH_DAY_COLUMNS_BY_TABLE.items():
+        create_sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table, )).fetchone()[0]
+        create_sql = re.sub(r'CREATE TABLE\s+(IF NOT EXISTS\s+)?"?\w+"?', 'CREATE TABLE {table}', create_sql, count=1)
+        for col in date_columns:
+            create_sql = re.sub(rf'("?{re.escape(col)}"?\s+)TEXT\b', r'\1INTEGER', create_sql, count=1)
+        for col in date_columns:
+            unconverted = conn.execute(f'SELECT COUNT(*) FROM "{table}" WHERE ({epoch_day_sql(col)}) IS NULL').fetchone()[0]
+            if unconverted:
+                raise ValueError(f"{unconverted} rows of {table} have a {col} that is not a date")
+        column_map = {col: epoch_day_sql(col) if col in date_columns else f'"{col}"' for col in table_columns(conn, table)}
+        # the same day stored in two formats (e.g. a date string and a timestamp) becomes one key:
+        key_columns = primary_key_columns(conn, table)
+        if key_columns:
+            duplicates = conn.execute(f'SELECT COALESCE(SUM(rows - 1), 0) FROM (SELECT COUNT(*) as rows FROM "{table}" '
+                                      f'GROUP BY {", ".join(column_map[col] for col in key_columns)} '
+                                      f'HAVING COUNT(*) > 1)').fetchone()[0]
+            if duplicates:
+                raise ValueError(f"{duplicates} rows of {table} duplicate the key of another row once their dates are "
+                                 f"converted, remove them and migrate again")
+        copy_and_swap(conn, table, create_sql, column_map, indexes=table_indexes(conn, table))
+
+
+def _add_row_hashes(conn):
+    # the value hashes upsert.py compares refreshed rows against, NULL until a row is next written (its values are
+    # compared until then)
+    for table in ['company_info', 'ticker_most_recent_metric_data', 'quarterly_financial_data', 'balance_sheet_data']:
+        add_column(conn, table, 'row_hash', 'INTEGER')
+
+
+def _add_statement_store(conn):
+    # the narrow raw statement store of statements.py, and row hashes for the now upserted cash flow table
+    conn.execute(query_create_statement_line_item_table)
+    conn.execute(query_create_statement_value_table)
+    add_column(conn, 'cashflow_statement_data', 'row_hash', 'INTEGER')
+
+
+def _add_price_tiers(conn):
+    # the weekly and monthly bar tables of retention.py, and the record of the days each tier holds
+    for table, carried_columns in TIERED_TABLES.items():
+        carried_sql = " ".join(f'"{col}" {col_type},' for col, col_type in carried_columns.items())
+        for tier in BAR_TIERS:
+            conn.execute(query_create_price_bar_table.format(table_name=bar_table_name(table, tier),
+                                                             carried_columns=carried_sql))
+    conn.execute(query_create_price_tier_table)
+
+
+def _add_columnar_change_counters(conn):
+    # the per-year change counts columnar.py exports by, counting the rows already stored as changed
+    conn.execute(query_create_columnar_change_table)
+    for table in COLUMNAR_TABLES:
+        for event, rows in [('INSERT', ['NEW']), ('UPDATE', ['OLD', 'NEW']), ('DELETE', ['OLD'])]:
+            counts = "".join(query_count_columnar_change.format(table_name=table, row=row) for row in rows)
+            conn.execute(query_create_columnar_change_trigger.format(table_name=table, event=event, counts=counts))
+        conn.execute(query_seed_columnar_change.format(table_name=table))
+
+
+# Ordered, append only - a released migration is never edited, a fix is a new migration:
+MIGRATIONS: List[Migration] = [
+    Migration(1, 'baseline tables', _create_baseline_tables),
+    Migration(2, 'secondary indexes for the hot access paths', _add_hot_path_indexes),
+    Migration(3, 'dates as epoch day integers', _dates_to_epoch_days),
+    Migration(4, 'row hashes for change detection', _add_row_hashes),
+    Migration(5, 'raw statement store', _add_statement_store),
+    Migration(6, 'weekly and monthly price tiers', _add_price_tiers),
+    Migration(7, 'columnar store change counters', _add_columnar_change_counters),
+]
+
+
+def create_schema_version_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER NOT NULL PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    """)
+
+
+def get_schema_version(conn) -> int:
+    create_schema_version_table(conn)
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def migrate(conn, target_version: Optional[int] = None) -> int:
+    """Apply the pending migrations up to target_version (default: all), each in its own transaction together with
+    its schema_version row, so a failed migration leaves the database at the previous version."""
+    current_version = get_schema_version(conn)
+    for migration in MIGRATIONS:
+        if migration.version <= current_version or (target_version is not None and migration.version > target_version):
+            continue
+        print(f"Applying migration {migration.version}: {migration.name}")
+        try:
+            conn.execute("BEGIN")
+            migration.apply(conn)
+            conn.execute("INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                         (migration.version, migration.name, datetime.now().isoformat(timespec='seconds')))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        current_version = migration.version
+    return current_version
+
+
+@click.command()
+@click.option('--target', default=None, type=int, help='Migrate up to this schema version instead of the latest')
+@click.option('--status', is_flag=True, default=False, help='Only print the current and latest schema versions')
+def execute(target, status):
+    from .db import initialize_db_connection, close_db
+    from ..comparison_tool.constants import DB_PATH
+
+    sql_conn = initialize_db_connection(DB_PATH)
+    if status:
+        print(f"Schema version {get_schema_version(sql_conn)}, latest {MIGRATIONS[-1].version}")
+    else:
+        print(f"Schema at version {migrate(sql_conn, target)}")
+    close_db(sql_conn, DB_PATH)
+
+
+if __name__ == '__main__':
+    execute()
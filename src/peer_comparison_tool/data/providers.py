@@ -0,0 +1,283 @@
+"""Market data providers: yfinance behind the response cache, and a deterministic synthetic provider for
+offline load and performance testing at any universe size"""
+
+import os
+import re
+import zlib
+from abc import ABC, abstractmethod
+from datetime import date
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .cache import CachedTicker, cached_download
+
+
+class MarketDataProvider(ABC):
+    """Source of the market data used by the retrievers.
+
+    ticker() returns an object with the subset of the yf.Ticker API we use: info, quarterly_financials,
+    get_balance_sheet(), cashflow, income_stmt, history(**window) and get_news().
+    download() returns the same wide frame as yf.download(..., group_by='column').
+    """
+    name = None
+
+    @abstractmethod
+    def ticker(self, symbol: str, rate_limiter=None):
+        pass
+
+    @abstractmethod
+    def download(self, tickers: List[str], rate_limiter=None, **kwargs) -> pd.DataFrame:
+        pass
+
+
+class YFinanceProvider(MarketDataProvider):
+    name = 'yfinance'
+
+    def __init__(self, cache=None):
+        self.cache = cache  # None uses the default response cache
+
+    def ticker(self, symbol: str, rate_limiter=None):
+        return CachedTicker(symbol, cache=self.cache, rate_limiter=rate_limiter)
+
+    def download(self, tickers: List[str], rate_limiter=None, **kwargs) -> pd.DataFrame:
+        return cached_download(tickers, cache=self.cache, rate_limiter=rate_limiter, **kwargs)
+
+
+SYNTHETIC_SECTORS = {
+    'Technology': ['Application Software', 'Semiconductors', 'Technology Hardware, Storage & Peripherals'],
+    'Healthcare': ['Pharmaceuticals', 'Health Care Equipment', 'Managed Health Care'],
+    'Financial Services': ['Diversified Banks', 'Asset Management & Custody Banks', 'Property & Casualty Insurance'],
+    'Industrials': ['Aerospace & Defense', 'Industrial Machinery & Supplies & Components', 'Rail Transportation'],
+    'Energy': ['Integrated Oil & Gas', 'Oil & Gas Exploration & Production'],
+    'Consumer Cyclical': ['Restaurants', 'Automobile Manufacturers', 'Apparel Retail'],
+    'Utilities': ['Electric Utilities', 'Multi-Utilities'],
+}
+SYNTHETIC_HISTORY_START = pd.Timestamp('2000-01-03')
+SYNTHETIC_NEWS_TITLES = [
+    "{name} beats quarterly earnings estimates", "{name} misses revenue expectations",
+    "{name} announces share buyback programme", "Analysts downgrade {name} on margin pressure",
+    "{name} raises full-year guidance", "{name} faces regulatory probe", "{name} names new chief executive",
+]
+
+
+class SyntheticProvider(MarketDataProvider):
+    # Generates statements and price paths from a seed: the same (seed, symbol, as_of) always gives the same data,
+    # and prices are a fixed path since SYNTHETIC_HISTORY_START so incremental downloads line up with earlier ones.
+    name = 'synthetic'
+
+    def __init__(self, seed: int = 0, as_of=None):
+        self.seed = seed
+        self.as_of = pd.Timestamp(as_of or date.today()).normalize()
+        self.dates = pd.bdate_range(SYNTHETIC_HISTORY_START, self.as_of, name='Date')
+
+    def _rng(self, symbol: str, stream: int) -> np.random.Generator:
+        # crc32 rather than hash() so the data is the same in every process
+        return np.random.default_rng([self.seed, zlib.crc32(symbol.encode()), stream])
+
+    def classification(self, symbol: str) -> Tuple[str, str]:
+        rng = self._rng(symbol, 0)
+        sector = list(SYNTHETIC_SECTORS.keys())[rng.integers(len(SYNTHETIC_SECTORS))]
+        sub_industries = SYNTHETIC_SECTORS[sector]
+        return sector, sub_industries[rng.integers(len(sub_industries))]
+
+    def universe(self, n_tickers: int) -> Dict[str, str]:
+        # ticker -> sub-industry map in the shape main_run / run_ingestion_job expect
+        tickers = [f"SYN{i:05d}" for i in range(n_tickers)]
+        return {ticker: self.classification(ticker)[1] for ticker in tickers}
+
+    def close_prices(self, symbol: str) -> np.ndarray:
+        # geometric brownian motion over the full synthetic calendar
+        rng = self._rng(symbol, 1)
+        start_price = rng.uniform(10, 400)
+        mu, sigma = rng.uniform(-0.05, 0.2) / 252, rng.uniform(0.15, 0.6) / np.sqrt(252)
+        # drawn last, so a later as_of only extends the path
+        log_returns = rng.normal(mu - sigma ** 2 / 2, sigma, size=len(self.dates))
+        return start_price * np.exp(np.cumsum(log_returns))
+
+    def window_mask(self, period: str = None, start=None, end=None, **_) -> np.ndarray:
+        mask = np.ones(len(self.dates), dtype=bool)
+        if start is not None:
+            mask &= self.dates >= pd.Timestamp(start)
+        elif period and period != 'max':
+            amount, unit = re.fullmatch(r'(\d+)(d|mo|y)', period).groups()
+            offset = {'d': pd.DateOffset(days=int(amount)), 'mo': pd.DateOffset(months=int(amount)),
+                      'y': pd.DateOffset(years=int(amount))}[unit]
+            mask &= self.dates > self.as_of - offset
+        if end is not None:
+            mask &= self.dates < pd.Timestamp(end)
+        return mask
+
+    def fundamentals(self, symbol: str) -> Dict[str, float]:
+        rng = self._rng(symbol, 2)
+        gross_margin = rng.uniform(0.2, 0.7)
+        operating_margin = gross_margin - rng.uniform(0.05, 0.18)
+        return {
+            'quarterly_revenue': 10 ** rng.uniform(8, 10.5),
+            'revenue_growth': rng.normal(0.015, 0.02),
+            'gross_margin': gross_margin,
+            'operating_margin': operating_margin,
+            'net_margin': operating_margin * rng.uniform(0.6, 0.85),
+            'shares': 10 ** rng.uniform(7.5, 9.5),
+            'asset_turnover': rng.uniform(0.3, 1.0),
+            'equity_ratio': rng.uniform(0.25, 0.6),
+            'current_ratio': rng.uniform(0.2, 0.5),
+            'inventory_share': rng.uniform(0.0, 0.4),
+            'cash_conversion': rng.uniform(1.05, 1.5),
+            'capex_intensity': rng.uniform(0.03, 0.1),
+            'short_ratio': rng.uniform(1, 6),
+        }
+
+    def ticker(self, symbol: str, rate_limiter=None):
+        return SyntheticTicker(self, symbol)
+
+    def download(self, tickers: List[str], rate_limiter=None, **kwargs) -> pd.DataFrame:
+        if isinstance(tickers, str):
+            tickers = tickers.split()
+        mask = self.window_mask(**kwargs)
+        closes = pd.DataFrame({ticker: self.close_prices(ticker)[mask] for ticker in tickers}, index=self.dates[mask])
+        closes.columns.name = 'Ticker'
+        return pd.concat({'Close': closes}, axis=1, names=['Price'])
+
+
+class SyntheticTicker:
+    # The yf.Ticker subset backed by a SyntheticProvider. Statement frames follow yfinance's layout:
+    # line items as rows, period end dates as columns, newest first.
+    def __init__(self, provider: SyntheticProvider, symbol: str):
+        self.provider = provider
+        self.ticker = symbol
+        self._fundamentals = provider.fundamentals(symbol)
+
+    def _period_revenue(self, n_periods: int, freq, quarters_per_period: int) -> Tuple[pd.DatetimeIndex, np.ndarray]:
+        # revenue per period, most recent first, with the usual ~6 week reporting lag
+        f = self._fundamentals
+        rng = self.provider._rng(self.ticker, 3)
+        periods = pd.date_range(end=self.provider.as_of - pd.Timedelta(days=45), periods=n_periods, freq=freq)[::-1]
+        growth = (1 + f['revenue_growth']) ** (-quarters_per_period * np.arange(n_periods))
+        noise = rng.normal(1, 0.03, size=n_periods)
+        return periods, f['quarterly_revenue'] * quarters_per_period * growth * noise
+
+    def _income_statement(self, periods: pd.DatetimeIndex, revenue: np.ndarray) -> pd.DataFrame:
+        f = self._fundamentals
+        gross_profit = revenue * f['gross_margin']
+        operating_income = revenue * f['operating_margin']
+        net_income = revenue * f['net_margin']
+        eps = net_income / f['shares']
+        return pd.DataFrame({
+            'Total Revenue': revenue,
+            'Cost Of Revenue': revenue - gross_profit,
+            'Gross Profit': gross_profit,
+            'Operating Expense': gross_profit - operating_income,
+            'Operating Income': operating_income,
+            'EBIT': operating_income,
+            'EBITDA': operating_income * 1.15,
+            'Tax Provision': (operating_income - net_income) * 0.8,
+            'Net Income': net_income,
+            'Net Income Continuous Operations': net_income,
+            'Basic EPS': eps,
+            'Diluted EPS': eps * 0.98,
+            'Total Expenses': revenue - operating_income,
+        }, index=periods).transpose()
+
+    @property
+    def quarterly_financials(self) -> pd.DataFrame:
+        return self._income_statement(*self._period_revenue(5, pd.offsets.QuarterEnd(), 1))
+
+    @property
+    def income_stmt(self) -> pd.DataFrame:
+        return self._income_statement(*self._period_revenue(4, pd.offsets.YearEnd(), 4))
+
+    def get_balance_sheet(self, **kwargs) -> pd.DataFrame:
+        f = self._fundamentals
+        periods, revenue = self._period_revenue(4, pd.offsets.YearEnd(), 4)
+        total_assets = revenue / f['asset_turnover']
+        equity = total_assets * f['equity_ratio']
+        current_assets = total_assets * f['current_ratio']
+        return pd.DataFrame({
+            'TotalAssets': total_assets,
+            'StockholdersEquity': equity,
+            'TotalLiabilitiesNetMinorityInterest': total_assets - equity,
+            'CurrentAssets': current_assets,
+            'Inventory': current_assets * f['inventory_share'],
+            'CashAndCashEquivalents': current_assets * 0.3,
+            'Receivables': current_assets * 0.3,
+            'OrdinarySharesNumber': np.full(len(periods), f['shares']),
+        }, index=periods).transpose()
+
+    @property
+    def cashflow(self) -> pd.DataFrame:
+        f = self._fundamentals
+        periods, revenue = self._period_revenue(4, pd.offsets.YearEnd(), 4)
+        operating_cash_flow = revenue * f['net_margin'] * f['cash_conversion']
+        capital_expenditure = -revenue * f['capex_intensity']
+        return pd.DataFrame({
+            'Operating Cash Flow': operating_cash_flow,
+            'Capital Expenditure': capital_expenditure,
+            'Free Cash Flow': operating_cash_flow + capital_expenditure,
+            'Depreciation And Amortization': revenue * f['operating_margin'] * 0.15,
+        }, index=periods).transpose()
+
+    @property
+    def info(self) -> Dict:
+        f = self._fundamentals
+        sector, sub_industry = self.provider.classification(self.ticker)
+        last_close = float(self.provider.close_prices(self.ticker)[-1])
+        quarterly = self.quarterly_financials
+        annual_balance_sheet = self.get_balance_sheet().iloc[:, 0]
+        ttm_net_income = float(quarterly.loc['Net Income'].iloc[:4].sum())
+        ttm_ebitda = float(quarterly.loc['EBITDA'].iloc[:4].sum())
+        market_cap = last_close * f['shares']
+        equity = float(annual_balance_sheet['StockholdersEquity'])
+        enterprise_value = market_cap + float(annual_balance_sheet['TotalLiabilitiesNetMinorityInterest']) * 0.5 - \
+            float(annual_balance_sheet['CashAndCashEquivalents'])
+        return {
+            'quoteType': 'EQUITY',
+            'longName': f"{self.ticker} Holdings Inc.",
+            'sector': sector,
+            'industry': sub_industry,
+            'marketCap': market_cap,
+            'trailingPE': market_cap / ttm_net_income if ttm_net_income > 0 else 'Infinity',
+            'priceToBook': market_cap / equity,
+            'returnOnEquity': ttm_net_income / equity,
+            'debtToEquity': float(annual_balance_sheet['TotalLiabilitiesNetMinorityInterest']) / equity * 100,
+            'enterpriseValue': enterprise_value,
+            'profitMargins': f['net_margin'],
+            'enterpriseToEbitda': enterprise_value / ttm_ebitda if ttm_ebitda > 0 else None,
+            'netIncomeToCommon': ttm_net_income,
+            'sharesOutstanding': f['shares'],
+            'shortRatio': f['short_ratio'],
+        }
+
+    def history(self, **kwargs) -> pd.DataFrame:
+        mask = self.provider.window_mask(**kwargs)
+        return pd.DataFrame({'Close': self.provider.close_prices(self.ticker)[mask]}, index=self.provider.dates[mask])
+
+    def get_news(self, **kwargs) -> List[Dict]:
+        rng = self.provider._rng(self.ticker, 4)
+        titles = rng.choice(SYNTHETIC_NEWS_TITLES, size=5, replace=False)
+        return [{'title': title.format(name=self.ticker)} for title in titles]
+
+
+def get_provider(name: str = None, **kwargs) -> MarketDataProvider:
+    # PEER_TOOL_PROVIDER=synthetic switches every retriever to generated data
+    name = name or os.getenv('PEER_TOOL_PROVIDER', YFinanceProvider.name)
+    providers = {YFinanceProvider.name: YFinanceProvider, SyntheticProvider.name: SyntheticProvider}
+    if name not in providers:
+        raise ValueError(f"Unknown market data provider {name}, expected one of {list(providers.keys())}")
+    return providers[name](**kwargs)
+
+
+_default_provider = None
+
+
+def get_default_provider() -> MarketDataProvider:
+    global _default_provider
+    if _default_provider is None:
+        _default_provider = get_provider()
+    return _default_provider
+
+
+def set_default_provider(provider: MarketDataProvider):
+    global _default_provider
+    _default_provider = provider
@@ -18,7 +18,7 @@ query_create_industry_price_yoy_aggregation = """
     WITH industry_price_year_lag as (
         SELECT t1.*, t2.industry_close_price as close_price_year, t2.industry_close_price_indexed as close_price_indexed_year
         FROM industry_time_series as t1
-        JOIN (select *, date(date, '+1 YEAR') as date_lagged 
+        JOIN (select *, CAST(strftime('%s', date * 86400, 'unixepoch', '+1 year') AS INTEGER) / 86400 as date_lagged
             from industry_time_series) as t2
         ON t1.sub_industry = t2.sub_industry AND t1.date = t2.date_lagged
     ),
@@ -53,7 +53,7 @@ query_ticker_time_series_yoy = """
     WITH ticker_price_year_lag as (
         SELECT t1.*, t2.close_price as close_price_year, t2.close_price_indexed as close_price_indexed_year
         FROM ticker_time_series as t1
-        JOIN (select *, date(date, '+1 YEAR') as date_lagged
+        JOIN (select *, CAST(strftime('%s', date * 86400, 'unixepoch', '+1 year') AS INTEGER) / 86400 as date_lagged
             from ticker_time_series) as t2
         ON t1.ticker = t2.ticker AND t1.date = date_lagged
     ),
@@ -66,6 +66,19 @@ query_ticker_time_series_yoy = """
     SELECT ticker, date, close_price_yoy, close_price_indexed_yoy FROM temp_ticker_price_yoy
 """
 
+# first_close is the close the stored index is based on: the ticker's first close, which is the open of its first
+# monthly bar once retention.py has rolled its first rows up, NULL rather than 0 so no index is divided by it:
+query_ticker_price_history_bounds = """
+    WITH bounds as (
+        SELECT ticker, MIN(date) as first_date, MAX(date) as last_date FROM ticker_time_series GROUP BY ticker
+    )
+    SELECT B.ticker, B.first_date, B.last_date,
+        NULLIF(COALESCE((SELECT M.open_price FROM ticker_time_series_monthly as M WHERE M.ticker = B.ticker
+            ORDER BY M.date LIMIT 1), F.close_price), 0) as first_close
+    FROM bounds as B
+    JOIN ticker_time_series as F ON F.ticker = B.ticker AND F.date = B.first_date
+"""
+
 # query_ticker_metric_yoy = """
 #     WITH
 #
@@ -91,3 +104,264 @@ get_table_data_query = """
 get_table_data_within_dates_query = """
     SELECT * FROM ? where date >= ?
 """
+
+# fetch_table_data's queries, formatted with the table name, its key column (ticker or sub_industry) and the selected
+# columns; the filters are added as a WHERE clause on t1.
+query_select_table = """
+    SELECT {columns} FROM {table_name} as t1
+"""
+
+# The latest row of every key, for tables with (key, date) primary keys. Walks the distinct keys of the primary key
+# one index seek at a time (a loose index scan) instead of reading every row of the table:
+query_most_recent_per_key = """
+    WITH RECURSIVE table_keys(key_value) AS (
+        SELECT MIN({key_column}) FROM {table_name}
+        UNION ALL
+        SELECT (SELECT MIN({key_column}) FROM {table_name} WHERE {key_column} > table_keys.key_value) FROM table_keys
+        WHERE table_keys.key_value IS NOT NULL
+    )
+    SELECT {columns} FROM table_keys JOIN {table_name} as t1 ON t1.{key_column} = table_keys.key_value
+        AND t1.date = (SELECT MAX(date) FROM {table_name} WHERE {key_column} = table_keys.key_value)
+"""
+
+# formatted with the table name and one placeholder per ticker:
+query_delete_ticker_rows = """
+    DELETE FROM {table_name} WHERE ticker IN ({placeholders})
+"""
+
+query_delete_industry_rows_for_tickers = """
+    DELETE FROM {table_name} WHERE sub_industry IN (SELECT sub_industry FROM company_info WHERE ticker IN ({placeholders}))
+"""
+
+query_delete_industry_rows_for_ticker_since = """
+    DELETE FROM {table_name} WHERE sub_industry = (SELECT sub_industry FROM company_info WHERE ticker = ?) AND date >= ?
+"""
+
+query_latest_versions_since = """
+    SELECT ticker, MAX("version date") as last_version FROM data_storage_record
+    WHERE "version date" >= ?
+    GROUP BY ticker
+"""
+
+query_ticker_refresh_priority = """
+    SELECT r.ticker, r.last_version, q.last_report
+    FROM (SELECT ticker, MAX("version date") as last_version FROM data_storage_record GROUP BY ticker) r
+    LEFT JOIN (SELECT ticker, MAX(date) as last_report FROM quarterly_financial_data GROUP BY ticker) q
+    ON r.ticker = q.ticker
+"""
+
+query_create_data_record_version_index = """
+    CREATE INDEX IF NOT EXISTS idx_data_storage_record_version_date ON data_storage_record ("version date", ticker)
+"""
+
+query_create_ingestion_job_table = """
+    CREATE TABLE IF NOT EXISTS ingestion_job (
+        job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        created_at TEXT NOT NULL,
+        status TEXT NOT NULL
+    )
+"""
+
+query_create_ingestion_job_ticker_table = """
+    CREATE TABLE IF NOT EXISTS ingestion_job_ticker (
+        job_id INTEGER NOT NULL,
+        ticker TEXT NOT NULL,
+        sub_industry TEXT,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT,
+        updated_at TEXT,
+        FOREIGN KEY (job_id) REFERENCES ingestion_job(job_id),
+        PRIMARY KEY (job_id, ticker)
+    )
+"""
+
+# Columnar store export (columnar.py). columnar_change counts the rows inserted, updated and deleted per table and
+# calendar year, kept by triggers on the exported tables, so an export knows exactly which years changed since the
+# last one, whatever the rowids. A trigger is formatted with the table name, the event and the count of each changed
+# row (query_count_columnar_change formatted with the table name and the row, NEW or OLD):
+query_create_columnar_change_table = """
+    CREATE TABLE IF NOT EXISTS columnar_change (
+        table_name TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        changes INTEGER NOT NULL,
+        PRIMARY KEY (table_name, year)
+    ) WITHOUT ROWID
+"""
+
+query_create_columnar_change_trigger = """
+    CREATE TRIGGER IF NOT EXISTS {table_name}_{event}_columnar_change AFTER {event} ON {table_name}
+    BEGIN
+        {counts}
+    END
+"""
+
+query_count_columnar_change = """
+        INSERT INTO columnar_change (table_name, year, changes)
+        VALUES ('{table_name}', CAST(strftime('%Y', {row}.date * 86400, 'unixepoch') AS INTEGER), 1)
+        ON CONFLICT (table_name, year) DO UPDATE SET changes = changes + 1;
+"""
+
+# the existing rows of a table as its first changes, formatted with the table name:
+query_seed_columnar_change = """
+    INSERT OR REPLACE INTO columnar_change (table_name, year, changes)
+    SELECT '{table_name}', CAST(strftime('%Y', date * 86400, 'unixepoch') AS INTEGER) as year, COUNT(*)
+    FROM {table_name} GROUP BY year
+"""
+
+query_columnar_changes = """
+    SELECT year, changes FROM columnar_change WHERE table_name = ?
+"""
+
+query_rows_since_date = """
+    SELECT * FROM {table_name} WHERE date >= ?
+"""
+
+# Raw statement store (statements.py). Values are keyed by line item first, so both one line item across tickers and
+# one ticker's statement (a probe per line item of the dictionary) are primary key searches:
+query_create_statement_line_item_table = """
+    CREATE TABLE IF NOT EXISTS statement_line_item (
+        line_item_id INTEGER PRIMARY KEY,
+        statement TEXT NOT NULL,
+        name TEXT NOT NULL,
+        UNIQUE (statement, name)
+    )
+"""
+
+query_create_statement_value_table = """
+    CREATE TABLE IF NOT EXISTS statement_value (
+        line_item_id INTEGER NOT NULL,
+        ticker TEXT NOT NULL,
+        date INTEGER NOT NULL,
+        value REAL NOT NULL,
+        PRIMARY KEY (line_item_id, ticker, date)
+    ) WITHOUT ROWID
+"""
+
+query_insert_line_items = """
+    INSERT OR IGNORE INTO statement_line_item (statement, name) VALUES (?, ?)
+"""
+
+query_line_items = """
+    SELECT line_item_id, statement, name as line_item FROM statement_line_item
+"""
+
+query_statement_values = """
+    SELECT v.ticker, v.date, i.name, v.value
+    FROM statement_line_item as i JOIN statement_value as v ON v.line_item_id = i.line_item_id
+    WHERE i.statement = ?{filters}
+"""
+
+# Windowed aggregations (aggregation_engine.py): the rows of each key between its start and end day, read with
+# one primary key range scan per key (CROSS JOIN keeps the window as the outer loop, the planner has no statistics of
+# the temp table). aggregation_window is a temp table of (key, start_day, end_day):
+query_create_aggregation_window = """
+    CREATE TEMP TABLE IF NOT EXISTS aggregation_window (
+        key TEXT NOT NULL PRIMARY KEY,
+        start_day INTEGER NOT NULL,
+        end_day INTEGER NOT NULL
+    )
+"""
+
+query_aggregation_sub_industries = """
+    SELECT DISTINCT sub_industry FROM company_info WHERE sub_industry IS NOT NULL
+"""
+
+query_window_rows = """
+    SELECT {columns} FROM aggregation_window as w
+    CROSS JOIN {table_name} as t1 ON t1.{key_column} = w.key AND t1.date BETWEEN w.start_day AND w.end_day
+"""
+
+query_industry_price_window_rows = """
+    SELECT CI.sub_industry, TTS.date, TTS.close_price, TTS.close_price_indexed
+    FROM aggregation_window as w
+    CROSS JOIN company_info as CI ON CI.sub_industry = w.key
+    CROSS JOIN ticker_time_series as TTS ON TTS.ticker = CI.ticker AND TTS.date BETWEEN w.start_day AND w.end_day
+"""
+
+query_industry_metric_window_rows = """
+    SELECT CI.sub_industry, QFD.date, QFD.quarter_reporting, QFD."Basic EPS", QFD."Operating Income",
+        QFD."Net Income", QFD."Gross Margin", QFD."Operating Margin", QFD."Net Margin", QFD."EBITDA Margin"
+    FROM aggregation_window as w
+    CROSS JOIN company_info as CI ON CI.sub_industry = w.key
+    CROSS JOIN quarterly_financial_data as QFD ON QFD.ticker = CI.ticker AND QFD.date BETWEEN w.start_day AND w.end_day
+"""
+
+# Every row of the industry aggregations, for a first build in DuckDB (aggregation_engine.py):
+query_industry_price_rows = """
+    SELECT CI.sub_industry, TTS.date, TTS.close_price, TTS.close_price_indexed
+    FROM ticker_time_series as TTS JOIN company_info as CI ON TTS.ticker = CI.ticker
+"""
+
+query_industry_metric_rows = """
+    SELECT CI.sub_industry, QFD.date, QFD.quarter_reporting, QFD."Basic EPS", QFD."Operating Income",
+        QFD."Net Income", QFD."Gross Margin", QFD."Operating Margin", QFD."Net Margin", QFD."EBITDA Margin"
+    FROM quarterly_financial_data as QFD JOIN company_info as CI ON QFD.ticker = CI.ticker
+"""
+
+# The aggregations of the window's rows, as query_create_industry_price_aggregation, query_ticker_time_series_yoy etc.
+# do for every row. A YoY row is matched to the row dated a year before it, 365 or 366 days earlier, with a range of
+# the primary key. The window rows are MATERIALIZED before they are grouped, the GROUP BY would otherwise have the planner
+# build automatic indexes over the whole tables. Formatted with the key column, the source and target tables and the YoY
+# column lists:
+query_window_industry_price_aggregation = """
+    INSERT OR IGNORE INTO industry_time_series (sub_industry, date, industry_close_price, industry_close_price_indexed)
+    WITH window_rows AS MATERIALIZED (""" + query_industry_price_window_rows + """)
+    SELECT sub_industry, date, sum(close_price), sum(close_price_indexed) FROM window_rows GROUP BY sub_industry, date
+"""
+
+query_window_price_yoy_aggregation = """
+    INSERT OR IGNORE INTO {target_table} ({key_column}, date, {yoy_columns})
+    SELECT t1.{key_column}, t1.date, {yoy_values}
+    FROM aggregation_window as w
+    CROSS JOIN {source_table} as t1 ON t1.{key_column} = w.key AND t1.date BETWEEN w.start_day AND w.end_day
+    CROSS JOIN {source_table} as t2 ON t2.{key_column} = t1.{key_column} AND t2.date BETWEEN t1.date - 366 AND t1.date - 365
+        AND CAST(strftime('%s', t2.date * 86400, 'unixepoch', '+1 year') AS INTEGER) / 86400 = t1.date
+"""
+
+query_window_industry_metric_aggregation = """
+    INSERT OR IGNORE INTO industry_metrics (sub_industry, date, quarter_reporting, "Basic EPS", "Operating Income",
+        "Net Income", "Gross Margin", "Operating Margin", "Net Margin", "EBITDA Margin")
+    WITH window_rows AS MATERIALIZED (""" + query_industry_metric_window_rows + """)
+    SELECT sub_industry, MIN(date), quarter_reporting, AVG("Basic EPS"), AVG("Operating Income"), AVG("Net Income"),
+        AVG("Gross Margin"), AVG("Operating Margin"), AVG("Net Margin"), AVG("EBITDA Margin")
+    FROM window_rows GROUP BY sub_industry, quarter_reporting
+"""
+
+# Tiered price retention (retention.py): weekly and monthly OHLC bars of the close of a daily price table, dated by the
+# last trading day of the period and carrying the table's other value columns as of that day:
+query_create_price_bar_table = """
+    CREATE TABLE IF NOT EXISTS {table_name} (
+        ticker TEXT NOT NULL,
+        date INTEGER NOT NULL,
+        open_price REAL,
+        high_price REAL,
+        low_price REAL,
+        close_price REAL,
+        {carried_columns}
+        PRIMARY KEY (ticker, date)
+    )
+"""
+
+# The days each tier of a daily price table holds (first_day / last_day NULL: unbounded):
+query_create_price_tier_table = """
+    CREATE TABLE IF NOT EXISTS price_tier (
+        table_name TEXT NOT NULL,
+        tier TEXT NOT NULL,
+        first_day INTEGER,
+        last_day INTEGER,
+        PRIMARY KEY (table_name, tier)
+    )
+"""
+
+query_price_tiers = """
+    SELECT tier, first_day, last_day FROM price_tier WHERE table_name = ?
+"""
+
+query_replace_price_tier = """
+    INSERT OR REPLACE INTO price_tier (table_name, tier, first_day, last_day) VALUES (?, ?, ?, ?)
+"""
+
+query_delete_ticker_rows_before = """
+    DELETE FROM {table_name} WHERE ticker = ? AND date < ?
+"""
@@ -0,0 +1,216 @@
+"""Query plan check: runs EXPLAIN QUERY PLAN on every query in queries.py against the migrated schema, with planner
+statistics for a full-size universe, and fails on full scans of the large tables.
+The app's fetch_table_data reads are checked the same way.
+Run from the repo root: python -m src.peer_comparison_tool.data.query_plans [--verbose]"""
+
+import click
+import math
+import re
+import sqlite3
+import sys
+from typing import Dict, List, NamedTuple, Set, Tuple
+
+from . import queries
+from .queries import query_create_aggregation_window
+from .migrations import migrate
+from .columnar import COLUMNAR_TABLES
+from .db_utils import build_table_query
+
+# Planner statistics for roughly 5000 tickers with 10 years of daily prices:
+ESTIMATED_TABLE_ROWS = {
+    'ticker_time_series': 12_500_000,
+    'statement_value': 5_000_000,
+    'ticker_ts_yoy': 12_500_000,
+    'ticker_time_series_weekly': 2_600_000,
+    'ticker_time_series_monthly': 600_000,
+    'data_storage_record': 2_500_000,
+    'ingestion_job_ticker': 1_000_000,
+    'cluster_table': 500_000,
+    'industry_time_series': 375_000,
+    'industry_time_series_yoy': 375_000,
+    'quarterly_financial_data': 200_000,
+    'ticker_metrics_yoy': 200_000,
+    'asset_class_time_series': 50_000,
+    'asset_class_time_series_weekly': 10_000,
+    'balance_sheet_data': 50_000,
+    'cashflow_statement_data': 50_000,
+    'industry_metrics': 6_000,
+    'industry_metrics_yoy': 6_000,
+    'company_info': 5_000,
+    'ticker_most_recent_metric_data': 5_000,
+    'ingestion_job': 1_000,
+    'statement_line_item': 1_000,
+}
+COLUMN_DISTINCT_VALUES = {
+    'ticker': 5_000, 'sub_industry': 150, 'date': 2_500, 'version date': 500, 'quarter_reporting': 40,
+    'job_id': 1_000, 'status': 4, 'line_item_id': 1_000, 'statement': 3, 'name': 500,
+}
+DEFAULT_DISTINCT_VALUES = 100
+LARGE_TABLE_ROWS = 100_000  # a full scan of a table at least this big fails the check
+
+# Queries that are meant to read a whole table, e.g. the aggregations rebuilt over every ticker:
+ALLOWED_FULL_SCANS: Dict[str, Set[str]] = {
+    'query_create_industry_price_aggregation': {'ticker_time_series'},
+    'query_create_industry_price_yoy_aggregation': {'industry_time_series'},
+    'query_create_industry_metric_aggregation': {'quarterly_financial_data'},
+    'query_industry_price_rows': {'ticker_time_series'},  # read by a first build in DuckDB
+    'query_industry_metric_rows': {'quarterly_financial_data'},
+    'query_ticker_time_series_yoy': {'ticker_time_series'},
+    'query_ticker_price_history_bounds': {'ticker_time_series'},  # first/last row of every ticker
+    'query_ticker_refresh_priority': {'data_storage_record', 'quarterly_financial_data'},  # every ticker
+    'query_rows_since_date': set(COLUMNAR_TABLES),  # whole years of every ticker, exported to the columnar store
+    'query_seed_columnar_change': set(COLUMNAR_TABLES),  # once, by migration 7
+}
+# Templates are checked once per table they are formatted with:
+TEMPLATE_ARGS: Dict[str, List[Dict[str, str]]] = {
+    'query_most_recent_per_key': [{'table_name': table, 'key_column': key_column, 'columns': 't1.*'}
+                                  for table, key_column in [('cluster_table', 'ticker'), ('ticker_time_series', 'ticker'),
+                                                            ('industry_time_series', 'sub_industry')]],
+    'query_select_table': [{'table_name': 'company_info', 'columns': 't1.*'}],
+    'query_delete_ticker_rows': [{'table_name': table, 'placeholders': '?, ?'}
+                                 for table in ['ticker_time_series', 'ticker_ts_yoy', 'ticker_metrics_yoy']],
+    'query_delete_industry_rows_for_tickers': [{'table_name': table, 'placeholders': '?, ?'}
+                                               for table in ['industry_time_series', 'industry_time_series_yoy',
+                                                             'industry_metrics', 'industry_metrics_yoy']],
+    'query_delete_industry_rows_for_ticker_since': [{'table_name': table}
+                                                    for table in ['industry_time_series', 'industry_time_series_yoy']],
+    'query_seed_columnar_change': [{'table_name': table} for table in COLUMNAR_TABLES],
+    'query_rows_since_date': [{'table_name': table} for table in COLUMNAR_TABLES],
+    'query_window_rows': [{'table_name': table, 'key_column': key_column, 'columns': 't1.*'}
+                          for table, key_column in [('ticker_time_series', 'ticker'),
+                                                    ('asset_class_time_series', 'ticker'),
+                                                    ('industry_time_series', 'sub_industry')]],
+    'query_window_price_yoy_aggregation': [
+        {'source_table': source, 'target_table': target, 'key_column': key_column, 'yoy_columns': yoy_columns,
+         'yoy_values': yoy_values}
+        for source, target, key_column, yoy_columns, yoy_values in [
+            ('ticker_time_series', 'ticker_ts_yoy', 'ticker', 'close_price_yoy',
+             '(t1.close_price / t2.close_price - 1) * 100'),
+            ('industry_time_series', 'industry_time_series_yoy', 'sub_industry', 'industry_close_price_yoy',
+             '(t1.industry_close_price / t2.industry_close_price - 1) * 100')]],
+    'query_delete_ticker_rows_before': [{'table_name': table} for table in ['ticker_time_series',
+                                                                            'asset_class_time_series',
+                                                                            'ticker_time_series_weekly']],
+    'query_statement_values': [{'filters': filters} for filters in [' AND v.ticker IN (?)', ' AND i.name IN (?, ?)',
+                                                                    ' AND i.name IN (?) AND v.ticker IN (?, ?)']],
+}
+# The fetch_table_data reads of the app that must not scan whole tables (its date ranges on ticker tables do):
+FETCH_TABLE_DATA_CALLS: List[Dict] = [
+    {'table_name': 'ticker_time_series', 'tickers': ['A'], 'columns': ['date', 'close_price_indexed']},
+    {'table_name': 'ticker_ts_yoy', 'tickers': ['A'], 'columns': ['date', 'close_price_indexed_yoy']},
+    {'table_name': 'ticker_metrics_yoy', 'tickers': ['A']},
+    {'table_name': 'industry_time_series', 'sub_industries': ['B']},
+    {'table_name': 'industry_metrics_yoy', 'sub_industries': ['B']},
+    {'table_name': 'quarterly_financial_data', 'tickers': ['A', 'C']},
+    {'table_name': 'ticker_time_series', 'sectors': ['D']},
+    {'table_name': 'cluster_table', 'most_recent': True, 'columns': ['ticker', 'cluster_membership']},
+    {'table_name': 'ticker_time_series', 'most_recent': True, 'columns': ['date']},
+    {'table_name': 'ticker_time_series_monthly', 'tickers': ['A'], 'columns': ['date', 'close_price_indexed']},
+    {'table_name': 'ticker_time_series_weekly', 'tickers': ['A'], 'start_date': '2020-01-01'},
+]
+SKIPPED_QUERIES = {'get_table_data_query', 'get_table_data_within_dates_query',  # table name as a parameter, unused
+                   'query_count_columnar_change'}  # a statement of the columnar_change triggers
+
+SQL_STATEMENT_START = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+# a scan of the table, or the automatic index the planner builds from one:
+SCAN_PATTERN = re.compile(r'^(?:SCAN (\S+)|SEARCH (\S+) USING AUTOMATIC)')
+TABLE_ALIAS_PATTERN = re.compile(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+as)?\s+(\w+)', re.IGNORECASE)
+
+
+class PlanViolation(NamedTuple):
+    query_name: str
+    table: str
+    detail: str
+
+
+def create_planner_database() -> sqlite3.Connection:
+    # the migrated schema with sqlite_stat1 filled in as if the tables were full, no rows needed
+    conn = sqlite3.connect(':memory:')
+    migrate(conn)
+    conn.execute(query_create_aggregation_window)  # the temp table of the aggregation engine's window reads
+    conn.execute("ANALYZE")  # creates sqlite_stat1
+    indexes = conn.execute("SELECT name, tbl_name FROM sqlite_master WHERE type = 'index'").fetchall()
+    for index_name, table in indexes:
+        table_rows = ESTIMATED_TABLE_ROWS.get(table, 1_000)
+        columns = [row[2] for row in conn.execute(f'PRAGMA index_info("{index_name}")')]
+        stat = [table_rows]
+        distinct_keys = 1
+        for column in columns:
+            distinct_keys = min(table_rows, distinct_keys * COLUMN_DISTINCT_VALUES.get(column, DEFAULT_DISTINCT_VALUES))
+            stat.append(math.ceil(table_rows / distinct_keys))
+        conn.execute("INSERT INTO sqlite_stat1 (tbl, idx, stat) VALUES (?, ?, ?)",
+                     (table, index_name, " ".join(map(str, stat))))
+    conn.execute("ANALYZE sqlite_schema")  # reload the statistics
+    return conn
+
+
+def collect_queries() -> Dict[str, str]:
+    checked_queries = {}
+    for name, sql in vars(queries).items():
+        if name.startswith('_') or name in SKIPPED_QUERIES or not isinstance(sql, str):
+            continue
+        if not sql.strip().upper().startswith(SQL_STATEMENT_START):
+            continue  # DDL
+        for template_args in TEMPLATE_ARGS.get(name, [{}]):
+            label_arg = template_args.get('table_name') or ", ".join(template_args.values()).strip()
+            label = f"{name}[{label_arg}]" if template_args else name
+            checked_queries[label] = sql.format(**template_args) if template_args else sql
+    return checked_queries
+
+
+def explain(conn, sql: str, params: list) -> List[str]:
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+
+def find_full_scans(query_name: str, sql: str, plan: List[str]) -> List[PlanViolation]:
+    aliases = {alias.lower(): table for table, alias in TABLE_ALIAS_PATTERN.findall(sql)}
+    allowed = ALLOWED_FULL_SCANS.get(query_name.split('[')[0], set())
+    violations = []
+    for detail in plan:
+        match = SCAN_PATTERN.match(detail)
+        if match is None:
+            continue
+        alias = match.group(1) or match.group(2)
+        table = aliases.get(alias.lower(), alias)
+        if ESTIMATED_TABLE_ROWS.get(table, 0) >= LARGE_TABLE_ROWS and table not in allowed:
+            violations.append(PlanViolation(query_name, table, detail))
+    return violations
+
+
+def collect_fetch_queries(conn) -> Dict[str, Tuple[str, list]]:
+    fetch_queries = {}
+    for call in FETCH_TABLE_DATA_CALLS:
+        filters = ", ".join(f"{key}={value}" for key, value in call.items() if key != 'table_name')
+        fetch_queries[f"fetch_table_data[{call['table_name']}, {filters}]"] = build_table_query(conn, **call)
+    return fetch_queries
+
+
+def check_query_plans(verbose: bool = False) -> List[PlanViolation]:
+    conn = create_planner_database()
+    violations = []
+    checked_queries = {name: (sql, [None] * sql.count('?')) for name, sql in collect_queries().items()}
+    for query_name, (sql, params) in (checked_queries | collect_fetch_queries(conn)).items():
+        plan = explain(conn, sql, params)
+        query_violations = find_full_scans(query_name, sql, plan)
+        violations += query_violations
+        if verbose or query_violations:
+            print(f"{'FULL SCAN' if query_violations else 'ok'}: {query_name}")
+            for detail in plan:
+                print(f"    {detail}")
+    conn.close()
+    return violations
+
+
+@click.command()
+@click.option('--verbose', is_flag=True, default=False, help='Print the plan of every query, not only the failing ones')
+def execute(verbose):
+    violations = check_query_plans(verbose)
+    for violation in violations:
+        print(f"{violation.query_name} scans all of {violation.table}: {violation.detail}")
+    print(f"{len(collect_queries()) + len(FETCH_TABLE_DATA_CALLS)} queries checked, "
+          f"{len(violations)} full scans of large tables")
+    sys.exit(1 if violations else 0)
+
+
+if __name__ == '__main__':
+    execute()
@@ -0,0 +1,25 @@
+"""Thread-safe request rate limiting shared by the ingestion worker threads"""
+
+import threading
+import time
+from collections import defaultdict
+
+from .constants import YAHOO_HOST
+
+
+class HostRateLimiter:
+    # Spaces requests to the same host at least 1 / requests_per_second apart, across all threads.
+    def __init__(self, requests_per_second: float = None):
+        self.min_interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = defaultdict(float)
+
+    def acquire(self, host: str = YAHOO_HOST):
+        if not self.min_interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot[host])
+            self._next_slot[host] = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
@@ -0,0 +1,200 @@
+"""Tiered retention of the daily price tables (ticker_time_series and asset_class_time_series), so the database and
+the app's loads stay bounded as the refreshes keep appending days. Every complete week and month of a table is rolled
+up into OHLC bars of the close ({table}_weekly and {table}_monthly), then the daily rows older than the policy's daily
+window and the weekly bars older than its weekly window are deleted, the monthly bars are kept for good. price_tier
+records the days each tier holds, which columnar.fetch_price_history uses to read long ranges from the bars.
+Each run ANALYZEs the rolled tables and VACUUMs once enough of the file is free pages.
+Apply the policy now from the repo root: python -m src.peer_comparison_tool.data.retention [--status]"""
+
+import click
+import sqlite3
+import numpy as np
+import pandas as pd
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from .aggregation_engine import last_dates, read_window_rows, FULL_HISTORY, YOY_LAG_DAYS
+from .bulk_load import bulk_load
+from .queries import query_window_rows, query_price_tiers, query_replace_price_tier, query_delete_ticker_rows_before
+from .constants import DAILY_RETENTION_DAYS, WEEKLY_RETENTION_DAYS, VACUUM_FREE_FRACTION
+
+# The daily price tables, with the value columns (and their types) their bars carry as of the period's last day:
+TIERED_TABLES: Dict[str, Dict[str, str]] = {
+    'ticker_time_series': {'close_price_indexed': 'REAL'},
+    'asset_class_time_series': {'AssetClass': 'TEXT', 'close_price_indexed': 'REAL', 'close_price_yoy': 'REAL'},
+}
+BAR_TIERS = ['weekly', 'monthly']  # finest first
+ANALYSIS_LIMIT = 1_000  # rows sampled per index by ANALYZE
+
+
+class RetentionPolicy(NamedTuple):
+    daily_days: int = DAILY_RETENTION_DAYS  # counted back from the latest date of the table
+    weekly_days: int = WEEKLY_RETENTION_DAYS
+    vacuum_free_fraction: float = VACUUM_FREE_FRACTION
+
+    def validate(self):
+        if self.daily_days < YOY_LAG_DAYS:
+            raise ValueError(f"daily_days must be at least {YOY_LAG_DAYS}, the YoY aggregations read a year of days")
+        if self.weekly_days < self.daily_days:
+            raise ValueError("weekly_days must be at least daily_days")
+
+
+class TierBounds(NamedTuple):
+    first_day: Optional[int]  # None: from the first stored day
+    last_day: Optional[int]  # None: up to the latest stored day
+
+
+def bar_table_name(table_name: str, tier: str) -> str:
+    return f"{table_name}_{tier}"
+
+
+def tier_columns(table_name: str) -> List[str]:
+    # the columns the daily table and its bar tables share
+    return ['ticker', 'date', 'close_price'] + list(TIERED_TABLES[table_name])
+
+
+def period_starts(days: np.ndarray, tier: str) -> np.ndarray:
+    # the first epoch day of the week (Monday) or month of each epoch day
+    days = np.asarray(days, dtype=np.int64)
+    if tier == 'weekly':
+        return days - (days + 3) % 7  # epoch day 0 was a Thursday
+    return days.astype('datetime64[D]').astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)
+
+
+def next_period_starts(days: np.ndarray, tier: str) -> np.ndarray:
+    days = np.asarray(days, dtype=np.int64)
+    if tier == 'weekly':
+        return period_starts(days, tier) + 7
+    return (days.astype('datetime64[D]').astype('datetime64[M]') + 1).astype('datetime64[D]').astype(np.int64)
+
+
+def price_bars(df: pd.DataFrame, tier: str, carried_columns: List[str]) -> pd.DataFrame:
+    # the OHLC bars of the close per ticker and period, dated by the period's last day and with its carried columns
+    df = df.sort_values(['ticker', 'date'])
+    df['period'] = period_starts(df['date'].to_numpy(), tier)
+    df_bars = df.groupby(['ticker', 'period'], sort=False).agg(
+        date=('date', 'last'), open_price=('close_price', 'first'), high_price=('close_price', 'max'),
+        low_price=('close_price', 'min'), close_price=('close_price', 'last'),
+        **{col: (col, 'last') for col in carried_columns})
+    return df_bars.reset_index().drop(columns=['period'])
+
+
+def roll_up(cursor, table_name: str, tier: str, table_last: pd.Series) -> int:
+    """Write the bars of the complete periods (the ones before the period of the table's latest day) that each ticker
+    has no bar for yet, reading only the daily rows after its last bar. Returns the last day the bars cover."""
+    end_day = int(period_starts([table_last.max()], tier)[0]) - 1
+    bar_last = last_dates(cursor.connection, bar_table_name(table_name, tier), 'ticker').reindex(
+        table_last.index, fill_value=FULL_HISTORY)
+    start_days = np.where(bar_last > FULL_HISTORY, next_period_starts(bar_last.clip(lower=0), tier), FULL_HISTORY)
+    df_windows = pd.DataFrame({'key': table_last.index, 'start_day': start_days, 'end_day': end_day})
+    df_windows = df_windows[df_windows['start_day'] <= end_day]
+    if not df_windows.empty:
+        carried_columns = list(TIERED_TABLES[table_name])
+        columns = ", ".join(f't1."{col}"' for col in tier_columns(table_name))
+        df = read_window_rows(cursor, df_windows, query_window_rows.format(
+            columns=columns, table_name=table_name, key_column='ticker'))
+        # REPLACE: a ticker rebuilt after a price adjustment has its bars rolled again
+        bulk_load(cursor, bar_table_name(table_name, tier), price_bars(df, tier, carried_columns),
+                  on_conflict='REPLACE')
+    return end_day
+
+
+def delete_rows_before(cursor, table_name: str, tickers, first_day: int) -> int:
+    # a primary key range per ticker rather than a scan of the whole table
+    cursor.executemany(query_delete_ticker_rows_before.format(table_name=table_name),
+                       [(ticker, first_day) for ticker in tickers])
+    return cursor.rowcount
+
+
+def price_tiers(conn, table_name: str) -> Dict[str, TierBounds]:
+    # tier -> the days it holds, empty before the first retention run
+    return {tier: TierBounds(first_day, last_day)
+            for tier, first_day, last_day in conn.execute(query_price_tiers, (table_name, ))}
+
+
+def tier_ranges(tiers: Dict[str, TierBounds], start_day: Optional[int] = None,
+                end_day: Optional[int] = None) -> List[Tuple[str, Optional[int], Optional[int]]]:
+    """The (tier, first_day, last_day) ranges, oldest first, a read of the days from start_day to end_day (None:
+    unbounded) is stitched from: the daily rows for the days the daily tier holds, the weekly bars for the days before
+    it and the monthly bars for the days before the weekly ones."""
+    if 'daily' not in tiers:
+        return [('daily', start_day, end_day)]
+    ranges = []
+    last_day = end_day
+    for tier in ['daily'] + BAR_TIERS:
+        tier_first_day = tiers[tier].first_day
+        first_day = tier_first_day if start_day is None else max(start_day, tier_first_day or start_day)
+        if last_day is None or first_day is None or first_day <= last_day:
+            ranges.append((tier, first_day, last_day))
+        if tier_first_day is None or (start_day is not None and start_day >= tier_first_day):
+            break
+        last_day = tier_first_day - 1 if last_day is None else min(last_day, tier_first_day - 1)
+    return ranges[::-1] or [('daily', start_day, end_day)]
+
+
+def optimize_database(conn, vacuum_free_fraction: float = VACUUM_FREE_FRACTION):
+    # refresh the planner statistics of the rolled tables, and give the deleted pages back once there are enough
+    conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+    for table_name in TIERED_TABLES:
+        for name in [table_name] + [bar_table_name(table_name, tier) for tier in BAR_TIERS]:
+            conn.execute(f'ANALYZE "{name}"')
+    conn.commit()
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    if page_count and free_pages / page_count >= vacuum_free_fraction:
+        try:
+            conn.execute("VACUUM")
+            print(f"Vacuumed the database, {free_pages} of {page_count} pages were free")
+        except sqlite3.OperationalError as e:
+            print(f"{e}: VACUUM skipped, it is retried after the next retention run")
+
+
+def apply_retention(conn, policy: RetentionPolicy = RetentionPolicy()) -> Dict[str, int]:
+    """Roll up, trim and record the tiers of every tiered table, commit, then optimize the database.
+    Returns the daily rows deleted per table. conn must not be in a transaction, the VACUUM can't run in one."""
+    policy.validate()
+    if conn.in_transaction:
+        raise ValueError("Commit the refresh before applying the retention policy")
+    cursor = conn.cursor()
+    deleted = {}
+    for table_name in TIERED_TABLES:
+        table_last = last_dates(conn, table_name, 'ticker')
+        if table_last.empty:
+            continue
+        latest_day = int(table_last.max())
+        bar_last_days = {tier: roll_up(cursor, table_name, tier, table_last) for tier in BAR_TIERS}
+        daily_first_day = latest_day - policy.daily_days + 1
+        weekly_first_day = latest_day - policy.weekly_days + 1
+        deleted[table_name] = delete_rows_before(cursor, table_name, table_last.index, daily_first_day)
+        weekly_table = bar_table_name(table_name, 'weekly')
+        delete_rows_before(cursor, weekly_table, last_dates(conn, weekly_table, 'ticker').index, weekly_first_day)
+        cursor.executemany(query_replace_price_tier, [
+            (table_name, 'daily', daily_first_day, None),
+            (table_name, 'weekly', weekly_first_day, bar_last_days['weekly']),
+            (table_name, 'monthly', None, bar_last_days['monthly']),
+        ])
+        print(f"{table_name}: rolled up to {bar_last_days['weekly']} (weekly) and {bar_last_days['monthly']} "
+              f"(monthly), {deleted[table_name]} daily rows past the retention window deleted")
+    conn.commit()
+    cursor.close()
+    optimize_database(conn, policy.vacuum_free_fraction)
+    return deleted
+
+
+@click.command()
+@click.option('--status', is_flag=True, default=False, help='Only print the tiers and the free pages')
+def execute(status):
+    from .db import initialize_db_connection, close_db
+    from ..comparison_tool.constants import DB_PATH
+
+    sql_conn = initialize_db_connection(DB_PATH)
+    if not status:
+        apply_retention(sql_conn)
+    for table_name in TIERED_TABLES:
+        print(table_name, price_tiers(sql_conn, table_name))
+    page_count = sql_conn.execute("PRAGMA page_count").fetchone()[0]
+    print(f"{sql_conn.execute('PRAGMA freelist_count').fetchone()[0]} of {page_count} pages free")
+    close_db(sql_conn, DB_PATH)
+
+
+if __name__ == '__main__':
+    execute()
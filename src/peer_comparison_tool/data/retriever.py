@@ -1,9 +1,17 @@
 """Class to retrieve and process the finance data gathered from the API"""
 
+import json
 import pandas as pd
 import numpy as np
-import yfinance as yf
 import os
+from dataclasses import dataclass, asdict, fields
+from typing import List, Optional, Dict, Any
+
+from .cache import CacheMissError
+from .providers import MarketDataProvider, get_default_provider
+from .constants import PRICE_HISTORY_CHUNK_SIZE
+from .transform import StatementPayload, QFINANCIAL_ROWS, CASHFLOW_ROWS, quarterly_financials_app_data, \
+    balance_sheet_app_data, cashflow_app_data
 
 
 class DataRetrievalError(Exception):
@@ -11,8 +19,75 @@ class DataRetrievalError(Exception):
     pass
 
 
+@dataclass(frozen=True)
+class StockInfoSnapshot:
+    """The fields we use from yfinance's Ticker.info, read once per ticker.
+    Serialisable with to_dict / to_json so a snapshot can be stored and replayed into RetrieveStockData."""
+    ticker: str
+    name: Optional[str] = None
+    industry: Optional[str] = None
+    sector: Optional[str] = None
+    market_cap: Optional[float] = None
+    trailing_pe: Optional[float] = None
+    price_to_book: Optional[float] = None
+    return_on_equity: Optional[float] = None
+    debt_to_equity: Optional[float] = None
+    enterprise_value: Optional[float] = None
+    profit_margins: Optional[float] = None
+    enterprise_to_ebitda: Optional[float] = None
+    net_income_to_common: Optional[float] = None
+    shares_outstanding: Optional[float] = None
+    short_ratio: Optional[float] = None
+    quote_type: Optional[str] = None
+
+    # snapshot field -> Ticker.info key
+    INFO_KEYS = {
+        'quote_type': 'quoteType', 'name': 'longName', 'industry': 'industry', 'sector': 'sector', 'market_cap': 'marketCap', 'trailing_pe': 'trailingPE',
+        'price_to_book': 'priceToBook', 'return_on_equity': 'returnOnEquity', 'debt_to_equity': 'debtToEquity',
+        'enterprise_value': 'enterpriseValue', 'profit_margins': 'profitMargins',
+        'enterprise_to_ebitda': 'enterpriseToEbitda', 'net_income_to_common': 'netIncomeToCommon',
+        'shares_outstanding': 'sharesOutstanding', 'short_ratio': 'shortRatio',
+    }
+
+    @classmethod
+    def from_info(cls, ticker: str, info: Dict[str, Any]) -> 'StockInfoSnapshot':
+        info = info or {}
+        values = {field: info.get(key) for field, key in cls.INFO_KEYS.items()}
+        if values['trailing_pe'] == 'Infinity':
+            values['trailing_pe'] = np.inf
+        return cls(ticker=ticker, **values)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'StockInfoSnapshot':
+        names = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in names})
+
+    @classmethod
+    def from_json(cls, payload: str) -> 'StockInfoSnapshot':
+        return cls.from_dict(json.loads(payload))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict())
+
+
+@dataclass(frozen=True)
+class FetchPlan:
+    """The datasets a RetrieveStockData is allowed to fetch. Nothing is fetched until it is first used."""
+    info: bool = True
+    quarterly_financials: bool = True
+    balance_sheet: bool = True
+    cashflow: bool = True
+
+
+FULL_FETCH_PLAN = FetchPlan()
+
+
 class RetrieveEconomicsData:
-    def __init__(self):
+    def __init__(self, provider: Optional[MarketDataProvider] = None):
+        self.provider = provider or get_default_provider()
         self.commodities = {"GC=F": "GoldFutures", "BZ=F": "CrudeOilFutures", "NG=F": "NaturalGasFutures", "ZW=F": "WheatFutures"}
         self.index_funds = {"^GSPC": "S&P500_Index", "^DJI": "DowJones_Index", "^IXIC": "NASDAQ_Index", "^RUT": "Russell2000_Index"}
         self.equity_traded_funds = {"SPY": "S&P500_ETF", "QQQ": "NASDAQ_ETF", "IWM": "Russell2000_ETF", "XLK": "TechSector",
@@ -20,93 +95,116 @@ class RetrieveEconomicsData:
                                     "XLY": "ConsumerDiscretionary_Sector"}
         self.currency_exchange = {"EURUSD=X": "EuroUSD_fx"}
         self.non_stock_entities = self.commodities | self.index_funds | self.equity_traded_funds | self.currency_exchange
-        self.ticker_info = pd.DataFrame({
-            'AssetClass': ['commodity'] * len(list(self.commodities.keys())) + ['index_fund'] * len(list(self.index_funds.keys())) +
-            ['etf'] * len(list(self.equity_traded_funds.keys())) + ['fx'] * len(list(self.currency_exchange.keys())),
-            'ticker': list(self.commodities.values()) + list(self.index_funds.values()) + list(self.equity_traded_funds.values()) + list(self.currency_exchange.values())
-        })
+        self.asset_classes = {symbol: 'commodity' for symbol in self.commodities} | \
+            {symbol: 'index_fund' for symbol in self.index_funds} | \
+            {symbol: 'etf' for symbol in self.equity_traded_funds} | \
+            {symbol: 'fx' for symbol in self.currency_exchange}
 
     def retrieve_economic_data(self):
-        # Fetch data
-        df = yf.download(list(self.non_stock_entities.keys()), period='2y', interval='1d')
-        df.columns = ['_'.join(col).strip() for col in df.columns.values]
-        close_cols = [c for c in df.columns if c.startswith("Close_")]
-        df = df[close_cols]
-        df.fillna(method='bfill', inplace=True)
-        # 1. create index columns:
-        df_index = df.copy()
-
-        for col in close_cols:
-            first_value = df_index[col].iloc[0]
-            df_index[col] = df_index[col] / first_value * 100
-        df_index = df_index[close_cols]
-        df_index = self._create_melted_dataframe(df_index, close_cols, "_indexed")
-        df_index.drop(columns=['AssetClass'], inplace=True)
-
-        # 2. yoy columns:
-        df_plus_year = df.copy()
-        df_plus_year = self._create_melted_dataframe(df_plus_year, close_cols, "_yoy")
-        df_plus_year['date_lagged'] = df_plus_year['date'] + pd.DateOffset(years=1)
-        df_plus_year['date_lagged'] = pd.to_datetime(df_plus_year['date_lagged']).dt.date
-        df_plus_year = pd.merge(df_plus_year.drop(columns=['date_lagged']),
-                                df_plus_year.drop(columns=['date', 'AssetClass']), left_on=['ticker', 'date'],
-                                right_on=['ticker', 'date_lagged'], how='inner', suffixes=('', '_lagged'))
-        df_plus_year['close_price_yoy'] = (df_plus_year['close_price_yoy'] / df_plus_year['close_price_yoy_lagged'].clip(lower=1) - 1) * 100
-        df_plus_year = df_plus_year[['date', 'ticker', 'close_price_yoy']]
-
-        # 3. original series columns:
-        df = self._create_melted_dataframe(df, close_cols, "")
-
-        # Join all columns together:
-        df = pd.merge(df, df_plus_year, on=['ticker', 'date'], how='outer')
-        df = pd.merge(df, df_index, on=['ticker', 'date'], how='outer')
-
-        return df
-
-    def _create_melted_dataframe(self, df, close_cols, value_column_append: str = ""):
-        column_map = {k: self.non_stock_entities[k.split("e_")[1]] for k in close_cols}
-        df.rename(columns=column_map, inplace=True)
-        df['date'] = pd.to_datetime(df.index).date
-        df = pd.melt(df, id_vars=['date'], var_name='ticker', value_name=f'close_price{value_column_append}')
-        df = pd.merge(df, self.ticker_info, on='ticker')
-        return df
+        # Fetch data, one close price column per series:
+        df = self.provider.download(list(self.non_stock_entities.keys()), period='2y', interval='1d')
+        df_close = df['Close'].bfill()
+        symbols = [symbol for symbol in self.non_stock_entities if symbol in df_close.columns]
+        closes = df_close[symbols].to_numpy(dtype=float)  # (dates, series)
+        dates = pd.DatetimeIndex(df_close.index).tz_localize(None)
+
+        # level, indexed to the first day and yoy against the nearest trading day on or before a year earlier,
+        # computed for every series in one pass over the wide array:
+        indexed = closes / closes[0] * 100
+        lag_positions = dates.searchsorted(dates - pd.DateOffset(years=1), side='right') - 1
+        has_lag = lag_positions >= 0
+        yoy = np.full_like(closes, np.nan)
+        yoy[has_lag] = (closes[has_lag] / np.clip(closes[lag_positions[has_lag]], 1, None) - 1) * 100
+
+        # long format straight from the arrays, series by series:
+        n_dates = len(dates)
+        return pd.DataFrame({
+            'date': np.tile(dates.date, len(symbols)),
+            'ticker': np.repeat([self.non_stock_entities[symbol] for symbol in symbols], n_dates),
+            'close_price': closes.ravel(order='F'),
+            'AssetClass': np.repeat([self.asset_classes[symbol] for symbol in symbols], n_dates),
+            'close_price_yoy': yoy.ravel(order='F'),
+            'close_price_indexed': indexed.ravel(order='F'),
+        })
 
 
 class RetrieveStockData:
     # Retrieve one stock ticker (info, history etc.) and create a small number of keys metrics with latest yfinance dat
-    def __init__(self, stock_ticker: str):
+    def __init__(self, stock_ticker: str, fetch_plan: FetchPlan = FULL_FETCH_PLAN, rate_limiter=None,
+                 info_snapshot: Optional[StockInfoSnapshot] = None, provider: Optional[MarketDataProvider] = None):
         self._df_quarterly = None
         self._df_balance_sheet = None
         self._df_stock_history = None
         self._df_cashflow = None
-        self.stock_info = None
-        self.stock_info_key = None
-        self.recent_key_metrics = None
+        self._info_snapshot = info_snapshot  # pass a stored snapshot to replay it instead of fetching .info
+        self._recent_key_metrics = None
+        self.fetch_plan = fetch_plan
 
         self.data_store = {}
         self.stock_level_data_store = {}
-        self.qfin_columns = ['Basic EPS', 'Operating Income', 'Total Revenue', 'Gross Profit', 'Net Income', 'EBITDA']
-        self.cashflow_columns = ['Free Cash Flow', 'Operating Cash Flow', 'Capital Expenditure']
+        self.qfin_columns = QFINANCIAL_ROWS
+        self.cashflow_columns = CASHFLOW_ROWS
         self.stock_ticker = stock_ticker  # Tickers if we want to look at multiple stock tickers at once
-        self.stock = yf.Ticker(self.stock_ticker)
-        self.stock_check_then_retrieve_data()
-        self.retrieve_stock_info()
-        self._retrieve_recent_metrics()
+        self.rate_limiter = rate_limiter  # shared HostRateLimiter when ingesting concurrently
+        self.provider = provider or get_default_provider()
+        self.stock = self.provider.ticker(self.stock_ticker, rate_limiter=rate_limiter)
+
+    def _require(self, dataset: str):
+        if not getattr(self.fetch_plan, dataset):
+            raise DataRetrievalError(f"{dataset} is not in the fetch plan for {self.stock_ticker}")
+
+    def ticker_exists(self) -> bool:
+        # one request: invalid and delisted tickers come back from .info without a quote type
+        try:
+            return self.info_snapshot.quote_type is not None
+        except Exception as e:
+            print(f"{e}: could not retrieve info for {self.stock_ticker}")
+            return False
 
     def try_stock_ticker(self):
-        if self.balance_sheets.empty or self.quarterly_finances.empty:
+        # cheapest checks first so a bad ticker stops after a single request
+        if self.fetch_plan.info and not self.ticker_exists():
+            return False
+        if self.fetch_plan.balance_sheet and self.balance_sheets.empty:
+            return False
+        if self.fetch_plan.quarterly_financials and self.quarterly_finances.empty:
             return False
         return True
 
     def stock_check_then_retrieve_data(self):
+        # fetch everything in the plan now, e.g. in a worker thread before the data is used
         try:
-            self.retrieve_balance_sheet()
-            self.retrieve_recent_quarterly_financials()
-            self.retrieve_cashflow_data()
+            if self.fetch_plan.info:
+                self.retrieve_stock_info()
+            if self.fetch_plan.balance_sheet and self._df_balance_sheet is None:
+                self.retrieve_balance_sheet()
+            if self.fetch_plan.quarterly_financials and self._df_quarterly is None:
+                self.retrieve_recent_quarterly_financials()
+            if self.fetch_plan.cashflow and self._df_cashflow is None:
+                self.retrieve_cashflow_data()
 
         except DataRetrievalError as e:
             print(f"Error {e}")
 
+    @property
+    def info_snapshot(self) -> StockInfoSnapshot:
+        if self._info_snapshot is None:
+            self.retrieve_stock_info()
+        return self._info_snapshot
+
+    @property
+    def stock_info_key(self):
+        return {
+            'industry': self.info_snapshot.industry,
+            'sector': self.info_snapshot.sector,
+        }
+
+    @property
+    def recent_key_metrics(self):
+        if self._recent_key_metrics is None:
+            self._retrieve_recent_metrics()
+        return self._recent_key_metrics
+
     @property
     def quarterly_finances(self):
         if self._df_quarterly is None:
@@ -120,11 +218,19 @@ class RetrieveStockData:
 
     @property
     def balance_sheets(self):
+        if self._df_balance_sheet is None:
+            self.retrieve_balance_sheet()
         return self._df_balance_sheet
 
     @property
     def most_recent_balance_sheet(self):
-        return self._df_balance_sheet[self._df_balance_sheet.iloc[:, [0]]]
+        return self.balance_sheets[self.balance_sheets.iloc[:, [0]]]
+
+    @property
+    def cashflow(self):
+        if self._df_cashflow is None:
+            self.retrieve_cashflow_data()
+        return self._df_cashflow
 
     @property
     def recent_metrics(self):
@@ -150,114 +256,51 @@ class RetrieveStockData:
         self._df_stock_history = self.stock.history(period="2y")
 
     def _retrieve_recent_metrics(self):
-        trailing_pe = self.stock.info.get('trailingPE')
-        trailing_pe = np.inf if trailing_pe == 'Infinity' else trailing_pe
-        self.recent_key_metrics = {'market_cap_string': self.safe_string_format(self.stock.info.get('marketCap')),  # add commas for each k.
-                                   'market_cap': self.stock.info.get("marketCap"),
-                                   'price_eps_ratio': self.safe_round(trailing_pe, 2),
-                                   'price_to_book': self.safe_round(self.stock.info.get('priceToBook'), 2),
-                                   'return_on_equity': self.safe_round(self.stock.info.get("returnOnEquity"), 2),
-                                   'debt_to_equity_ratio': self.safe_round(self.stock.info.get("debtToEquity"), 2),
-                                   "enterprise_value": self.safe_round(self.stock.info.get("enterpriseValue"), 2),
-                                   "profit_margin": self.safe_round(self.stock.info.get("profitMargins"), 2),
-                                   "enterpriseToEbitda": self.safe_round(self.stock.info.get("enterpriseToEbitda"), 2),
+        info = self.info_snapshot
+        self._recent_key_metrics = {'market_cap_string': self.safe_string_format(info.market_cap),  # add commas for each k.
+                                   'market_cap': info.market_cap,
+                                   'price_eps_ratio': self.safe_round(info.trailing_pe, 2),
+                                   'price_to_book': self.safe_round(info.price_to_book, 2),
+                                   'return_on_equity': self.safe_round(info.return_on_equity, 2),
+                                   'debt_to_equity_ratio': self.safe_round(info.debt_to_equity, 2),
+                                   "enterprise_value": self.safe_round(info.enterprise_value, 2),
+                                   "profit_margin": self.safe_round(info.profit_margins, 2),
+                                   "enterpriseToEbitda": self.safe_round(info.enterprise_to_ebitda, 2),
                                    }
         latest_eps = None
         try:
-            latest_eps = self.stock.info.get("netIncomeToCommon") / self.stock.info.get("sharesOutstanding")
+            latest_eps = info.net_income_to_common / info.shares_outstanding
 
         except Exception as e:
             pass
         finally:
-            self.recent_key_metrics['latest_eps'] = self.safe_round(latest_eps, 2)
+            self._recent_key_metrics['latest_eps'] = self.safe_round(latest_eps, 2)
 
     def retrieve_recent_quarterly_financials(self):
         # might want to process these - but it is columns = dates, rows = key metrics
+        self._require('quarterly_financials')
         self._df_quarterly = self.stock.quarterly_financials
 
     def get_quarterly_financials_app_data(self):
-        q_fin_rows = self.quarterly_finances.index.to_list()
-        try:
-            # check if any missing self.qfin_columns and if so create colum of NaN values (i/e. missing):
-            if 'Basic EPS' not in q_fin_rows:
-                if 'Diluted EPS' in q_fin_rows:
-                    self.quarterly_finances.loc['Basic EPS'] = self.quarterly_finances.loc['Diluted EPS']
-                else:
-                    self.quarterly_finances.loc['Basic EPS'] = float(np.nan)
-
-            if 'EBITDA' not in q_fin_rows:
-                if 'EBIT' in q_fin_rows:
-                    self.quarterly_finances.loc['EBITDA'] = self.quarterly_finances.loc['EBIT']
-                else:
-                    self.quarterly_finances.loc['EBITDA'] = float(np.nan)
-
-            if 'Operating Income' not in q_fin_rows:
-                # EBIT is close to Operating Income generally, but includes Non-Operating Expenses + Income too.
-                if 'EBIT' in q_fin_rows:
-                    self.quarterly_finances.loc['Operating Income'] = self.quarterly_finances.loc['EBIT']
-                else:
-                    self.quarterly_finances.loc['Operating Income'] = float(np.nan)
-
-            if 'Gross Profit' not in q_fin_rows:
-                # If Gross Profit unavailable (because no COGS) then it might be a bank etc.
-                # so we use the Net Interest Income instead (where the Operating Expenses are the COGS)
-                if 'Net Interest Income' in q_fin_rows:
-                    self.quarterly_finances.loc['Gross Profit'] = self.quarterly_finances.loc['Net Interest Income']
-                else:
-                    self.quarterly_finances.loc['Gross Profit'] = float(np.nan)
-
-            df = self.quarterly_finances.loc[self.qfin_columns]
-        except KeyError as e:
-            print(f"{e}: No quarterly financial statements for {self.stock_ticker}")
-            return pd.DataFrame()
-        except ValueError as e:
-            print(f"{e}: No quarterly financial statements for {self.stock_ticker}")
-            return pd.DataFrame()
-        df = df.astype(float)
-        df.fillna(value=0.0, inplace=True)
-        # transform rows to columns and columns to rows:
-        df = df.transpose()
-        df['Gross Margin'] = np.where(df['Total Revenue'] > 0, df['Gross Profit'] / df['Total Revenue'] * 100, 0)
-        df['Operating Margin'] = np.where(df['Total Revenue'] > 0, df['Operating Income'] / df['Total Revenue'] * 100, 0)
-        df['Net Margin'] = np.where(df['Total Revenue'] > 0, df['Net Income'] / df['Total Revenue'] * 100, 0)
-        df['EBITDA Margin'] = np.where(df['Total Revenue'] > 0, df['EBITDA'] / df['Total Revenue'] * 100, 0)
-        df.drop(columns=['Total Revenue', 'Gross Profit', 'EBITDA'], inplace=True)
-        # todo standardise the dates into year-quarter because they are not always the same date here
-        return df
+        return quarterly_financials_app_data(self.quarterly_finances, self.stock_ticker)
 
     def retrieve_balance_sheet(self):
         # annual - can be fairly out of date:
+        self._require('balance_sheet')
         self._df_balance_sheet = self.stock.get_balance_sheet()
 
     def get_balance_sheet_app_data(self):
-        df = self.balance_sheets
-        df = df.astype(float)
-        df.fillna(value=0.0, inplace=True)
-        df = df.transpose()
-
-        # processing and creating new insight columns:
-        if 'CurrentAssets' not in df.columns:
-            # 1. Check if we are dealing with finance institution (repalce QuickRatio with Loan-to-Deposit Ratio)
-            # We just want an industry appropriate measure of liquidity - TODO rename to Liquidity Ratio?
-            df['Blank'] = 0  # used to avoid errors getting data
-            df['CurrentAssets'] = df.get('CashCashEquivalentsAndShortTermInvestments', df.get('CashAndCashEquivalents', df['Blank'])) + \
-                                  df.get('Receivables', df['Blank']) + df.get('TotalLoans', df.get('LoansReceivables', df['Blank']))
-            # using CashAndCashEquivalents/CashCashEquivalentsAndShortTermInvestments,
-            # Receivable and TotalLoans/LoansReceivables,
-        if 'TotalLiabilitiesNetMinorityInterest' not in df.columns:
-            df['TotalLiabilitiesNetMinorityInterest'] = df.get('TotalDeposits', df.get('CustomerDeposits'), df['Blank']) + \
-                                                        df.get('UnearnedPremium', df['Blank']) + \
-                                                        df.get('AccountsPayable', df['Blank'])
-            # UnearendPremium, AccountsPayable, Customer Deposits etc.
-        else:
-            if 'Inventory' in df.columns:
-                df['Quick Ratio'] = (df['CurrentAssets'] - df['Inventory']) / df['TotalLiabilitiesNetMinorityInterest']
-            else:
-                df['Quick Ratio'] = df['CurrentAssets'] / df['TotalLiabilitiesNetMinorityInterest']
-
-        df['Equity Ratio'] = (df['CurrentAssets'] - df['TotalLiabilitiesNetMinorityInterest']) / df['OrdinarySharesNumber']
-        df['Debt-to-Equity Ratio'] = df['TotalLiabilitiesNetMinorityInterest'] / df['StockholdersEquity']
-        return df
+        return balance_sheet_app_data(self.balance_sheets)
+
+    def statement_payload(self) -> StatementPayload:
+        # the raw statements in the fetch plan, for transform_statements in a worker process
+        return StatementPayload(
+            ticker=self.stock_ticker,
+            overview_map=self.stock_overview_map,
+            quarterly_financials=self.quarterly_finances if self.fetch_plan.quarterly_financials else None,
+            balance_sheet=self.balance_sheets if self.fetch_plan.balance_sheet else None,
+            cashflow=self.cashflow if self.fetch_plan.cashflow else None,
+        )
 
     def get_stock_level_data(self):
         stock_history = self.stock.history(period='2y')
@@ -274,10 +317,8 @@ class RetrieveStockData:
         stock_history_normalised['Close'] = stock_history_normalised['Close'] / stock_history_normalised['Close'].iloc[0] * 100
         self.stock_level_data_store['stock_price_normalised_data'] = stock_history_normalised
 
-        try:
-            self.stock_level_data_store['short_ratio'] = self.stock.info['shortRatio']
-        except KeyError as E:
-            self.stock_level_data_store['short_ratio'] = 0
+        short_ratio = self.info_snapshot.short_ratio
+        self.stock_level_data_store['short_ratio'] = short_ratio if short_ratio is not None else 0
         income_statement = self.stock.income_stmt
         income_statement_rows = ['Total Revenue', 'Net Income Continuous Operations', 'Basic EPS']
         income_statement_cols = [c for c in income_statement.columns][:2]
@@ -301,23 +342,21 @@ class RetrieveStockData:
         return self.stock_level_data_store
 
     def retrieve_cashflow_data(self):
+        self._require('cashflow')
         self._df_cashflow = self.stock.cashflow
 
     def get_cashflow_data(self):
-        df = self._df_cashflow.transpose()
-        df.sort_index(inplace=True)
-        df['ticker'] = self.stock_ticker
-        # check that all of self.cashflow_columns are in the dataset, and if not set to NaN (i.e missing)
-        for col in [c for c in self.cashflow_columns if c not in df.columns]:
-            df[col] = float('nan')  # Add missing column with NaN values
-        return df[self.cashflow_columns]
+        return cashflow_app_data(self.cashflow)
+
+    @property
+    def stock_info(self):
+        return self.info_snapshot
 
     def retrieve_stock_info(self):
-        self.stock_info = self.stock.info
-        self.stock_info_key = {
-            'industry': self.stock_info.get('industry'),
-            'sector': self.stock_info.get('sector'),
-        }
+        # the only read of Ticker.info, every derived metric uses the snapshot:
+        if self._info_snapshot is None:
+            self._require('info')
+            self._info_snapshot = StockInfoSnapshot.from_info(self.stock_ticker, self.stock.info)
 
     def _stock_overview_map(self):
         stock_overview_map = {
@@ -333,6 +372,75 @@ class RetrieveStockData:
         return stock_key_metrics_info
 
 
+def retrieve_price_history(tickers: List[str], period: str = '2y', chunk_size: int = PRICE_HISTORY_CHUNK_SIZE,
+                           rate_limiter=None, start: Optional[str] = None,
+                           provider: Optional[MarketDataProvider] = None, actions: bool = False) -> pd.DataFrame:
+    """Download the daily close prices for many tickers with one yf.download call per chunk of tickers.
+    Returns long format rows (ticker, date, close_price, close_price_indexed) ready for ticker_time_series.
+    If start ('YYYY-MM-DD', inclusive) is given only the prices from that date are downloaded instead of the period.
+    With actions the rows also have a stock_split column, the split ratio of a split on that date and 0 otherwise."""
+    columns = ['ticker', 'date', 'close_price', 'close_price_indexed'] + (['stock_split'] if actions else [])
+    window = {'start': start} if start else {'period': period}
+    provider = provider or get_default_provider()
+    chunks = []
+    for i in range(0, len(tickers), chunk_size):
+        chunk = tickers[i:i + chunk_size]
+        try:
+            df_chunk = _download_close_prices(provider, chunk, rate_limiter, actions, **window)
+            retrieved = set(df_chunk['ticker'])
+            missing = [t for t in chunk if t not in retrieved]
+            if missing and not start and period != '1y':
+                # Just get the last year if we cant get 2yr for some reason
+                df_chunk = pd.concat([df_chunk, _download_close_prices(provider, missing, rate_limiter, actions,
+                                                                       period='1y')])
+        except CacheMissError as e:
+            print(e)
+            continue
+        chunks.append(df_chunk)
+    if not chunks:
+        return pd.DataFrame(columns=columns)
+
+    df = pd.concat(chunks, ignore_index=True)
+    df.sort_values(by=['ticker', 'date'], inplace=True)
+    df['close_price_indexed'] = df['close_price'] / df.groupby('ticker')['close_price'].transform('first') * 100
+    df['date'] = df['date'].dt.date
+    return df[columns].reset_index(drop=True)
+
+
+def _stack_price_column(df: pd.DataFrame, column: str, tickers: List[str], value_name: str) -> pd.DataFrame:
+    # one column of a yf.download frame, wide (date x ticker) to long, dropping the dates a ticker has no value for
+    values = df[column]
+    if isinstance(values, pd.Series):
+        # older yfinance versions return flat columns for a single ticker
+        values = values.to_frame(name=tickers[0])
+    df_long = values.stack().reset_index()
+    df_long.columns = ['date', 'ticker', value_name]
+    df_long['date'] = pd.to_datetime(df_long['date'])
+    if df_long['date'].dt.tz is not None:
+        df_long['date'] = df_long['date'].dt.tz_localize(None)
+    return df_long
+
+
+def _download_close_prices(provider: MarketDataProvider, tickers: List[str], rate_limiter=None, actions: bool = False,
+                           **window) -> pd.DataFrame:
+    if actions:
+        window['actions'] = True  # only passed when set, so the cached downloads without it keep their keys
+    df = provider.download(tickers, rate_limiter=rate_limiter, interval='1d', auto_adjust=True, group_by='column',
+                           progress=False, **window)
+    if df.empty:
+        return pd.DataFrame({'ticker': pd.Series(dtype=str), 'date': pd.Series(dtype='datetime64[ns]'),
+                             'close_price': pd.Series(dtype=float), 'stock_split': pd.Series(dtype=float)})
+    df_long = _stack_price_column(df, 'Close', tickers, 'close_price')
+    df_long['stock_split'] = 0.0
+    if actions and 'Stock Splits' in df.columns.get_level_values(0):
+        df_splits = _stack_price_column(df, 'Stock Splits', tickers, 'split')
+        df_splits = df_splits[df_splits['split'] > 0]
+        if not df_splits.empty:
+            df_long = df_long.merge(df_splits, on=['date', 'ticker'], how='left')
+            df_long['stock_split'] = df_long.pop('split').fillna(0.0)
+    return df_long
+
+
 def write_security_stock_ticker_data() -> None:
     url = 'https://en.wikipedia.org/wiki/List_of_S%26P_500_companies'
     tables = pd.read_html(url)
@@ -0,0 +1,139 @@
+"""Standalone ingestion scheduler: refreshes the stored data on its own process, independent of the Dash app.
+Run from the repo root, e.g. python -m src.peer_comparison_tool.data.scheduler --sector "Health Care" --once"""
+
+import click
+import os
+import time
+import pandas as pd
+from typing import Dict, List, Optional
+
+from .main import run_ingestion_job, create_aggregations_data
+from .retriever import RetrieveEconomicsData
+from .providers import SyntheticProvider, set_default_provider
+from .db_utils import partition_by_recency, update_other_asset_classes
+from .queries import query_ticker_refresh_priority
+from .migrations import migrate
+from .columnar import export_columnar_store
+from .snapshot import publish_snapshot
+from .retention import RetentionPolicy, apply_retention
+from .upsert import ChangeLog
+from .aggregation_engine import AGGREGATION_ENGINES
+from .constants import TICKERS, SCHEDULER_INTERVAL_SECONDS, AGGREGATION_ENGINE
+
+SP500_TICKERS_PATH = os.path.expanduser('~/Documents/Code/peer-comparison-tool/data/sp500_security_ticker.csv')
+
+
+def load_universe(sectors: Optional[List[str]] = None) -> Dict[str, str]:
+    # ticker -> GICS sub-industry from the S&P 500 list, optionally only some GICS sectors
+    if not os.path.exists(SP500_TICKERS_PATH):
+        return {ticker: "Misc." for ticker in TICKERS}
+    df_ticker_id = pd.read_csv(SP500_TICKERS_PATH)
+    if sectors:
+        df_ticker_id = df_ticker_id[df_ticker_id['GICS Sector'].isin(sectors)]
+    return dict(zip(df_ticker_id['Symbol'], df_ticker_id['GICS Sub-Industry']))
+
+
+def prioritise_tickers(conn, tickers: List[str]) -> List[str]:
+    """Order tickers for refreshing: never ingested first, then the stalest, and among equally stale tickers the ones
+    that reported most recently (their next filing is the most likely to have landed) first."""
+    df_priority = pd.read_sql_query(query_ticker_refresh_priority, conn)
+    df_priority = pd.DataFrame({'ticker': tickers}).merge(df_priority, on='ticker', how='left')
+    df_priority['never_ingested'] = df_priority['last_version'].isna()
+    df_priority['last_report'] = df_priority['last_report'].fillna(-1)  # epoch days, never reported last
+    df_priority.sort_values(['never_ingested', 'last_version', 'last_report'], ascending=[False, True, False],
+                            inplace=True, kind='stable')
+    return df_priority['ticker'].to_list()
+
+
+def refresh_universe(conn, tickers_subgics_map: Dict[str, str], resume: bool = False,
+                     max_tickers: Optional[int] = None, columnar_dir: Optional[str] = None,
+                     snapshot_dir: Optional[str] = None, aggregation_engine: str = AGGREGATION_ENGINE,
+                     retention: Optional[RetentionPolicy] = None, **ingestion_kwargs):
+    """One refresh cycle: ingest the stale tickers in priority order (at most max_tickers of them), rerun the
+    aggregations, update the other asset classes, apply the retention policy (if any, None keeps every daily price) and
+    export the changes to the columnar store (if columnar_dir).
+    With a snapshot_dir the finished refresh is then published for the app, which never reads conn's database."""
+    asset_retriever = RetrieveEconomicsData()
+    # one staleness query for the stocks and the other asset classes together:
+    stale_tickers, _ = partition_by_recency(
+        conn, {ticker: 'equity' for ticker in tickers_subgics_map} | asset_retriever.asset_classes)
+    stale_stocks = prioritise_tickers(conn, [ticker for ticker in stale_tickers if ticker in tickers_subgics_map])
+    if max_tickers is not None:
+        stale_stocks = stale_stocks[:max_tickers]
+
+    # fetch new data,transform and write to tables then update aggregations such as industry time series etc:
+    if stale_stocks:
+        # a resumed job wrote some of its rows in an earlier run, which only a full aggregation picks up:
+        change_log = None if resume else ChangeLog()
+        run_ingestion_job({ticker: tickers_subgics_map[ticker] for ticker in stale_stocks}, conn, resume=resume,
+                          change_log=change_log, **ingestion_kwargs)
+        # rerun aggregations, clustering, other ML models etc. for what changed to store updated summaries and features:
+        create_aggregations_data(conn, tickers_subgics_map, change_log, engine=aggregation_engine)
+
+    for asset in list(asset_retriever.non_stock_entities.keys()):
+        if asset not in stale_tickers:
+            del asset_retriever.non_stock_entities[asset]  # remove from the map
+    update_other_asset_classes(asset_retriever, conn)
+    if retention is not None:
+        apply_retention(conn, retention)
+    if columnar_dir:
+        export_columnar_store(conn, columnar_dir)
+    if snapshot_dir:
+        publish_snapshot(conn, snapshot_dir)
+    print(f"Refreshed {len(stale_stocks)} stale tickers, {len(tickers_subgics_map) - len(stale_stocks)} left as is")
+
+
+def run_scheduler(db_path: str, tickers_subgics_map: Dict[str, str], interval_seconds: float = SCHEDULER_INTERVAL_SECONDS,
+                  once: bool = False, resume: bool = False, max_tickers: Optional[int] = None,
+                  columnar_dir: Optional[str] = None, snapshot_dir: Optional[str] = None,
+                  aggregation_engine: str = AGGREGATION_ENGINE,
+                  retention: Optional[RetentionPolicy] = None):
+    from .db import initialize_db_connection, close_db
+
+    while True:
+        # a fresh connection per cycle so nothing is held open while sleeping:
+        sql_conn = initialize_db_connection(db_path)
+        try:
+            migrate(sql_conn)
+            refresh_universe(sql_conn, tickers_subgics_map, resume=resume, max_tickers=max_tickers,
+                             columnar_dir=columnar_dir, snapshot_dir=snapshot_dir,
+                             aggregation_engine=aggregation_engine, retention=retention)
+        finally:
+            close_db(sql_conn, db_path)
+        if once:
+            return
+        resume = False  # tickers left over from an interrupted cycle are still stale, so the next cycle picks them up
+        print(f"Next refresh in {interval_seconds}s")
+        time.sleep(interval_seconds)
+
+
+@click.command()
+@click.option('--tickers', default=None, help='Comma separated tickers to refresh instead of the S&P 500 list')
+@click.option('--sector', 'sectors', multiple=True, help='Only refresh this GICS sector of the S&P 500 list (repeatable)')
+@click.option('--synthetic', default=None, type=int, help='Refresh a generated universe of this many tickers offline')
+@click.option('--interval', default=SCHEDULER_INTERVAL_SECONDS, type=float, help='Seconds between refresh cycles')
+@click.option('--once', is_flag=True, default=False, help='Run a single refresh cycle and exit')
+@click.option('--max-tickers', default=None, type=int, help='Refresh at most this many stale tickers per cycle')
+@click.option('--resume', is_flag=True, default=False, help='Continue the last unfinished ingestion job first')
+@click.option('--engine', default=AGGREGATION_ENGINE, type=click.Choice(AGGREGATION_ENGINES),
+              help='Engine of the first, full build of the price and industry aggregations')
+@click.option('--retention', is_flag=True, default=False,
+              help='Roll the old daily prices up into weekly and monthly bars, by default every daily price is kept')
+def execute(tickers, sectors, synthetic, interval, once, max_tickers, resume, engine, retention):
+    from ..comparison_tool.constants import DB_PATH, COLUMNAR_DIR, SNAPSHOT_DIR
+
+    if synthetic:
+        provider = SyntheticProvider()
+        set_default_provider(provider)
+        tickers_subgics_map = provider.universe(synthetic)
+    elif tickers:
+        tickers_subgics_map = {ticker.strip(): "Misc." for ticker in tickers.split(",") if ticker.strip()}
+    else:
+        tickers_subgics_map = load_universe(list(sectors))
+    run_scheduler(DB_PATH, tickers_subgics_map, interval_seconds=interval, once=once, resume=resume,
+                  max_tickers=max_tickers, columnar_dir=COLUMNAR_DIR, snapshot_dir=SNAPSHOT_DIR,
+                  aggregation_engine=engine, retention=RetentionPolicy() if retention else None)
+
+
+if __name__ == '__main__':
+    execute()
@@ -0,0 +1,118 @@
+"""Snapshot publication: the ingestion and aggregations write to the working database, and once a refresh has finished
+a copy of it is published as a new snapshot file and the CURRENT pointer file is swapped to name it. The app's readers
+follow the pointer and open the snapshot immutable, so they never see a half finished refresh and take no locks.
+A published snapshot is never written to again. Publish the working database now from the repo root:
+python -m src.peer_comparison_tool.data.snapshot [--status]"""
+
+import click
+import os
+import sqlite3
+from datetime import datetime
+from typing import List, Optional
+
+from .constants import SNAPSHOTS_KEPT
+
+SNAPSHOT_POINTER = 'CURRENT'
+SNAPSHOT_PREFIX = 'snapshot-'
+SNAPSHOT_SUFFIX = '.db'
+
+
+def _fsync(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def current_snapshot(snapshot_dir: str) -> Optional[str]:
+    # the path of the published snapshot, None before the first publish
+    try:
+        with open(os.path.join(snapshot_dir, SNAPSHOT_POINTER)) as f:
+            file_name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return os.path.join(snapshot_dir, file_name) if file_name else None
+
+
+def list_snapshots(snapshot_dir: str) -> List[str]:
+    # oldest first, the names sort by publication time
+    if not os.path.isdir(snapshot_dir):
+        return []
+    return sorted(file_name for file_name in os.listdir(snapshot_dir)
+                  if file_name.startswith(SNAPSHOT_PREFIX) and file_name.endswith(SNAPSHOT_SUFFIX))
+
+
+def write_snapshot(conn, path: str):
+    """Copy the committed state of the working database to path: the backup API copies the pages as they are,
+    indexes and the columnar_change counts the columnar store is checked against included. The copy is switched out
+    of WAL so it is one self-contained file that immutable readers can map."""
+    tmp_path = f"{path}.tmp"
+    snapshot_conn = sqlite3.connect(tmp_path)
+    try:
+        conn.backup(snapshot_conn)
+        snapshot_conn.execute("PRAGMA journal_mode = DELETE")
+        snapshot_conn.execute("PRAGMA optimize")
+    finally:
+        snapshot_conn.close()
+    _fsync(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def swap_pointer(snapshot_dir: str, file_name: str):
+    # rename over the old pointer: readers see the old snapshot or the new one, never a partly written name
+    pointer_path = os.path.join(snapshot_dir, SNAPSHOT_POINTER)
+    tmp_path = f"{pointer_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(file_name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, pointer_path)
+
+
+def prune_snapshots(snapshot_dir: str, keep: int = SNAPSHOTS_KEPT):
+    # the previous snapshots are kept for a while as app readers may still have them open
+    current = current_snapshot(snapshot_dir)
+    for file_name in list_snapshots(snapshot_dir)[:-keep]:
+        path = os.path.join(snapshot_dir, file_name)
+        if path == current:
+            continue
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"{e}: could not remove old snapshot {file_name}, it is removed after the next publish")
+
+
+def publish_snapshot(conn, snapshot_dir: str, keep: int = SNAPSHOTS_KEPT) -> str:
+    # publish the working database's last commit (conn must not be in a transaction) and return the snapshot path
+    if conn.in_transaction:
+        raise ValueError("Commit the refresh before publishing a snapshot of it")
+    os.makedirs(snapshot_dir, exist_ok=True)
+    file_name = f"{SNAPSHOT_PREFIX}{datetime.now().strftime('%Y%m%dT%H%M%S%f')}{SNAPSHOT_SUFFIX}"
+    path = os.path.join(snapshot_dir, file_name)
+    write_snapshot(conn, path)
+    swap_pointer(snapshot_dir, file_name)
+    prune_snapshots(snapshot_dir, keep)
+    print(f"Published snapshot {file_name}")
+    return path
+
+
+@click.command()
+@click.option('--status', is_flag=True, default=False, help='Only print the current snapshot')
+def execute(status):
+    from .db import initialize_db_connection, close_db
+    from ..comparison_tool.constants import DB_PATH, SNAPSHOT_DIR
+
+    if SNAPSHOT_DIR is None:
+        print("Snapshots are disabled (PEER_TOOL_SNAPSHOT_DIR is empty)")
+        return
+    if status:
+        print(f"Current snapshot: {current_snapshot(SNAPSHOT_DIR)}, {len(list_snapshots(SNAPSHOT_DIR))} kept")
+        return
+    sql_conn = initialize_db_connection(DB_PATH)
+    publish_snapshot(sql_conn, SNAPSHOT_DIR)
+    close_db(sql_conn, DB_PATH)
+
+
+if __name__ == '__main__':
+    execute()
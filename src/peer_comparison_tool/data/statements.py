@@ -0,0 +1,84 @@
+"""The raw financial statements, every line item the provider returns, in a narrow store: statement_value has one
+(line_item_id, ticker, date, value) row per reported value and statement_line_item is the dictionary of line item
+names per statement, so each name is stored once instead of on every value. The wide tables (quarterly_financial_data
+etc.) keep only the columns the app renders, any other metric can be derived from here without fetching again.
+Print a stored statement from the repo root:
+python -m src.peer_comparison_tool.data.statements --ticker AAPL --statement cashflow"""
+
+import click
+import pandas as pd
+from typing import List, Optional
+
+from .bulk_load import bulk_load
+from .dates import decode_date_columns
+from .queries import query_insert_line_items, query_line_items, query_statement_values
+
+# The statements of the fetch plan, as named in statement_line_item:
+STATEMENTS = ['quarterly_financials', 'balance_sheet', 'cashflow']
+STATEMENT_VALUE_KEY = ['line_item_id', 'ticker', 'date']
+
+
+def line_item_ids(cursor, df_items: pd.DataFrame) -> pd.DataFrame:
+    # the dictionary ids of the (statement, line_item) pairs, adding the ones not seen before
+    cursor.executemany(query_insert_line_items, df_items[['statement', 'line_item']].drop_duplicates().itertuples(
+        index=False, name=None))
+    # the dictionary holds a few hundred names, so all of it is read:
+    return pd.read_sql_query(query_line_items, cursor.connection)
+
+
+def write_raw_statements(cursor, df_raw: pd.DataFrame) -> int:
+    """Write the narrow statement rows (transform.RAW_STATEMENT_COLS) and return how many values were new or changed.
+    Restated values replace the stored ones, unchanged values are not rewritten. Like upsert() the write is left in
+    the caller's transaction."""
+    if df_raw.empty:
+        return 0
+    df = pd.merge(df_raw, line_item_ids(cursor, df_raw), on=['statement', 'line_item'])
+    df = df[STATEMENT_VALUE_KEY + ['value']].drop_duplicates(subset=STATEMENT_VALUE_KEY, keep='last')
+
+    cursor.execute('DROP TABLE IF EXISTS temp."staging_statement_value"')
+    cursor.execute('CREATE TEMP TABLE "staging_statement_value" AS SELECT * FROM statement_value WHERE 0')
+    bulk_load(cursor, 'temp."staging_statement_value"', df)
+    cursor.execute("""
+        INSERT INTO statement_value (line_item_id, ticker, date, value)
+        SELECT line_item_id, ticker, date, value FROM temp."staging_statement_value" WHERE true
+        ON CONFLICT (line_item_id, ticker, date) DO UPDATE SET value = excluded.value
+        WHERE statement_value.value IS NOT excluded.value
+    """)
+    written = cursor.rowcount
+    cursor.execute('DROP TABLE temp."staging_statement_value"')
+    return written
+
+
+def fetch_statement_values(sql_conn, statement: str, line_items: Optional[List[str]] = None,
+                           tickers: Optional[List[str]] = None) -> pd.DataFrame:
+    """A stored statement made wide again: a row per ticker and period date and a column per line item (default
+    every line item of the statement). Line items a ticker does not report are NaN."""
+    if statement not in STATEMENTS:
+        raise ValueError(f"Unknown statement {statement}, one of {STATEMENTS}")
+    filters, params = "", [statement]
+    if line_items is not None:
+        filters += f" AND i.name IN ({', '.join(['?'] * len(line_items))})"
+        params += list(line_items)
+    if tickers is not None:
+        filters += f" AND v.ticker IN ({', '.join(['?'] * len(tickers))})"
+        params += list(tickers)
+    df = pd.read_sql_query(query_statement_values.format(filters=filters), sql_conn, params=params)
+    df = decode_date_columns(df).pivot(index=['ticker', 'date'], columns='name', values='value')
+    return df.rename_axis(columns=None).reset_index()
+
+
+@click.command()
+@click.option('--ticker', required=True, help='Ticker of the stored statement')
+@click.option('--statement', default='cashflow', type=click.Choice(STATEMENTS), help='Statement to print')
+def execute(ticker, statement):
+    from .db import initialize_db_connection, close_db
+    from ..comparison_tool.constants import DB_PATH
+
+    sql_conn = initialize_db_connection(DB_PATH)
+    df = fetch_statement_values(sql_conn, statement, tickers=[ticker])
+    print(df.drop(columns=['ticker']).set_index('date').transpose().to_string())
+    close_db(sql_conn, DB_PATH)
+
+
+if __name__ == '__main__':
+    execute()
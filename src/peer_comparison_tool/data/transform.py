@@ -0,0 +1,218 @@
+"""Pure statement transforms: raw yfinance statements in, table-ready frames out.
+Nothing here touches the network or the database, so the functions can run in a process pool."""
+
+import numpy as np
+import pandas as pd
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Dict, NamedTuple, Optional
+
+QFINANCIAL_ROWS = ['Basic EPS', 'Operating Income', 'Total Revenue', 'Gross Profit', 'Net Income', 'EBITDA']
+QFINANCIAL_TABLE_COLS = ['ticker', 'date', 'quarter_reporting', 'Basic EPS', 'Operating Income',
+                         'Operating Income (MM)', 'Net Income', 'Net Income (MM)', 'Gross Margin',
+                         'Operating Margin', 'Net Margin', 'EBITDA Margin']
+RECENT_METRICS_TABLE_COLS = ['ticker', 'market_cap', 'price_eps_ratio', 'price_to_book', 'return_on_equity',
+                             'debt_to_equity_ratio', 'profit_margin', 'enterpriseToEbitda', 'latest_eps',
+                             'enterprise_value']
+COMPANY_INFO_TABLE_COLS = ['ticker', 'name', 'sector', 'industry', 'sub_industry']
+BALANCE_SHEET_TABLE_COLS = ['ticker', 'date', 'annual_reporting', 'OrdinarySharesNumber', 'StockholdersEquity',
+                            'TotalLiabilitiesNetMinorityInterest', 'CurrentAssets', 'Quick Ratio',
+                            'Equity Ratio', 'Debt-to-Equity Ratio']
+CASHFLOW_ROWS = ['Free Cash Flow', 'Operating Cash Flow', 'Capital Expenditure']
+CASHFLOW_TABLE_COLS = ['ticker', 'date'] + CASHFLOW_ROWS
+RAW_STATEMENT_COLS = ['ticker', 'date', 'statement', 'line_item', 'value']
+
+
+class StatementPayload(NamedTuple):
+    # The raw statements of one ticker, picklable so it can be sent to a worker process
+    ticker: str
+    overview_map: Dict[str, str]  # ticker, industry, sector columns added to every row
+    quarterly_financials: Optional[pd.DataFrame]
+    balance_sheet: Optional[pd.DataFrame]
+    cashflow: Optional[pd.DataFrame] = None
+
+
+class TransformedStatements(NamedTuple):
+    ticker: str
+    quarterly_financials: pd.DataFrame
+    balance_sheet: pd.DataFrame
+    cashflow: pd.DataFrame
+    raw_statements: pd.DataFrame  # every line item of the statements, RAW_STATEMENT_COLS rows for statements.py
+
+
+def quarterly_financials_app_data(df_quarterly: pd.DataFrame, ticker: str = None) -> pd.DataFrame:
+    df_quarterly = df_quarterly.copy()
+    q_fin_rows = df_quarterly.index.to_list()
+    try:
+        # check if any missing QFINANCIAL_ROWS and if so create row of NaN values (i/e. missing):
+        if 'Basic EPS' not in q_fin_rows:
+            if 'Diluted EPS' in q_fin_rows:
+                df_quarterly.loc['Basic EPS'] = df_quarterly.loc['Diluted EPS']
+            else:
+                df_quarterly.loc['Basic EPS'] = float(np.nan)
+
+        if 'EBITDA' not in q_fin_rows:
+            if 'EBIT' in q_fin_rows:
+                df_quarterly.loc['EBITDA'] = df_quarterly.loc['EBIT']
+            else:
+                df_quarterly.loc['EBITDA'] = float(np.nan)
+
+        if 'Operating Income' not in q_fin_rows:
+            # EBIT is close to Operating Income generally, but includes Non-Operating Expenses + Income too.
+            if 'EBIT' in q_fin_rows:
+                df_quarterly.loc['Operating Income'] = df_quarterly.loc['EBIT']
+            else:
+                df_quarterly.loc['Operating Income'] = float(np.nan)
+
+        if 'Gross Profit' not in q_fin_rows:
+            # If Gross Profit unavailable (because no COGS) then it might be a bank etc.
+            # so we use the Net Interest Income instead (where the Operating Expenses are the COGS)
+            if 'Net Interest Income' in q_fin_rows:
+                df_quarterly.loc['Gross Profit'] = df_quarterly.loc['Net Interest Income']
+            else:
+                df_quarterly.loc['Gross Profit'] = float(np.nan)
+
+        df = df_quarterly.loc[QFINANCIAL_ROWS]
+    except KeyError as e:
+        print(f"{e}: No quarterly financial statements for {ticker}")
+        return pd.DataFrame()
+    except ValueError as e:
+        print(f"{e}: No quarterly financial statements for {ticker}")
+        return pd.DataFrame()
+    df = df.astype(float)
+    df.fillna(value=0.0, inplace=True)
+    # transform rows to columns and columns to rows:
+    df = df.transpose()
+    df['Gross Margin'] = np.where(df['Total Revenue'] > 0, df['Gross Profit'] / df['Total Revenue'] * 100, 0)
+    df['Operating Margin'] = np.where(df['Total Revenue'] > 0, df['Operating Income'] / df['Total Revenue'] * 100, 0)
+    df['Net Margin'] = np.where(df['Total Revenue'] > 0, df['Net Income'] / df['Total Revenue'] * 100, 0)
+    df['EBITDA Margin'] = np.where(df['Total Revenue'] > 0, df['EBITDA'] / df['Total Revenue'] * 100, 0)
+    df.drop(columns=['Total Revenue', 'Gross Profit', 'EBITDA'], inplace=True)
+    # todo standardise the dates into year-quarter because they are not always the same date here
+    return df
+
+
+def balance_sheet_app_data(df_balance_sheet: pd.DataFrame) -> pd.DataFrame:
+    df = df_balance_sheet.astype(float)
+    df.fillna(value=0.0, inplace=True)
+    df = df.transpose()
+
+    # processing and creating new insight columns:
+    if 'CurrentAssets' not in df.columns:
+        # 1. Check if we are dealing with finance institution (repalce QuickRatio with Loan-to-Deposit Ratio)
+        # We just want an industry appropriate measure of liquidity - TODO rename to Liquidity Ratio?
+        df['Blank'] = 0  # used to avoid errors getting data
+        df['CurrentAssets'] = df.get('CashCashEquivalentsAndShortTermInvestments', df.get('CashAndCashEquivalents', df['Blank'])) + \
+                              df.get('Receivables', df['Blank']) + df.get('TotalLoans', df.get('LoansReceivables', df['Blank']))
+        # using CashAndCashEquivalents/CashCashEquivalentsAndShortTermInvestments,
+        # Receivable and TotalLoans/LoansReceivables,
+    if 'TotalLiabilitiesNetMinorityInterest' not in df.columns:
+        df['TotalLiabilitiesNetMinorityInterest'] = df.get('TotalDeposits', df.get('CustomerDeposits'), df['Blank']) + \
+                                                    df.get('UnearnedPremium', df['Blank']) + \
+                                                    df.get('AccountsPayable', df['Blank'])
+        # UnearendPremium, AccountsPayable, Customer Deposits etc.
+    else:
+        if 'Inventory' in df.columns:
+            df['Quick Ratio'] = (df['CurrentAssets'] - df['Inventory']) / df['TotalLiabilitiesNetMinorityInterest']
+        else:
+            df['Quick Ratio'] = df['CurrentAssets'] / df['TotalLiabilitiesNetMinorityInterest']
+
+    df['Equity Ratio'] = (df['CurrentAssets'] - df['TotalLiabilitiesNetMinorityInterest']) / df['OrdinarySharesNumber']
+    df['Debt-to-Equity Ratio'] = df['TotalLiabilitiesNetMinorityInterest'] / df['StockholdersEquity']
+    return df
+
+
+def cashflow_app_data(df_cashflow: pd.DataFrame) -> pd.DataFrame:
+    df = df_cashflow.transpose()
+    df.sort_index(inplace=True)
+    # check that all of CASHFLOW_ROWS are in the dataset, and if not set to NaN (i.e missing)
+    for col in [c for c in CASHFLOW_ROWS if c not in df.columns]:
+        df[col] = float('nan')  # Add missing column with NaN values
+    # years the provider has no cash flows for come back as all NaN columns:
+    return df[CASHFLOW_ROWS].astype(float).dropna(how='all')
+
+
+def narrow_statement(df_statement: pd.DataFrame, ticker: str, statement: str) -> pd.DataFrame:
+    # a raw statement (line items x period dates, as the provider returns it) as one row per reported value
+    df = df_statement[~df_statement.index.duplicated()].apply(pd.to_numeric, errors='coerce')
+    df = df.rename_axis(index='line_item').reset_index().melt(id_vars='line_item', var_name='date', value_name='value')
+    df = df.dropna(subset=['value'])
+    df['ticker'] = ticker
+    df['statement'] = statement
+    return df[RAW_STATEMENT_COLS]
+
+
+def prepare_quarterly_financials(df_qfinancials: pd.DataFrame) -> pd.DataFrame:
+    df_qfinancials = df_qfinancials.reset_index().rename(columns={'index': 'date'})
+    df_qfinancials['date_moved'] = df_qfinancials['date'] - pd.DateOffset(months=1)
+    df_qfinancials['quarter_reporting'] = df_qfinancials['date_moved'].dt.year.astype(str) + "_" + df_qfinancials['date_moved'].dt.quarter.astype(str)
+    # todo quarterly mapping - tough because different end of months for reporting
+    df_qfinancials['Operating Income (MM)'] = df_qfinancials['Operating Income'] / 1_000_000  # in millions
+    df_qfinancials['Net Income (MM)'] = df_qfinancials['Net Income'] / 1_000_000  # in millions
+    return df_qfinancials[QFINANCIAL_TABLE_COLS]
+
+
+def prepare_balance_sheets(df_balancesheets: pd.DataFrame) -> pd.DataFrame:
+    df_balancesheets = df_balancesheets.reset_index().rename(columns={'index': 'date'})
+    df_balancesheets['date_moved'] = df_balancesheets['date'] + pd.DateOffset(months=3)
+    df_balancesheets['annual_reporting'] = df_balancesheets['date_moved'].dt.year.astype(str)
+    return df_balancesheets[BALANCE_SHEET_TABLE_COLS]
+
+
+def prepare_cashflows(df_cashflows: pd.DataFrame) -> pd.DataFrame:
+    df_cashflows = df_cashflows.reset_index().rename(columns={'index': 'date'})
+    return df_cashflows[CASHFLOW_TABLE_COLS]
+
+
+def add_ticker_metadata(df: pd.DataFrame, ticker_metadata):
+    for key, val in ticker_metadata.items():
+        df[key] = val
+
+
+def transform_statements(payload: StatementPayload) -> TransformedStatements:
+    # the whole per-ticker statement stage: fallback rows, ratios, metadata and the table columns, plus every raw
+    # line item in the narrow format
+    df_qfinancials, df_balancesheets, df_cashflows = pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+    raw_statements = {'quarterly_financials': payload.quarterly_financials, 'balance_sheet': payload.balance_sheet,
+                      'cashflow': payload.cashflow}
+    raw_frames = [narrow_statement(df, payload.ticker, statement) for statement, df in raw_statements.items()
+                  if df is not None and not df.empty]
+    if payload.quarterly_financials is not None:
+        df_qfinancials = quarterly_financials_app_data(payload.quarterly_financials, payload.ticker)
+        if not df_qfinancials.empty:
+            add_ticker_metadata(df_qfinancials, payload.overview_map)
+            df_qfinancials = prepare_quarterly_financials(df_qfinancials)
+
+    if payload.balance_sheet is not None:
+        df_balancesheets = balance_sheet_app_data(payload.balance_sheet)
+        if not df_balancesheets.empty:
+            add_ticker_metadata(df_balancesheets, payload.overview_map)
+            df_balancesheets = prepare_balance_sheets(df_balancesheets)
+
+    if payload.cashflow is not None and not payload.cashflow.empty:
+        df_cashflows = cashflow_app_data(payload.cashflow)
+        if not df_cashflows.empty:
+            add_ticker_metadata(df_cashflows, payload.overview_map)
+            df_cashflows = prepare_cashflows(df_cashflows)
+    df_raw = pd.concat(raw_frames, ignore_index=True) if raw_frames else pd.DataFrame(columns=RAW_STATEMENT_COLS)
+    return TransformedStatements(payload.ticker, df_qfinancials, df_balancesheets, df_cashflows, df_raw)
+
+
+def create_transform_executor(max_workers: Optional[int] = None) -> Optional[ProcessPoolExecutor]:
+    # None uses every core, 1 (or fewer) transforms inline in the calling process
+    if max_workers is not None and max_workers <= 1:
+        return None
+    # the workers are started lazily while the fetch threads run, and a forked worker can inherit a lock one of them
+    # holds, so they are spawned instead
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=get_context('spawn'))
+
+
+def submit_transform(executor: Optional[ProcessPoolExecutor], payload: StatementPayload) -> Future:
+    if executor is not None:
+        return executor.submit(transform_statements, payload)
+    future = Future()
+    try:
+        future.set_result(transform_statements(payload))
+    except Exception as e:
+        future.set_exception(e)
+    return future
@@ -0,0 +1,107 @@
+"""Upserts with change detection: every row stores a hash of its values (row_hash, from migrations 4 and 5), so refreshed
+data only writes the rows that are new or whose values changed - restated financials replace the stored ones and
+unchanged rows are not rewritten. Each upsert reports the changed keys so the aggregations can be limited to them."""
+
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
+
+from .bulk_load import bulk_load, primary_key_columns, quoted_columns
+from .dates import encode_date_columns
+
+ROW_HASH_COLUMN = 'row_hash'
+# The tables written with upsert(), all keyed by ticker:
+HASHED_TABLES = ['company_info', 'ticker_most_recent_metric_data', 'quarterly_financial_data', 'balance_sheet_data',
+                 'cashflow_statement_data']
+
+
+class UpsertDelta(NamedTuple):
+    table: str
+    inserted: pd.DataFrame  # the key columns of the new rows
+    updated: pd.DataFrame  # the key columns of the rows whose values changed
+    unchanged: int
+
+    def changed_tickers(self, include_inserted: bool = True) -> Set[str]:
+        frames = [self.updated, self.inserted] if include_inserted else [self.updated]
+        return {ticker for df in frames for ticker in df['ticker']}
+
+    def summary(self) -> str:
+        return f"{self.table}: {len(self.inserted)} inserted, {len(self.updated)} updated, {self.unchanged} unchanged"
+
+
+class ChangeLog:
+    # The deltas of the upserts in a refresh, for the aggregations that follow it
+    def __init__(self):
+        self.deltas: Dict[str, List[UpsertDelta]] = {}
+
+    def add(self, delta: UpsertDelta):
+        self.deltas.setdefault(delta.table, []).append(delta)
+
+    def changed_tickers(self, tables: Iterable[str], include_inserted: bool = True) -> Set[str]:
+        return {ticker for table in tables for delta in self.deltas.get(table, [])
+                for ticker in delta.changed_tickers(include_inserted)}
+
+    def summary(self) -> str:
+        # one line per table, the deltas of all its upserts added up
+        return "\n".join(f"{table}: {sum(len(d.inserted) for d in deltas)} inserted, "
+                         f"{sum(len(d.updated) for d in deltas)} updated, {sum(d.unchanged for d in deltas)} unchanged"
+                         for table, deltas in self.deltas.items())
+
+
+def normalize_values(df: pd.DataFrame) -> pd.DataFrame:
+    # the columns in name order, numbers as float64 and everything else as strings (missing values as None), so the
+    # same values hash the same whatever dtypes and column order a refresh delivers them in
+    columns = {}
+    for col in sorted(df.columns):
+        values = df[col]
+        if pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+            columns[col] = values.astype(np.float64)
+        else:
+            columns[col] = values.astype(str).where(values.notna(), None)
+    return pd.DataFrame(columns, index=df.index)
+
+
+def row_hashes(df: pd.DataFrame) -> np.ndarray:
+    # a stable 64 bit hash of each row's values (pandas' hash is seeded with a fixed key), as SQLite's signed INTEGER
+    return pd.util.hash_pandas_object(normalize_values(df), index=False).to_numpy().view(np.int64)
+
+
+def upsert(cursor, table: str, df: pd.DataFrame, key_columns: Optional[List[str]] = None) -> UpsertDelta:
+    """Write the rows of df that are new or changed (by key_columns, default the primary key) and return the delta.
+    The rows go to a temp table first, which is diffed against the stored hashes and merged with one
+    INSERT ... ON CONFLICT DO UPDATE, skipping the rows whose hash did not change. Like bulk_load the upsert is left in
+    the caller's transaction."""
+    key_columns = key_columns or primary_key_columns(cursor.connection, table)
+    df = encode_date_columns(df).drop_duplicates(subset=key_columns, keep='last')
+    value_columns = [col for col in df.columns if col not in key_columns]
+    df = df.assign(**{ROW_HASH_COLUMN: row_hashes(df[value_columns])})
+    if df.empty:
+        return UpsertDelta(table, df[key_columns], df[key_columns], 0)
+
+    staging_table = f'temp."upsert_{table}"'
+    columns_str = quoted_columns(df.columns)
+    keys_join = " AND ".join(f'S."{col}" = T."{col}"' for col in key_columns)
+    cursor.execute(f'DROP TABLE IF EXISTS {staging_table}')
+    cursor.execute(f'CREATE TEMP TABLE "upsert_{table}" AS SELECT {columns_str} FROM "{table}" WHERE 0')
+    bulk_load(cursor, staging_table, df)
+
+    # the delta, before the merge changes the stored hashes. The rows stored before migration 4 have no hash yet, so
+    # their values are compared instead (the merge then stores their hash):
+    values_differ = " OR ".join(f'T."{col}" IS NOT S."{col}"' for col in value_columns) or "false"
+    df_changed = pd.read_sql_query(f"""
+        SELECT {", ".join(f'S."{col}"' for col in key_columns)}, T."{key_columns[0]}" IS NULL AS is_new
+        FROM {staging_table} as S LEFT JOIN "{table}" as T ON {keys_join}
+        WHERE T."{ROW_HASH_COLUMN}" IS NOT S."{ROW_HASH_COLUMN}"
+            AND (T."{ROW_HASH_COLUMN}" IS NOT NULL OR T."{key_columns[0]}" IS NULL OR {values_differ})
+    """, cursor.connection)
+    updates_str = ", ".join(f'"{col}" = excluded."{col}"' for col in value_columns + [ROW_HASH_COLUMN])
+    cursor.execute(f"""
+        INSERT INTO "{table}" ({columns_str}) SELECT {columns_str} FROM {staging_table} WHERE true
+        ON CONFLICT ({quoted_columns(key_columns)}) DO UPDATE SET {updates_str}
+        WHERE "{table}"."{ROW_HASH_COLUMN}" IS NOT excluded."{ROW_HASH_COLUMN}"
+    """)
+    cursor.execute(f'DROP TABLE {staging_table}')
+
+    is_new = df_changed.pop('is_new').astype(bool)
+    return UpsertDelta(table, df_changed[is_new].reset_index(drop=True), df_changed[~is_new].reset_index(drop=True),
+                       len(df) - len(df_changed))
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+# the package is imported as src.peer_comparison_tool, as the CLIs are run, from the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.peer_comparison_tool.data.aggregation_engine import synthetic_aggregation_database  # noqa: E402
+from src.peer_comparison_tool.data.db import initialize_db_connection  # noqa: E402
+
+
+@pytest.fixture
+def synthetic_db(tmp_path):
+    # a migrated database of 10 synthetic tickers in 2 sub-industries, with 4 years of daily prices and quarterly metrics
+    path = str(tmp_path / 'synthetic.db')
+    synthetic_aggregation_database(path, 10, 4, n_sub_industries=2)
+    conn = initialize_db_connection(path)
+    yield conn
+    conn.close()
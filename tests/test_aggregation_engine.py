@@ -0,0 +1,45 @@
+import pytest
+
+from src.peer_comparison_tool.data.aggregation_engine import synthetic_aggregation_database, append_trading_day, \
+    time_aggregations, time_set_based_refresh, compare_aggregates, duckdb_available
+from src.peer_comparison_tool.data.db import initialize_db_connection
+
+
+@pytest.fixture
+def database_pair(tmp_path):
+    # two copies of the same synthetic database
+    paths = [str(tmp_path / f'{name}.db') for name in ['first', 'second']]
+    for path in paths:
+        synthetic_aggregation_database(path, 10, 10, n_sub_industries=2)  # back past the leap day of 2016
+    return paths
+
+
+def assert_same_aggregates(conn, other_path):
+    assert compare_aggregates(conn, other_path) == {'ticker_ts_yoy': 0.0, 'industry_time_series': 0.0,
+                                                    'industry_time_series_yoy': 0.0, 'industry_metrics': 0.0}
+
+
+def test_windowed_refresh_matches_the_set_based_queries(database_pair):
+    windowed_path, set_based_path = database_pair
+    conn = initialize_db_connection(windowed_path)
+    time_aggregations(conn, 'sqlite')
+    append_trading_day(conn)
+    time_aggregations(conn, 'sqlite', sub_industries=[])
+    conn.close()
+    conn = initialize_db_connection(set_based_path)
+    append_trading_day(conn)
+    time_set_based_refresh(conn)
+    assert_same_aggregates(conn, windowed_path)
+    conn.close()
+
+
+@pytest.mark.skipif(not duckdb_available(), reason='duckdb is not installed')
+def test_duckdb_build_matches_sqlite(database_pair):
+    duckdb_path, sqlite_path = database_pair
+    for path, engine in [(sqlite_path, 'sqlite'), (duckdb_path, 'duckdb')]:
+        conn = initialize_db_connection(path)
+        time_aggregations(conn, engine)
+        conn.close()
+    conn = initialize_db_connection(duckdb_path)
+    assert_same_aggregates(conn, sqlite_path)
+    conn.close()
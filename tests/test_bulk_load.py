@@ -0,0 +1,48 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from src.peer_comparison_tool.data.bulk_load import bulk_load
+from src.peer_comparison_tool.data.migrations import migrate
+
+TABLE = 'ticker_time_series'
+
+
+def prices(closes, ticker='AAA'):
+    return pd.DataFrame({'ticker': ticker, 'date': range(20_000, 20_000 + len(closes)), 'close_price': closes,
+                         'close_price_indexed': closes})
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    migrate(conn)
+    yield conn
+    conn.close()
+
+
+def stored_closes(conn, ticker='AAA'):
+    return [close for close, in conn.execute(f"SELECT close_price FROM {TABLE} WHERE ticker = ? ORDER BY date",
+                                             (ticker, ))]
+
+
+@pytest.mark.parametrize('open_transaction', [False, True])
+def test_failed_load_leaves_nothing_behind(conn, open_transaction):
+    if open_transaction:
+        bulk_load(conn.cursor(), TABLE, prices([1.0], ticker='BBB'))
+    df = pd.concat([prices([1.0, 2.0, 3.0]), prices([4.0])])  # the last row repeats the first one's key
+    with pytest.raises(sqlite3.IntegrityError):
+        bulk_load(conn.cursor(), TABLE, df, chunk_rows=2)
+    conn.commit()
+    assert stored_closes(conn) == []
+    assert stored_closes(conn, 'BBB') == ([1.0] if open_transaction else [])
+
+
+@pytest.mark.parametrize('open_transaction', [False, True])
+def test_later_row_replaces_the_earlier_one(conn, open_transaction):
+    if open_transaction:
+        conn.execute("BEGIN")
+    bulk_load(conn.cursor(), TABLE, pd.concat([prices([1.0, 2.0]), prices([3.0])]), on_conflict='REPLACE')
+    conn.commit()
+    assert stored_closes(conn) == [3.0, 2.0]
@@ -0,0 +1,68 @@
+import pandas as pd
+import pytest
+
+from src.peer_comparison_tool.data.columnar import columnar_available, export_columnar_store, \
+    current_columnar_version, fetch_time_series
+from src.peer_comparison_tool.data.db import initialize_db_connection
+from src.peer_comparison_tool.data.db_utils import fetch_table_data
+from src.peer_comparison_tool.data.retention import apply_retention, RetentionPolicy
+from src.peer_comparison_tool.data.snapshot import publish_snapshot
+
+pytestmark = pytest.mark.skipif(not columnar_available(), reason='pyarrow is not installed')
+
+TABLE = 'ticker_time_series'
+KEY = ['ticker', 'date']
+
+
+def assert_store_matches_table(conn, store_dir):
+    df = fetch_time_series(conn, TABLE, store_dir).sort_values(KEY).reset_index(drop=True)
+    df_table = fetch_table_data(conn, TABLE).sort_values(KEY).reset_index(drop=True)
+    pd.testing.assert_frame_equal(df, df_table)
+
+
+def test_export_is_current_until_the_table_changes(synthetic_db, tmp_path):
+    store_dir = str(tmp_path / 'columnar')
+    export_columnar_store(synthetic_db, store_dir)
+    assert current_columnar_version(synthetic_db, store_dir, TABLE) is not None
+    assert_store_matches_table(synthetic_db, store_dir)
+    synthetic_db.execute(f"DELETE FROM {TABLE} WHERE ticker = 'T00003' AND date < 19000")
+    synthetic_db.commit()
+    assert current_columnar_version(synthetic_db, store_dir, TABLE) is None
+
+
+def test_rowid_reuse_is_a_change(synthetic_db, tmp_path):
+    store_dir = str(tmp_path / 'columnar')
+    export_columnar_store(synthetic_db, store_dir)
+    # the same number of rows deleted from the top of the table and inserted again, which reuses their rowids
+    df_top = pd.read_sql_query(f"SELECT rowid, * FROM {TABLE} ORDER BY rowid DESC LIMIT 5", synthetic_db)
+    synthetic_db.execute(f"DELETE FROM {TABLE} WHERE rowid IN ({', '.join(map(str, df_top['rowid']))})")
+    df_top = df_top.drop(columns='rowid').assign(close_price=1.0)
+    synthetic_db.executemany(f"INSERT INTO {TABLE} (ticker, date, close_price, close_price_indexed) "
+                             f"VALUES (?, ?, ?, ?)", df_top.itertuples(index=False))
+    synthetic_db.commit()
+    assert current_columnar_version(synthetic_db, store_dir, TABLE) is None
+    export_columnar_store(synthetic_db, store_dir)
+    assert_store_matches_table(synthetic_db, store_dir)
+
+
+def test_old_snapshot_is_not_current(synthetic_db, tmp_path):
+    store_dir = str(tmp_path / 'columnar')
+    export_columnar_store(synthetic_db, store_dir)
+    snapshot_conn = initialize_db_connection(publish_snapshot(synthetic_db, str(tmp_path / 'snapshots')),
+                                             read_only=True, immutable=True)
+    assert current_columnar_version(snapshot_conn, store_dir, TABLE) is not None
+    synthetic_db.execute(f"DELETE FROM {TABLE} WHERE ticker = 'T00003' AND date < 19000")
+    synthetic_db.commit()
+    export_columnar_store(synthetic_db, store_dir)
+    assert current_columnar_version(synthetic_db, store_dir, TABLE) is not None
+    assert current_columnar_version(snapshot_conn, store_dir, TABLE) is None
+    snapshot_conn.close()
+
+
+def test_export_after_retention(synthetic_db, tmp_path):
+    store_dir = str(tmp_path / 'columnar')
+    export_columnar_store(synthetic_db, store_dir)
+    apply_retention(synthetic_db, RetentionPolicy())
+    assert current_columnar_version(synthetic_db, store_dir, TABLE) is None
+    export_columnar_store(synthetic_db, store_dir)
+    assert_store_matches_table(synthetic_db, store_dir)
@@ -0,0 +1,53 @@
+import sqlite3
+
+import pytest
+
+from src.peer_comparison_tool.data import db_tables
+from src.peer_comparison_tool.data.db import initialize_db_connection
+from src.peer_comparison_tool.data.migrations import migrate, get_schema_version, MIGRATIONS
+
+
+def version_2_database():
+    conn = sqlite3.connect(':memory:', isolation_level=None)
+    migrate(conn, 2)
+    conn.execute("INSERT INTO ticker_time_series VALUES ('A', '2020-02-29', 1, 1)")
+    conn.execute("INSERT INTO ticker_time_series VALUES ('A', '2020-03-01 00:00:00', 2, 2)")
+    conn.execute("INSERT INTO ticker_time_series VALUES ('A', ?, 3, 3)", (str(18323 * 86400 * 10 ** 9), ))
+    return conn
+
+
+def test_dates_are_converted_to_epoch_days():
+    conn = version_2_database()
+    migrate(conn)
+    assert get_schema_version(conn) == len(MIGRATIONS)
+    assert conn.execute("SELECT date, close_price FROM ticker_time_series ORDER BY date").fetchall() == [
+        (18321, 1), (18322, 2), (18323, 3)]
+
+
+def test_colliding_dates_abort_the_conversion():
+    conn = version_2_database()
+    # 2020-02-29 again, as nanoseconds
+    conn.execute("INSERT INTO ticker_time_series VALUES ('A', ?, 4, 4)", (18321 * 86400 * 10 ** 9, ))
+    with pytest.raises(ValueError):
+        migrate(conn)
+    assert get_schema_version(conn) == 2
+    assert conn.execute("SELECT COUNT(*) FROM ticker_time_series").fetchone()[0] == 4
+
+
+def test_failed_migration_is_rolled_back(tmp_path, monkeypatch):
+    path = str(tmp_path / 'failed.db')
+
+    def fail(cursor):
+        raise RuntimeError("table creation failed")
+
+    conn = initialize_db_connection(path)
+    monkeypatch.setattr(db_tables, 'create_data_record_table', fail)
+    with pytest.raises(RuntimeError):
+        migrate(conn)
+    conn.close()
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall() == [('schema_version', )]
+    assert get_schema_version(conn) == 0
+    monkeypatch.undo()
+    assert migrate(conn) == len(MIGRATIONS)
+    conn.close()
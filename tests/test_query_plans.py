@@ -0,0 +1,28 @@
+import pytest
+
+from src.peer_comparison_tool.data.db_utils import build_table_query
+from src.peer_comparison_tool.data.query_plans import create_planner_database, collect_queries, explain, \
+    find_full_scans, FETCH_TABLE_DATA_CALLS
+
+QUERIES = collect_queries()
+
+
+@pytest.fixture(scope='module')
+def planner_conn():
+    conn = create_planner_database()
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize('query_name', sorted(QUERIES))
+def test_query_reads_large_tables_through_an_index(planner_conn, query_name):
+    sql = QUERIES[query_name]
+    plan = explain(planner_conn, sql, [None] * sql.count('?'))
+    assert find_full_scans(query_name, sql, plan) == [], plan
+
+
+@pytest.mark.parametrize('call', FETCH_TABLE_DATA_CALLS, ids=lambda call: call['table_name'])
+def test_fetch_table_data_reads_large_tables_through_an_index(planner_conn, call):
+    sql, params = build_table_query(planner_conn, **call)
+    plan = explain(planner_conn, sql, params)
+    assert find_full_scans(f"fetch_table_data[{call['table_name']}]", sql, plan) == [], plan
@@ -0,0 +1,50 @@
+import pandas as pd
+
+from src.peer_comparison_tool.data.bulk_load import bulk_load
+from src.peer_comparison_tool.data.db import initialize_db_connection
+from src.peer_comparison_tool.data.main import update_ticker_price_history
+from src.peer_comparison_tool.data.migrations import migrate
+from src.peer_comparison_tool.data.providers import SyntheticProvider
+
+
+class SplitProvider(SyntheticProvider):
+    # the synthetic prices, with a 2:1 split of each ticker of splits on its date when the actions are downloaded
+    def __init__(self, splits=None, **kwargs):
+        super().__init__(**kwargs)
+        self.splits = splits or {}
+
+    def download(self, tickers, rate_limiter=None, **kwargs):
+        df = super().download(tickers, rate_limiter, **kwargs)
+        if kwargs.get('actions'):
+            df_splits = pd.DataFrame(0.0, index=df.index, columns=df['Close'].columns)
+            for ticker, split_date in self.splits.items():
+                if ticker in df_splits.columns and split_date in df_splits.index:
+                    df_splits.loc[split_date, ticker] = 2.0
+            df = pd.concat({'Close': df['Close'], 'Stock Splits': df_splits}, axis=1, names=['Price'])
+        return df
+
+
+def test_split_rebuilds_the_ticker_and_its_later_aggregates(tmp_path):
+    conn = initialize_db_connection(str(tmp_path / 'split.db'))
+    migrate(conn)
+    tickers = ['AAA', 'BBB']
+    bulk_load(conn.cursor(), 'company_info', pd.DataFrame({
+        'ticker': tickers, 'name': tickers, 'sector': 'Synthetic', 'industry': 'Synthetic', 'sub_industry': 'x'}))
+    old_provider = SplitProvider(as_of=pd.Timestamp.today() - pd.Timedelta(days=20))
+    update_ticker_price_history(conn, tickers, provider=old_provider)
+    conn.commit()
+    first_dates = dict(conn.execute("SELECT ticker, MIN(date) FROM ticker_time_series GROUP BY ticker").fetchall())
+    # aggregated rows before and after the rebuilt history
+    conn.execute("INSERT INTO industry_time_series VALUES ('x', 1, 1, 1)")
+    conn.execute("INSERT INTO industry_time_series VALUES ('x', 99999, 1, 1)")
+    conn.commit()
+    split_date = pd.bdate_range(end=pd.Timestamp.today() - pd.Timedelta(days=5), periods=1)[0]
+    update_ticker_price_history(conn, tickers, provider=SplitProvider(splits={'BBB': split_date}))
+    conn.commit()
+    bounds = {ticker: (first_date, last_date) for ticker, first_date, last_date in conn.execute(
+        "SELECT ticker, MIN(date), MAX(date) FROM ticker_time_series GROUP BY ticker")}
+    assert bounds['AAA'][0] == first_dates['AAA']
+    assert bounds['BBB'][0] != first_dates['BBB']  # re-downloaded in full
+    assert bounds['AAA'][1] == bounds['BBB'][1]
+    assert conn.execute("SELECT date FROM industry_time_series").fetchall() == [(1, )]
+    conn.close()
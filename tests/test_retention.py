@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.peer_comparison_tool.data.bulk_load import bulk_load
+from src.peer_comparison_tool.data.columnar import fetch_price_history
+from src.peer_comparison_tool.data.dates import to_epoch_days
+from src.peer_comparison_tool.data.db_utils import update_ticker_yoy_aggregations, update_industry_aggregations, \
+    delete_ticker_price_history, fetch_price_history_bounds
+from src.peer_comparison_tool.data.retention import apply_retention, RetentionPolicy, price_tiers, tier_ranges, \
+    TierBounds
+
+
+def test_tier_ranges_before_the_first_run():
+    assert tier_ranges({}, 10, 20) == [('daily', 10, 20)]
+
+
+def test_tier_ranges_stitch_the_tiers_oldest_first():
+    tiers = {'daily': TierBounds(100, None), 'weekly': TierBounds(50, 97), 'monthly': TierBounds(None, 90)}
+    assert tier_ranges(tiers) == [('monthly', None, 49), ('weekly', 50, 99), ('daily', 100, None)]
+    assert tier_ranges(tiers, 60, 120) == [('weekly', 60, 99), ('daily', 100, 120)]
+    assert tier_ranges(tiers, 110) == [('daily', 110, None)]
+
+
+def test_retention_policy_keeps_a_year_of_days():
+    with pytest.raises(ValueError):
+        apply_retention(None, RetentionPolicy(daily_days=100))
+
+
+@pytest.mark.parametrize('date, end_date', [
+    (None, None), ('2022-06-01', None), ('2021-01-01', '2022-03-01'), ('2024-06-01', '2024-07-01')])
+def test_stitched_history_matches_the_daily_closes(synthetic_db, date, end_date):
+    df_full = pd.read_sql_query("SELECT date, close_price FROM ticker_time_series WHERE ticker = 'T00001'",
+                                synthetic_db).set_index('date')['close_price']
+    apply_retention(synthetic_db, RetentionPolicy())
+    assert 'daily' in price_tiers(synthetic_db, 'ticker_time_series')
+    df = fetch_price_history(synthetic_db, 'ticker_time_series', None, date=date, tickers=['T00001'],
+                             end_date=end_date)
+    days = to_epoch_days(df['date'])
+    assert len(df) > 0
+    assert np.all(np.diff(days) > 0)
+    assert np.allclose(df['close_price'].to_numpy(), df_full.loc[days].to_numpy())
+
+
+def test_first_close_survives_retention(synthetic_db):
+    first_closes = pd.read_sql_query(
+        "SELECT ticker, close_price FROM ticker_time_series t "
+        "WHERE date = (SELECT MIN(date) FROM ticker_time_series WHERE ticker = t.ticker)",
+        synthetic_db).set_index('ticker')['close_price']
+    apply_retention(synthetic_db, RetentionPolicy())
+    df_bounds = fetch_price_history_bounds(synthetic_db).set_index('ticker')
+    assert np.allclose(df_bounds['first_close'].reindex(first_closes.index), first_closes)
+
+
+def aggregate(conn):
+    update_ticker_yoy_aggregations(conn, [])
+    update_industry_aggregations(conn, [])
+    conn.commit()
+
+
+def test_rebase_after_retention_keeps_the_industry_history(synthetic_db):
+    aggregate(synthetic_db)
+    df_full = pd.read_sql_query("SELECT * FROM ticker_time_series WHERE ticker = 'T00000'", synthetic_db)
+    df_before = pd.read_sql_query("SELECT * FROM industry_time_series ORDER BY sub_industry, date", synthetic_db)
+    apply_retention(synthetic_db, RetentionPolicy())
+    # a rebase of T00000: its stored history is replaced by the full download
+    cursor = synthetic_db.cursor()
+    df_bounds = fetch_price_history_bounds(synthetic_db)
+    delete_ticker_price_history(cursor, df_bounds[df_bounds['ticker'] == 'T00000'])
+    bulk_load(cursor, 'ticker_time_series', df_full)
+    synthetic_db.commit()
+    aggregate(synthetic_db)
+    df_after = pd.read_sql_query("SELECT * FROM industry_time_series ORDER BY sub_industry, date", synthetic_db)
+    assert df_after[['sub_industry', 'date']].equals(df_before[['sub_industry', 'date']])
+    assert np.allclose(df_after['industry_close_price'], df_before['industry_close_price'])
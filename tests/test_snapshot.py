@@ -0,0 +1,39 @@
+import os
+
+from src.peer_comparison_tool.data.constants import SNAPSHOTS_KEPT
+from src.peer_comparison_tool.data.db import initialize_db_connection
+from src.peer_comparison_tool.data.snapshot import publish_snapshot, current_snapshot, list_snapshots
+
+COUNT_ROWS = "SELECT COUNT(*) FROM ticker_time_series"
+
+
+def test_publish_swaps_the_pointer(synthetic_db, tmp_path):
+    snapshot_dir = str(tmp_path / 'snapshots')
+    assert current_snapshot(snapshot_dir) is None
+    path = publish_snapshot(synthetic_db, snapshot_dir)
+    assert current_snapshot(snapshot_dir) == path
+    assert not os.path.exists(f"{path}-wal")
+
+
+def test_snapshot_is_unaffected_by_later_writes(synthetic_db, tmp_path):
+    snapshot_dir = str(tmp_path / 'snapshots')
+    n_rows = synthetic_db.execute(COUNT_ROWS).fetchone()[0]
+    snapshot_conn = initialize_db_connection(publish_snapshot(synthetic_db, snapshot_dir), read_only=True,
+                                             immutable=True)
+    synthetic_db.execute("DELETE FROM ticker_time_series WHERE ticker = 'T00000'")
+    synthetic_db.commit()
+    assert snapshot_conn.execute(COUNT_ROWS).fetchone()[0] == n_rows
+    new_conn = initialize_db_connection(publish_snapshot(synthetic_db, snapshot_dir), read_only=True,
+                                        immutable=True)
+    assert new_conn.execute(COUNT_ROWS).fetchone()[0] < n_rows
+    snapshot_conn.close()
+    new_conn.close()
+
+
+def test_old_snapshots_are_pruned(synthetic_db, tmp_path):
+    snapshot_dir = str(tmp_path / 'snapshots')
+    for _ in range(SNAPSHOTS_KEPT + 2):
+        path = publish_snapshot(synthetic_db, snapshot_dir)
+    snapshots = list_snapshots(snapshot_dir)
+    assert len(snapshots) == SNAPSHOTS_KEPT
+    assert os.path.join(snapshot_dir, snapshots[-1]) == path
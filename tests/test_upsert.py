@@ -0,0 +1,48 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from src.peer_comparison_tool.data.migrations import migrate
+from src.peer_comparison_tool.data.upsert import upsert, row_hashes
+
+TABLE = 'quarterly_financial_data'
+
+
+def quarters(basic_eps=(1, 2)):
+    return pd.DataFrame({'ticker': 'AAA', 'date': ['2024-03-31', '2024-06-30'],
+                         'quarter_reporting': ['2024_1', '2024_2'], 'Basic EPS': list(basic_eps), 'Net Income': [None, 5.0]})
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    migrate(conn)
+    yield conn
+    conn.close()
+
+
+def test_hash_ignores_dtypes_and_column_order():
+    df = quarters()
+    df_float = df.astype({'Basic EPS': float})[df.columns[::-1]]
+    assert (row_hashes(df) == row_hashes(df_float)).all()
+
+
+def test_unchanged_refresh_reports_no_updates(conn):
+    delta = upsert(conn.cursor(), TABLE, quarters())
+    assert len(delta.inserted) == 2
+    # the same values again, as floats and in another column order
+    df = quarters().astype({'Basic EPS': float})
+    delta = upsert(conn.cursor(), TABLE, df[df.columns[::-1]])
+    assert (len(delta.inserted), len(delta.updated), delta.unchanged) == (0, 0, 2)
+    delta = upsert(conn.cursor(), TABLE, quarters(basic_eps=(1, 3)))
+    assert list(delta.updated['date']) == [19904]
+
+
+def test_rows_without_a_hash_are_compared_by_value(conn):
+    # rows stored before the hashes were added
+    upsert(conn.cursor(), TABLE, quarters())
+    conn.execute(f"UPDATE {TABLE} SET row_hash = NULL")
+    delta = upsert(conn.cursor(), TABLE, quarters(basic_eps=(1, 3)))
+    assert (len(delta.inserted), len(delta.updated), delta.unchanged) == (0, 1, 1)
+    assert conn.execute(f"SELECT COUNT(*) FROM {TABLE} WHERE row_hash IS NULL").fetchone()[0] == 0